@@ -0,0 +1,56 @@
+"""add_sidebar_order_indexes
+
+Revision ID: 5b88dbd27eb0
+Revises: a3d7e5c91b64
+Create Date: 2026-10-18 09:41:17.226093
+
+"""
+from typing import Sequence, Union
+from pendulum import Timezone
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '5b88dbd27eb0'
+down_revision: Union[str, Sequence[str], None] = 'a3d7e5c91b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built concurrently so writes to large tables are not blocked meanwhile;
+    # Postgres cannot do that inside a transaction. If a build fails it
+    # leaves an invalid index behind, which must be dropped before retrying.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_diagram_repository_order',
+            'diagram',
+            ['repository_id', 'order_index', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_repository_order_index',
+            'repository',
+            ['order_index', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_repository_order_index',
+            table_name='repository',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_diagram_repository_order',
+            table_name='diagram',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,112 @@
+"""store_diagram_content_in_blobs
+
+Revision ID: 8f3b2d6c1a90
+Revises: 642264973502
+Create Date: 2026-10-17 14:03:52.118406
+
+"""
+from typing import Sequence, Union
+from pendulum import Timezone
+import hashlib
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3b2d6c1a90'
+down_revision: Union[str, Sequence[str], None] = '642264973502'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 100
+
+diagram = sa.table(
+    'diagram',
+    sa.column('id', sa.Integer()),
+    sa.column('content', sa.String()),
+    sa.column('content_digest', sa.String()),
+)
+diagramblob = sa.table(
+    'diagramblob',
+    sa.column('digest', sa.String()),
+    sa.column('codec', sa.String()),
+    sa.column('size', sa.Integer()),
+    sa.column('data', sa.LargeBinary()),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('diagramblob',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('codec', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('digest')
+    )
+    with op.batch_alter_table('diagram', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_digest', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+    # Move existing bodies into the blob table, a batch of rows at a time
+    conn = op.get_bind()
+    stored = set()
+    ids = conn.execute(sa.select(diagram.c.id).order_by(diagram.c.id)).scalars().all()
+    for start in range(0, len(ids), BATCH_SIZE):
+        rows = conn.execute(
+            sa.select(diagram.c.id, diagram.c.content).where(
+                diagram.c.id.in_(ids[start:start + BATCH_SIZE])
+            )
+        ).all()
+        for row in rows:
+            raw = (row.content or '').encode('utf-8')
+            digest = hashlib.sha256(raw).hexdigest()
+            if digest not in stored:
+                conn.execute(
+                    diagramblob.insert().values(
+                        digest=digest, codec='zlib', size=len(raw), data=zlib.compress(raw, 6)
+                    )
+                )
+                stored.add(digest)
+            conn.execute(
+                diagram.update().where(diagram.c.id == row.id).values(content_digest=digest)
+            )
+
+    with op.batch_alter_table('diagram', schema=None) as batch_op:
+        batch_op.alter_column('content_digest', existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=False)
+        batch_op.create_foreign_key('diagram_content_digest_fkey', 'diagramblob', ['content_digest'], ['digest'])
+        batch_op.drop_column('content')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('diagram', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+    conn = op.get_bind()
+    blobs = conn.execute(sa.select(diagramblob.c.digest, diagramblob.c.codec)).all()
+    for blob in blobs:
+        data = conn.execute(
+            sa.select(diagramblob.c.data).where(diagramblob.c.digest == blob.digest)
+        ).scalar_one()
+        if blob.codec == 'zstd':
+            import zstandard
+
+            raw = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            raw = zlib.decompress(data)
+        conn.execute(
+            diagram.update()
+            .where(diagram.c.content_digest == blob.digest)
+            .values(content=raw.decode('utf-8'))
+        )
+
+    with op.batch_alter_table('diagram', schema=None) as batch_op:
+        batch_op.alter_column('content', existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=False)
+        batch_op.drop_constraint('diagram_content_digest_fkey', type_='foreignkey')
+        batch_op.drop_column('content_digest')
+
+    op.drop_table('diagramblob')
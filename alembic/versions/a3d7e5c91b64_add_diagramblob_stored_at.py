@@ -0,0 +1,33 @@
+"""add_diagramblob_stored_at
+
+Revision ID: a3d7e5c91b64
+Revises: d4a8e1f63b27
+Create Date: 2026-10-17 22:14:05.318442
+
+"""
+from typing import Sequence, Union
+from pendulum import Timezone
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d7e5c91b64'
+down_revision: Union[str, Sequence[str], None] = 'd4a8e1f63b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('diagramblob', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stored_at', sa.DateTime(timezone=True), nullable=True))
+    # Existing orphans are swept once blob_orphan_ttl has passed from here
+    op.execute('UPDATE diagramblob SET stored_at = CURRENT_TIMESTAMP')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('diagramblob', schema=None) as batch_op:
+        batch_op.drop_column('stored_at')
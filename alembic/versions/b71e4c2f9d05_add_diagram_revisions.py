@@ -0,0 +1,40 @@
+"""add_diagram_revisions
+
+Revision ID: b71e4c2f9d05
+Revises: 8f3b2d6c1a90
+Create Date: 2026-10-17 16:41:07.582930
+
+"""
+from typing import Sequence, Union
+from pendulum import Timezone
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71e4c2f9d05'
+down_revision: Union[str, Sequence[str], None] = '8f3b2d6c1a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('diagramrevision',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('diagram_id', sa.Integer(), nullable=False),
+    sa.Column('number', sa.Integer(), nullable=False),
+    sa.Column('snapshot', sa.Boolean(), nullable=False),
+    sa.Column('author', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('codec', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('diagram_id', 'number', name='unique_diagram_revision')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('diagramrevision')
@@ -0,0 +1,151 @@
+"""add_diagram_search
+
+Revision ID: d4a8e1f63b27
+Revises: b71e4c2f9d05
+Create Date: 2026-10-17 18:12:36.904417
+
+"""
+from typing import Sequence, Union
+from pendulum import Timezone
+import html
+import re
+import xml.etree.ElementTree as ET
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a8e1f63b27'
+down_revision: Union[str, Sequence[str], None] = 'b71e4c2f9d05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 100
+
+diagram = sa.table(
+    'diagram',
+    sa.column('id', sa.Integer()),
+    sa.column('repository_id', sa.Integer()),
+    sa.column('name', sa.String()),
+    sa.column('diagram_type', sa.String()),
+    sa.column('notes', sa.String()),
+    sa.column('content_digest', sa.String()),
+)
+diagramblob = sa.table(
+    'diagramblob',
+    sa.column('digest', sa.String()),
+    sa.column('codec', sa.String()),
+    sa.column('data', sa.LargeBinary()),
+)
+diagramsearch = sa.table(
+    'diagramsearch',
+    sa.column('diagram_id', sa.Integer()),
+    sa.column('repository_id', sa.Integer()),
+    sa.column('name', sa.String()),
+    sa.column('document', sa.String()),
+)
+
+
+# Frozen copy of designrepo.search as of this revision, so later changes to
+# the application's extraction or index expression cannot change what this
+# migration does
+VECTOR_SQL = (
+    "(setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', document), 'B'))"
+)
+MAX_DOCUMENT_LENGTH = 100_000
+_WORD = re.compile(r'\w[\w.-]*')
+_TAG = re.compile(r'<[^>]+>')
+_SKIP_LINE = re.compile(r"^\s*(@|!|'|%%|skinparam\b|style\b|classDef\b)")
+
+
+def _extract_labels(diagram_type, content):
+    if diagram_type == 'drawio':
+        try:
+            root = ET.fromstring(content)
+        except ET.ParseError:
+            root = None
+        if root is not None:
+            labels = []
+            for element in root.iter():
+                for attr in ('name', 'value', 'label'):
+                    value = element.get(attr)
+                    if value and (attr != 'name' or element.tag == 'diagram'):
+                        labels.append(html.unescape(_TAG.sub(' ', value)))
+            return ' '.join(' '.join(labels).split())
+    return ' '.join(
+        ' '.join(_WORD.findall(line))
+        for line in content.splitlines()
+        if not _SKIP_LINE.match(line)
+    )
+
+
+def _document(diagram_type, content, notes):
+    text = f'{notes}\n{_extract_labels(diagram_type, content)}'
+    return text[:MAX_DOCUMENT_LENGTH]
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('diagramsearch',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('diagram_id', sa.Integer(), nullable=False),
+    sa.Column('repository_id', sa.Integer(), nullable=False),
+    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('document', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('diagram_id')
+    )
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute(
+            f'CREATE INDEX ix_diagramsearch_vector ON diagramsearch USING gin ({VECTOR_SQL})'
+        )
+        op.execute(
+            'CREATE INDEX ix_diagramsearch_name_trgm ON diagramsearch USING gin (name gin_trgm_ops)'
+        )
+
+    # Index existing diagrams, a batch of rows at a time
+    conn = op.get_bind()
+    ids = conn.execute(sa.select(diagram.c.id).order_by(diagram.c.id)).scalars().all()
+    for start in range(0, len(ids), BATCH_SIZE):
+        rows = conn.execute(
+            sa.select(
+                diagram.c.id,
+                diagram.c.repository_id,
+                diagram.c.name,
+                diagram.c.diagram_type,
+                diagram.c.notes,
+                diagramblob.c.codec,
+                diagramblob.c.data,
+            )
+            .join(diagramblob, diagramblob.c.digest == diagram.c.content_digest)
+            .where(diagram.c.id.in_(ids[start:start + BATCH_SIZE]))
+        ).all()
+        for row in rows:
+            content = _decompress(row.codec, row.data).decode('utf-8')
+            conn.execute(
+                diagramsearch.insert().values(
+                    diagram_id=row.id,
+                    repository_id=row.repository_id,
+                    name=row.name,
+                    document=_document(row.diagram_type, content, row.notes or ''),
+                )
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP INDEX IF EXISTS ix_diagramsearch_name_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_diagramsearch_vector')
+    op.drop_table('diagramsearch')
@@ -0,0 +1,158 @@
+"""Process-wide OpenAI client with a shared HTTP connection pool.
+
+Completions run on the job queue and finished ones are cached for
+ai_cache_ttl seconds, keyed on the model, the system message and a hash
+of the rest of the conversation. Re-running a prompt against unchanged
+content is then answered without another upstream call, and identical
+requests in flight share one call.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletionChunk
+
+from . import jobs
+from .settings import settings
+
+MODEL = "gpt-4o"
+
+_client: Optional[openai.AsyncOpenAI] = None
+
+
+def get_client() -> openai.AsyncOpenAI:
+    """Return the shared AsyncOpenAI client, creating it on first use.
+
+    Reusing one client keeps TLS connections alive between requests instead
+    of paying connection setup on every AI call.
+    """
+    global _client
+    if _client is None:
+        timeout = httpx.Timeout(
+            settings.openai_timeout, connect=settings.openai_connect_timeout
+        )
+        http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+                keepalive_expiry=settings.openai_keepalive_expiry,
+            ),
+        )
+        _client = openai.AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+            timeout=timeout,
+            max_retries=settings.openai_max_retries,
+            http_client=http_client,
+        )
+    return _client
+
+
+class CompletionCache:
+    """Least recently used completions, each kept for at most ttl seconds."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Requests answered by joining an identical call in flight
+        self.coalesced = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, text: str):
+        self._entries[key] = (time.monotonic(), text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+cache = CompletionCache(settings.ai_cache_ttl, settings.ai_cache_size)
+
+
+def completion_key(messages: List[dict]) -> Tuple[str, str, str]:
+    """(model, system message, hash of the other messages) of a request."""
+    system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    others = [m for m in messages if m["role"] != "system"]
+    digest = hashlib.sha256(json.dumps(others).encode("utf-8")).hexdigest()
+    return MODEL, system, digest
+
+
+async def _complete(job: jobs.Job, messages: List[dict]) -> str:
+    # The SDK's stream stops reading at the "[DONE]" event and then closes
+    # the response before the end of the body arrives, which drops the
+    # connection instead of returning it to the pool. Read the events
+    # ourselves, to the end of the body.
+    content = ""
+    async with get_client().chat.completions.with_streaming_response.create(
+        model=MODEL,
+        messages=messages,
+        stream=True,
+    ) as response:
+        async for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:") :].strip()
+            if data == "[DONE]":
+                continue
+            payload = json.loads(data)
+            if payload.get("error"):
+                raise openai.APIError(
+                    str(payload["error"].get("message", "AI stream failed")),
+                    request=response.http_request,
+                    body=payload["error"],
+                )
+            chunk = ChatCompletionChunk.model_validate(payload)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            content += chunk.choices[0].delta.content
+            job.report(content)
+    # Only complete answers are cached, never cancelled or failed ones
+    cache.put(job.key[1:], content)
+    return content
+
+
+def submit_completion(messages: List[dict]) -> jobs.Job:
+    """Queue a streamed chat completion as an interactive job.
+
+    The job reports the text generated so far as its progress and returns
+    the full text. A cached completion is returned as a finished job.
+    """
+    key = completion_key(messages)
+    text = cache.get(key)
+    if text is not None:
+        cache.hits += 1
+        return jobs.completed(("completion", *key), text)
+    if jobs.completions.get(("completion", *key)) is not None:
+        cache.coalesced += 1
+    else:
+        cache.misses += 1
+    return jobs.completions.submit(
+        ("completion", *key),
+        lambda job: _complete(job, messages),
+        priority=jobs.INTERACTIVE,
+    )
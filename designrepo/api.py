@@ -0,0 +1,176 @@
+import asyncio
+
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from sqlalchemy.exc import NoResultFound
+import reflex as rx
+from . import ai, auth, blobs, drawio, render, thumbnails
+from .models import User
+from .settings import settings
+
+api = FastAPI()
+
+# Private: these responses are only for logged in users, so shared caches
+# must not hand them to anyone else
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Rendered SVGs and draw.io documents come from user-supplied sources and are
+# served from the app's own origin, so browsers must not run any script in
+# them or sniff them into another type
+UNTRUSTED_CONTENT_HEADERS = {
+    "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'",
+    "X-Content-Type-Options": "nosniff",
+}
+
+
+async def require_user(request: Request):
+    """Refuse requests without a valid session token, as page loads do."""
+    if not settings.oidc_issuer:
+        # Without OIDC every visitor is the local user
+        return
+    token = request.cookies.get(auth.SESSION_COOKIE, "")
+    profile, fresh = auth.load_session_token(token) if token else (None, False)
+    if profile is not None and not fresh:
+        # Expired; still accepted while the user exists, as State.on_load does
+        async with rx.asession() as session:
+            user = (
+                await session.exec(User.select().where(User.sub == profile["sub"]))
+            ).first()
+        if user is None:
+            profile = None
+    if profile is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+
+
+@api.post("/upload/drawio", dependencies=[Depends(require_user)])
+async def upload_drawio(request: Request):
+    """Store an uploaded draw.io document as a diagram blob.
+
+    The request body is the file itself. It is read as it arrives and
+    refused as soon as it passes upload_max_bytes. Returns the digest the
+    editor loads the document by.
+    """
+    limit = settings.upload_max_bytes
+    length = request.headers.get("content-length", "")
+    try:
+        if length.isdigit():
+            drawio.check_size(int(length), limit)
+        data = await drawio.read_stream(request.stream(), limit)
+        xml = await asyncio.to_thread(drawio.inflate, data, limit)
+    except drawio.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except drawio.DrawioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    async with rx.asession() as session:
+        digest = await blobs.put_encoded(session, xml)
+        await session.commit()
+    return {"digest": digest}
+
+
+@api.get("/render/digest/{diagram_type}/{digest}", dependencies=[Depends(require_user)])
+async def render_digest(diagram_type: str, digest: str, request: Request):
+    """Render a diagram whose source was too long to encode in the URL."""
+    if diagram_type not in render.RENDERABLE_TYPES or not blobs.is_digest(digest):
+        raise HTTPException(status_code=404, detail="Unknown diagram")
+    async with rx.asession() as session:
+        try:
+            content = await blobs.get(session, digest)
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Unknown diagram")
+    return await _render_response(diagram_type, content, request)
+
+
+@api.get("/render/{diagram_type}/{encoded}", dependencies=[Depends(require_user)])
+async def render_diagram(diagram_type: str, encoded: str, request: Request):
+    """Render a PlantUML or Mermaid diagram encoded in the URL to SVG."""
+    if diagram_type not in render.RENDERABLE_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown diagram type")
+    try:
+        content = render.decode_source(diagram_type, encoded)
+    except render.RenderError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await _render_response(diagram_type, content, request)
+
+
+@api.get("/source/{digest}")
+async def diagram_source(digest: str, token: str = ""):
+    """Serve a stored draw.io document to the diagrams.net viewer.
+
+    The viewer sends no session cookie, so the URL from
+    render.drawio_viewer_url carries a token for this document instead.
+    """
+    if not blobs.is_digest(digest):
+        raise HTTPException(status_code=404, detail="Unknown diagram")
+    if settings.oidc_issuer and not auth.check_source_token(token, digest):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    async with rx.asession() as session:
+        try:
+            content = await blobs.get(session, digest)
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Unknown diagram")
+    # The viewer runs on another origin and fetches the document itself
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Access-Control-Allow-Origin": render.DRAWIO_VIEWER_ORIGIN,
+        **UNTRUSTED_CONTENT_HEADERS,
+    }
+    return Response(content=content, media_type="application/xml", headers=headers)
+
+
+@api.get("/thumbnail/{diagram_type}/{digest}", dependencies=[Depends(require_user)])
+async def diagram_thumbnail(diagram_type: str, digest: str):
+    """Serve the thumbnail of a diagram body, or a placeholder until it exists."""
+    if not thumbnails.is_valid(diagram_type, digest):
+        raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    thumbnail = thumbnails.get(diagram_type, digest)
+    if thumbnail is not None:
+        data, fmt = thumbnail
+        if fmt == "svg":
+            # The render failed; the thumbnail may appear once it is retried
+            cache_control = f"max-age={int(settings.thumbnail_retry_seconds)}"
+        else:
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        return Response(
+            content=data,
+            media_type=thumbnails.MEDIA_TYPES[fmt],
+            headers={"Cache-Control": cache_control},
+        )
+
+    # Not rendered yet, e.g. saved before thumbnails existed
+    async with rx.asession() as session:
+        try:
+            content = await blobs.get(session, digest)
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    if content.strip():
+        thumbnails.schedule(diagram_type, content, digest)
+        cache_control = "no-store"
+    else:
+        # A blank diagram never gets a thumbnail, so keep the placeholder
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    return Response(
+        content=thumbnails.PLACEHOLDER_SVG,
+        media_type="image/svg+xml",
+        headers={"Cache-Control": cache_control},
+    )
+
+
+@api.get("/ai/cache")
+async def ai_cache_stats():
+    """Size and hit/miss counters of the AI completion cache."""
+    return ai.cache.stats()
+
+
+async def _render_response(diagram_type: str, content: str, request: Request):
+    etag = f'"{render.diagram_digest(diagram_type, content)}"'
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "ETag": etag,
+        **UNTRUSTED_CONTENT_HEADERS,
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        svg = await render.render_svg(diagram_type, content)
+    except render.RenderError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return Response(content=svg, media_type="image/svg+xml", headers=headers)
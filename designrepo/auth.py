@@ -0,0 +1,75 @@
+"""Signed, expiring session tokens carrying the user profile.
+
+A valid token is enough to authenticate a page load without touching the
+database; the users table is only consulted again once the token expires.
+
+Stored diagram bodies are also handed to the diagrams.net viewer, which
+runs on another site and so never sends the session cookie, through URLs
+carrying a signed token for that one body.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from .settings import settings
+
+SESSION_SALT = "designrepo-session"
+SOURCE_SALT = "designrepo-source"
+# Cookie holding the session token, sent with page loads and backend requests
+SESSION_COOKIE = "designrepo_session"
+
+
+class SessionSecretError(RuntimeError):
+    """Raised when session tokens are used without a signing key."""
+
+
+def _serializer(salt: str = SESSION_SALT) -> URLSafeTimedSerializer:
+    # Fall back to the OIDC client secret so existing deployments keep working
+    secret = settings.session_secret or settings.oidc_client_secret
+    if not secret:
+        # Settings refuse this when OIDC is enabled; never sign with an
+        # empty key even if the settings were changed at runtime
+        raise SessionSecretError("No session secret is configured")
+    return URLSafeTimedSerializer(secret, salt=salt)
+
+
+def issue_session_token(profile: Dict[str, Any]) -> str:
+    """Sign a user profile into a session token."""
+    return _serializer().dumps(profile)
+
+
+def load_session_token(token: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Verify a session token.
+
+    Returns (profile, fresh). profile is None if the token is forged or
+    malformed. fresh is False if the signature is valid but the token is
+    older than session_max_age, in which case the caller should re-check
+    the user against the database before trusting the profile.
+    """
+    serializer = _serializer()
+    try:
+        return serializer.loads(token, max_age=settings.session_max_age), True
+    except SignatureExpired as e:
+        try:
+            return serializer.load_payload(e.payload), False
+        except BadSignature:
+            return None, False
+    except BadSignature:
+        return None, False
+
+
+def issue_source_token(digest: str) -> str:
+    """Sign a token granting read access to the diagram body digest."""
+    return _serializer(SOURCE_SALT).dumps(digest)
+
+
+def check_source_token(token: str, digest: str) -> bool:
+    """Whether token was issued for digest within source_token_max_age."""
+    try:
+        signed = _serializer(SOURCE_SALT).loads(
+            token, max_age=settings.source_token_max_age
+        )
+    except BadSignature:
+        return False
+    return signed == digest
@@ -0,0 +1,142 @@
+"""Compressed, content-addressed storage for diagram bodies.
+
+Each distinct body is stored once in the diagramblob table, keyed by the
+SHA-256 of its text, and diagrams reference it by digest. Bodies are
+compressed with zlib, or with zstd when blob_codec is "zstd" and the
+zstandard package is installed. The codec is recorded per blob, so
+changing it only affects newly written bodies.
+
+Bodies are also stored before anything references them, e.g. draw.io
+uploads that have not been saved yet. sweep removes those once no diagram
+has referenced them for blob_orphan_ttl.
+"""
+
+import asyncio
+import hashlib
+import re
+import zlib
+from datetime import datetime, timedelta
+from typing import Tuple
+
+import pendulum
+import reflex as rx
+from sqlalchemy import delete, exists, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .models import Diagram, DiagramBlob
+from .settings import settings
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional
+    zstandard = None
+
+# Bodies larger than this are (de)compressed off the event loop
+THREAD_THRESHOLD = 256 * 1024
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def is_digest(value: str) -> bool:
+    """Whether value has the form of a content digest."""
+    return bool(_DIGEST.match(value))
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=settings.blob_level).compress(data)
+    return zlib.compress(data, settings.blob_level)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd diagram bodies")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+async def _run(func, *args):
+    if len(args[-1]) > THREAD_THRESHOLD:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+async def compress(data: bytes) -> Tuple[str, bytes]:
+    """Compress data with the configured codec; returns (codec, data)."""
+    codec = settings.blob_codec
+    if codec == "zstd" and zstandard is None:
+        codec = "zlib"
+    return codec, await _run(_compress, codec, data)
+
+
+async def decompress(codec: str, data: bytes) -> bytes:
+    return await _run(_decompress, codec, data)
+
+
+async def put(session: AsyncSession, content: str) -> str:
+    """Store a diagram body if it is not stored yet and return its digest.
+
+    The insert is part of the caller's transaction. Storing a body again
+    refreshes its stored_at, which keeps sweep from removing it while a
+    diagram is about to reference it.
+    """
+    return await put_encoded(session, content.encode("utf-8"))
+
+
+async def put_encoded(session: AsyncSession, raw: bytes) -> str:
+    """Like put, for a body that is already UTF-8 encoded."""
+    digest = hashlib.sha256(raw).hexdigest()
+    codec, data = await compress(raw)
+    now = datetime.now(tz=pendulum.local_timezone())
+    dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+    await session.execute(
+        dialect.insert(DiagramBlob)
+        .values(digest=digest, codec=codec, size=len(raw), data=data, stored_at=now)
+        .on_conflict_do_update(index_elements=["digest"], set_={"stored_at": now})
+    )
+    return digest
+
+
+async def get(session: AsyncSession, digest: str) -> str:
+    """Return the diagram body stored under digest."""
+    blob = (
+        await session.exec(select(DiagramBlob).where(DiagramBlob.digest == digest))
+    ).one()
+    return (await decompress(blob.codec, blob.data)).decode("utf-8")
+
+
+async def prune(session: AsyncSession, before: datetime) -> int:
+    """Delete blobs stored before before that no diagram references.
+
+    Blobs without stored_at predate it and count as old.
+    """
+    result = await session.execute(
+        delete(DiagramBlob).where(
+            or_(DiagramBlob.stored_at.is_(None), DiagramBlob.stored_at < before),
+            ~exists().where(Diagram.content_digest == DiagramBlob.digest),
+        )
+    )
+    return result.rowcount
+
+
+async def sweep():
+    """Lifespan task that prunes unreferenced blobs every blob_sweep_interval."""
+    while True:
+        before = datetime.now(tz=pendulum.local_timezone()) - timedelta(
+            seconds=settings.blob_orphan_ttl
+        )
+        try:
+            async with rx.asession() as session:
+                await prune(session, before)
+                await session.commit()
+        except (OSError, SQLAlchemyError):
+            pass  # Tried again on the next sweep
+        await asyncio.sleep(settings.blob_sweep_interval)
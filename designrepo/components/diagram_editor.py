@@ -1,6 +1,129 @@
 import reflex as rx
+from reflex.components.core.upload import upload_files_context_var_data
+from reflex.vars import VarData
+from ..settings import settings
 from ..state import State
 
+# Large documents are synced to the backend at most this often while typing,
+# and always when the editor loses focus.
+EDITOR_DEBOUNCE_MS = 500
+
+
+def stop_generation_button():
+    return rx.button(
+        rx.icon("square", size=16),
+        "Stop",
+        on_click=State.cancel_generation,
+        variant="soft",
+        color_scheme="red",
+        position="absolute",
+        top="12px",
+        right="12px",
+        z_index="10",
+        cursor="pointer",
+    )
+
+
+def upload_drawio():
+    """Post the file selected in the draw.io upload straight to the backend.
+
+    The file is sent as the request body, so the backend reads it as it
+    arrives; State.load_upload then loads the stored document by digest.
+    """
+    url = State.drawio_upload_url
+    script = rx.Var(
+        _js_expr=f"""(async () => {{
+    const file = (filesById["drawio_upload"] || [])[0];
+    if (!file) return {{ error: "no file selected" }};
+    try {{
+        const resp = await fetch({url!s}, {{
+            method: "POST",
+            body: file,
+            credentials: "include",
+            headers: {{ "Content-Type": "application/xml" }},
+        }});
+        const body = await resp.json();
+        return resp.ok
+            ? {{ digest: body.digest, name: file.name }}
+            : {{ error: body.detail, name: file.name }};
+    }} catch (e) {{
+        return {{ error: String(e), name: file.name }};
+    }}
+}})()""",
+        _var_data=VarData.merge(upload_files_context_var_data, url._get_all_var_data()),
+    )
+    return rx.run_script(script, callback=State.load_upload)
+
+
+def revision_row(revision):
+    return rx.hstack(
+        rx.text(f"#{revision.number}", size="2", weight="bold"),
+        rx.text(revision.author, size="2", color_scheme="gray"),
+        rx.spacer(),
+        rx.text(revision.created_at, size="1", color_scheme="gray"),
+        rx.dialog.close(
+            rx.button(
+                "Restore",
+                on_click=State.restore_revision(revision.number),
+                variant="soft",
+                size="1",
+            ),
+        ),
+        width="100%",
+        align_items="center",
+    )
+
+
+def revision_history():
+    return rx.dialog.root(
+        rx.dialog.trigger(
+            rx.button(
+                rx.icon("history"),
+                "History",
+                on_click=State.load_revisions,
+                size="3",
+                variant="soft",
+                color_scheme="gray",
+            ),
+        ),
+        rx.dialog.content(
+            rx.vstack(
+                rx.dialog.title("Revision History"),
+                rx.dialog.description(
+                    "Restoring a revision loads it into the editor; save to keep it."
+                ),
+                rx.scroll_area(
+                    rx.vstack(
+                        rx.foreach(State.revisions, revision_row),
+                        rx.cond(
+                            State.has_more_revisions,
+                            rx.button(
+                                "Load more",
+                                on_click=State.load_more_revisions,
+                                variant="ghost",
+                                size="1",
+                                width="100%",
+                            ),
+                        ),
+                        width="100%",
+                        spacing="2",
+                    ),
+                    type="auto",
+                    scrollbars="vertical",
+                    style={"max-height": "400px"},
+                ),
+                rx.hstack(
+                    rx.spacer(),
+                    rx.dialog.close(
+                        rx.button("Close", variant="soft", color_scheme="gray"),
+                    ),
+                    width="100%",
+                ),
+                spacing="4",
+            ),
+        ),
+    )
+
 
 def diagram_editor():
     return rx.card(
@@ -71,6 +194,7 @@ def diagram_editor():
                             spacing="3",
                         ),
                         id="drawio_upload",
+                        max_size=settings.upload_max_bytes,
                         border=f"1px dashed {rx.color('gray', 5)}",
                         padding="8",
                         border_radius="md",
@@ -79,9 +203,7 @@ def diagram_editor():
                     ),
                     rx.button(
                         "Upload Draw.io",
-                        on_click=State.handle_upload(
-                            rx.upload_files(upload_id="drawio_upload")
-                        ),
+                        on_click=upload_drawio(),
                         width="100%",
                         variant="soft",
                         size="2",
@@ -99,69 +221,77 @@ def diagram_editor():
                             margin_bottom="2",
                         ),
                         rx.box(
-                            rx.text_area(
-                                value=State.diagram_content,
-                                on_change=State.set_diagram_content,
-                                placeholder="Enter diagram code here...",
-                                height="400px",
-                                width="100%",
-                                variant="surface",
-                                style={
-                                    "font-family": "monospace",
-                                    "font-size": "13px",
-                                    "padding": "12px",
-                                },
-                            ),
-                            rx.dialog.root(
-                                rx.dialog.trigger(
-                                    rx.button(
-                                        rx.icon("sparkles", size=16),
-                                        variant="soft",
-                                        color_scheme="amber",
-                                        position="absolute",
-                                        top="12px",
-                                        right="12px",
-                                        z_index="10",
-                                        cursor="pointer",
-                                    ),
+                            rx.debounce_input(
+                                rx.text_area(
+                                    value=State.diagram_content,
+                                    on_change=State.set_diagram_content,
+                                    placeholder="Enter diagram code here...",
+                                    height="400px",
+                                    width="100%",
+                                    variant="surface",
+                                    style={
+                                        "font-family": "monospace",
+                                        "font-size": "13px",
+                                        "padding": "12px",
+                                    },
                                 ),
-                                rx.dialog.content(
-                                    rx.vstack(
-                                        rx.dialog.title("AI Assistant"),
-                                        rx.dialog.description(
-                                            "Provide a prompt instruction to update or generate the diagram code."
-                                        ),
-                                        rx.text_area(
-                                            value=State.ai_prompt,
-                                            on_change=State.set_ai_prompt,
-                                            placeholder="e.g., Add a new component called 'Database'...",
-                                            width="100%",
-                                            height="150px",
+                                debounce_timeout=EDITOR_DEBOUNCE_MS,
+                                force_notify_on_blur=True,
+                            ),
+                            rx.cond(
+                                State.is_loading,
+                                stop_generation_button(),
+                                rx.dialog.root(
+                                    rx.dialog.trigger(
+                                        rx.button(
+                                            rx.icon("sparkles", size=16),
+                                            variant="soft",
+                                            color_scheme="amber",
+                                            position="absolute",
+                                            top="12px",
+                                            right="12px",
+                                            z_index="10",
+                                            cursor="pointer",
                                         ),
-                                        rx.hstack(
-                                            rx.dialog.close(
+                                    ),
+                                    rx.dialog.content(
+                                        rx.vstack(
+                                            rx.dialog.title("AI Assistant"),
+                                            rx.dialog.description(
+                                                "Provide a prompt instruction to update or generate the diagram code."
+                                            ),
+                                            rx.text_area(
+                                                value=State.ai_prompt,
+                                                on_change=State.set_ai_prompt,
+                                                placeholder="e.g., Add a new component called 'Database'...",
+                                                width="100%",
+                                                height="150px",
+                                            ),
+                                            rx.hstack(
+                                                rx.dialog.close(
+                                                    rx.button(
+                                                        "Cancel",
+                                                        variant="soft",
+                                                        color_scheme="gray",
+                                                    ),
+                                                ),
+                                                rx.spacer(),
                                                 rx.button(
-                                                    "Cancel",
-                                                    variant="soft",
-                                                    color_scheme="gray",
+                                                    "Generate",
+                                                    on_click=State.generate_diagram,
+                                                    is_loading=State.is_loading,
+                                                    variant="solid",
+                                                    color_scheme="indigo",
                                                 ),
+                                                width="100%",
+                                                padding_top="4",
                                             ),
-                                            rx.spacer(),
-                                            rx.button(
-                                                "Generate",
-                                                on_click=State.generate_diagram,
-                                                is_loading=State.is_loading,
-                                                variant="solid",
-                                                color_scheme="indigo",
-                                            ),
-                                            width="100%",
-                                            padding_top="4",
+                                            spacing="4",
                                         ),
-                                        spacing="4",
                                     ),
+                                    open=State.show_ai_modal,
+                                    on_open_change=State.set_show_ai_modal,
                                 ),
-                                open=State.show_ai_modal,
-                                on_open_change=State.set_show_ai_modal,
                             ),
                             position="relative",
                             width="100%",
@@ -177,75 +307,83 @@ def diagram_editor():
                     "Notes (Markdown)", size="2", weight="medium", color_scheme="gray"
                 ),
                 rx.box(
-                    rx.text_area(
-                        value=State.diagram_notes,
-                        on_change=State.set_diagram_notes,
-                        placeholder="Enter notes in markdown...",
-                        height="250px",
-                        width="100%",
-                        variant="surface",
-                        style={"padding": "12px"},
-                    ),
-                    rx.dialog.root(
-                        rx.dialog.trigger(
-                            rx.button(
-                                rx.icon("sparkles", size=16),
-                                variant="soft",
-                                color_scheme="amber",
-                                position="absolute",
-                                top="12px",
-                                right="12px",
-                                z_index="10",
-                                cursor="pointer",
-                            ),
+                    rx.debounce_input(
+                        rx.text_area(
+                            value=State.diagram_notes,
+                            on_change=State.set_diagram_notes,
+                            placeholder="Enter notes in markdown...",
+                            height="250px",
+                            width="100%",
+                            variant="surface",
+                            style={"padding": "12px"},
                         ),
-                        rx.dialog.content(
-                            rx.vstack(
-                                rx.dialog.title("AI Notes Assistant"),
-                                rx.dialog.description(
-                                    "Provide a prompt instruction to update or generate the notes."
-                                ),
-                                rx.text_area(
-                                    value=State.ai_notes_prompt,
-                                    on_change=State.set_ai_notes_prompt,
-                                    placeholder="e.g., Summarize the technical architecture described in the diagram...",
-                                    width="100%",
-                                    height="150px",
+                        debounce_timeout=EDITOR_DEBOUNCE_MS,
+                        force_notify_on_blur=True,
+                    ),
+                    rx.cond(
+                        State.is_loading,
+                        stop_generation_button(),
+                        rx.dialog.root(
+                            rx.dialog.trigger(
+                                rx.button(
+                                    rx.icon("sparkles", size=16),
+                                    variant="soft",
+                                    color_scheme="amber",
+                                    position="absolute",
+                                    top="12px",
+                                    right="12px",
+                                    z_index="10",
+                                    cursor="pointer",
                                 ),
-                                rx.flex(
-                                    rx.text("Refer to Diagram", size="2"),
-                                    rx.spacer(),
-                                    rx.switch(
-                                        checked=State.refer_to_diagram,
-                                        on_change=State.set_refer_to_diagram,
+                            ),
+                            rx.dialog.content(
+                                rx.vstack(
+                                    rx.dialog.title("AI Notes Assistant"),
+                                    rx.dialog.description(
+                                        "Provide a prompt instruction to update or generate the notes."
                                     ),
-                                    width="100%",
-                                    align_items="center",
-                                ),
-                                rx.hstack(
-                                    rx.dialog.close(
-                                        rx.button(
-                                            "Cancel",
-                                            variant="soft",
-                                            color_scheme="gray",
+                                    rx.text_area(
+                                        value=State.ai_notes_prompt,
+                                        on_change=State.set_ai_notes_prompt,
+                                        placeholder="e.g., Summarize the technical architecture described in the diagram...",
+                                        width="100%",
+                                        height="150px",
+                                    ),
+                                    rx.flex(
+                                        rx.text("Refer to Diagram", size="2"),
+                                        rx.spacer(),
+                                        rx.switch(
+                                            checked=State.refer_to_diagram,
+                                            on_change=State.set_refer_to_diagram,
                                         ),
+                                        width="100%",
+                                        align_items="center",
                                     ),
-                                    rx.spacer(),
-                                    rx.button(
-                                        "Generate",
-                                        on_click=State.generate_notes,
-                                        is_loading=State.is_loading,
-                                        variant="solid",
-                                        color_scheme="indigo",
+                                    rx.hstack(
+                                        rx.dialog.close(
+                                            rx.button(
+                                                "Cancel",
+                                                variant="soft",
+                                                color_scheme="gray",
+                                            ),
+                                        ),
+                                        rx.spacer(),
+                                        rx.button(
+                                            "Generate",
+                                            on_click=State.generate_notes,
+                                            is_loading=State.is_loading,
+                                            variant="solid",
+                                            color_scheme="indigo",
+                                        ),
+                                        width="100%",
+                                        padding_top="4",
                                     ),
-                                    width="100%",
-                                    padding_top="4",
+                                    spacing="4",
                                 ),
-                                spacing="4",
                             ),
+                            open=State.show_ai_notes_modal,
+                            on_open_change=State.set_show_ai_notes_modal,
                         ),
-                        open=State.show_ai_notes_modal,
-                        on_open_change=State.set_show_ai_notes_modal,
                     ),
                     position="relative",
                     width="100%",
@@ -254,13 +392,17 @@ def diagram_editor():
                 spacing="2",
                 padding_top="4",
             ),
-            rx.button(
-                rx.icon("save"),
-                "Save Changes",
-                on_click=State.save_diagram,
+            rx.hstack(
+                revision_history(),
+                rx.button(
+                    rx.icon("save"),
+                    "Save Changes",
+                    on_click=State.save_diagram,
+                    flex="1",
+                    size="3",
+                    variant="solid",
+                ),
                 width="100%",
-                size="3",
-                variant="solid",
                 margin_top="4",
             ),
             width="100%",
@@ -1,5 +1,6 @@
 import reflex as rx
 from ..state import State
+from .in_view import in_view
 
 
 def diagram_list():
@@ -68,6 +69,18 @@ def diagram_list():
             rx.foreach(
                 State.diagrams,
                 lambda diagram: rx.box(
+                    rx.cond(
+                        diagram.thumbnail_url != "",
+                        rx.image(
+                            src=diagram.thumbnail_url,
+                            alt="",
+                            loading="lazy",
+                            width="100%",
+                            height="90px",
+                            object_fit="contain",
+                            margin_bottom="6pt",
+                        ),
+                    ),
                     rx.hstack(
                         rx.text(diagram.name, size="2", weight="medium"),
                         rx.spacer(),
@@ -124,6 +137,22 @@ def diagram_list():
                     },
                     width="100%",
                     padding="10pt",
+                    # Let the browser skip layout and paint of off-screen rows
+                    style={
+                        "content_visibility": "auto",
+                        "contain_intrinsic_size": "auto 140px",
+                    },
+                ),
+            ),
+            # Loads the next page as the end of the list scrolls into view. The
+            # key remounts it per page, so it fires again if it is still visible.
+            rx.cond(
+                State.has_more_diagrams,
+                in_view(
+                    rx.spinner(size="1"),
+                    on_change=State.load_more_diagrams,
+                    root_margin="200px",
+                    key=State.diagrams.length(),
                 ),
             ),
             width="100%",
@@ -0,0 +1,17 @@
+import reflex as rx
+from reflex.event import passthrough_event_spec
+
+
+class InView(rx.Component):
+    """Calls on_change when its content scrolls into or out of view."""
+
+    library = "react-intersection-observer@9.16.0"
+    tag = "InView"
+
+    # Grow the viewport by this margin, to fire before the content is visible
+    root_margin: rx.Var[str]
+
+    on_change: rx.EventHandler[passthrough_event_spec(bool)]
+
+
+in_view = InView.create
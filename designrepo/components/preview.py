@@ -1,28 +1,5 @@
 import reflex as rx
 from ..state import State
-import base64
-import zlib
-
-
-def encode_plantuml(text: str) -> str:
-    """Encode PlantUML text for the public renderer."""
-    # Simplified version: many online renderers accept some form of encoding
-    # For now, let's use a simple approach or just assume we can send it
-    # Actually, PlantUML public server uses a specific encoding.
-    # If I can't easily implement it here, I might just use a placeholder or
-    # use a library if I can find one.
-    # Let's try to implement the real one.
-    try:
-        zlibbed_str = zlib.compress(text.encode("utf-8"))
-        compressed_string = zlibbed_str[2:-4]
-        return (
-            base64.b64encode(compressed_string)
-            .decode("utf-8")
-            .replace("+", "-")
-            .replace("/", "_")
-        )
-    except:
-        return ""
 
 
 def preview():
@@ -78,7 +55,7 @@ def preview():
                 padding_bottom="4",
             ),
             rx.cond(
-                State.diagram_content,
+                State.has_diagram_content,
                 rx.divider(),
             ),
             rx.box(
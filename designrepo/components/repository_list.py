@@ -1,5 +1,52 @@
 import reflex as rx
 from ..state import State
+from .in_view import in_view
+
+
+def search_result(result):
+    return rx.box(
+        rx.hstack(
+            rx.icon("file-text", size=16),
+            rx.vstack(
+                rx.text(result.name),
+                rx.text(result.repository_name, size="1", color=rx.color("gray", 10)),
+                spacing="0",
+            ),
+            width="100%",
+            align_items="center",
+            spacing="3",
+        ),
+        on_click=lambda: State.open_search_result(result),
+        color=rx.color("gray", 11),
+        border_radius="md",
+        cursor="pointer",
+        _hover={"background_color": rx.color("gray", 3)},
+        width="100%",
+        padding="5pt",
+    )
+
+
+def search_results():
+    return rx.vstack(
+        rx.foreach(State.search_results, search_result),
+        rx.cond(
+            State.has_more_results,
+            rx.button(
+                "Load more",
+                on_click=State.load_more_results,
+                variant="ghost",
+                size="1",
+            ),
+        ),
+        rx.cond(
+            State.search_results.length() == 0,
+            rx.text("No matching diagrams", size="2", color=rx.color("gray", 10)),
+        ),
+        width="100%",
+        spacing="2",
+        padding_top="6",
+        padding_bottom="6",
+    )
 
 
 def repository_list():
@@ -75,66 +122,109 @@ def repository_list():
             align_items="center",
             padding_bottom="6",
         ),
+        rx.hstack(
+            # rx.input debounces controlled inputs, so typing does not
+            # run a query per keystroke
+            rx.input(
+                placeholder="Search diagrams",
+                value=State.search_query,
+                on_change=State.set_search_query,
+                variant="surface",
+                width="100%",
+            ),
+            rx.cond(
+                State.search_query != "",
+                rx.icon_button(
+                    rx.icon("x"),
+                    size="1",
+                    variant="ghost",
+                    on_click=State.clear_search,
+                ),
+            ),
+            width="100%",
+            align_items="center",
+            padding_bottom="4",
+        ),
         rx.divider(),
-        rx.vstack(
-            rx.foreach(
-                State.repositories,
-                lambda repository: rx.box(
-                    rx.hstack(
-                        rx.icon("folder", size=16),
-                        rx.text(repository.name),
-                        rx.spacer(),
+        rx.cond(
+            State.search_query != "",
+            search_results(),
+            rx.vstack(
+                rx.foreach(
+                    State.repositories,
+                    lambda repository: rx.box(
                         rx.hstack(
-                            rx.icon_button(
-                                rx.icon("chevron-up"),
-                                size="1",
-                                variant="ghost",
-                                on_click=State.move_repository_up(
-                                    repository.id
-                                ).stop_propagation,
-                            ),
-                            rx.icon_button(
-                                rx.icon("chevron-down"),
-                                size="1",
-                                variant="ghost",
-                                on_click=State.move_repository_down(
-                                    repository.id
-                                ).stop_propagation,
+                            rx.icon("folder", size=16),
+                            rx.text(repository.name),
+                            rx.spacer(),
+                            rx.hstack(
+                                rx.icon_button(
+                                    rx.icon("chevron-up"),
+                                    size="1",
+                                    variant="ghost",
+                                    on_click=State.move_repository_up(
+                                        repository.id
+                                    ).stop_propagation,
+                                ),
+                                rx.icon_button(
+                                    rx.icon("chevron-down"),
+                                    size="1",
+                                    variant="ghost",
+                                    on_click=State.move_repository_down(
+                                        repository.id
+                                    ).stop_propagation,
+                                ),
+                                spacing="1",
                             ),
-                            spacing="1",
+                            width="100%",
+                            align_items="center",
+                            spacing="3",
                         ),
+                        on_click=lambda: State.select_repository(repository),
+                        background_color=rx.cond(
+                            State.current_repository.name == repository.name,
+                            rx.color("indigo", 3),
+                            "transparent",
+                        ),
+                        color=rx.cond(
+                            State.current_repository.name == repository.name,
+                            rx.color("indigo", 9),
+                            rx.color("gray", 11),
+                        ),
+                        border_radius="md",
+                        cursor="pointer",
+                        _hover={
+                            "background_color": rx.cond(
+                                State.current_repository.name == repository.name,
+                                rx.color("indigo", 4),
+                                rx.color("gray", 3),
+                            ),
+                        },
                         width="100%",
-                        align_items="center",
-                        spacing="3",
+                        padding="5pt",
+                        # Let the browser skip layout and paint of off-screen rows
+                        style={
+                            "content_visibility": "auto",
+                            "contain_intrinsic_size": "auto 36px",
+                        },
                     ),
-                    on_click=lambda: State.select_repository(repository),
-                    background_color=rx.cond(
-                        State.current_repository.name == repository.name,
-                        rx.color("indigo", 3),
-                        "transparent",
-                    ),
-                    color=rx.cond(
-                        State.current_repository.name == repository.name,
-                        rx.color("indigo", 9),
-                        rx.color("gray", 11),
+                ),
+                # Loads the next page as the end of the list scrolls into view. The
+                # key remounts it per page, so it fires again if it is still visible.
+                rx.cond(
+                    State.has_more_repositories,
+                    in_view(
+                        rx.spinner(size="1"),
+                        on_change=State.load_more_repositories,
+                        root_margin="200px",
+                        key=State.repositories.length(),
                     ),
-                    border_radius="md",
-                    cursor="pointer",
-                    _hover={
-                        "background_color": rx.cond(
-                            State.current_repository.name == repository.name,
-                            rx.color("indigo", 4),
-                            rx.color("gray", 3),
-                        ),
-                    },
-                    width="100%",
-                    padding="5pt",
                 ),
+                width="100%",
+                spacing="2",
+                padding_top="6",
+                padding_bottom="6",
             ),
-            width="100%",
-            spacing="2",
-            padding_top="6",
-            padding_bottom="6",
         ),
         width="100%",
         padding="8",
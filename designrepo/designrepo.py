@@ -1,5 +1,7 @@
 import reflex as rx
 from .state import State
+from .api import api
+from . import blobs, render, sync
 from .components.repository_list import repository_list
 from .components.diagram_list import diagram_list
 from .components.diagram_editor import diagram_editor
@@ -178,6 +180,7 @@ def index() -> rx.Component:
 
 
 app = rx.App(
+    api_transformer=api,
     theme=rx.theme(
         appearance="light",
         has_background=True,
@@ -186,3 +189,6 @@ app = rx.App(
     ),
 )
 app.add_page(index, on_load=State.on_load)
+app.register_lifespan_task(sync.listen, rx_app=app)
+app.register_lifespan_task(blobs.sweep)
+app.register_lifespan_task(render.sweep)
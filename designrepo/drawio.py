@@ -0,0 +1,137 @@
+"""Reading draw.io uploads.
+
+draw.io stores each page either as a plain <mxGraphModel> element or, in
+its "compressed" format, as the text of the <diagram> element: the page XML
+URL-encoded, raw-deflated and base64-encoded. Uploads are normalised to the
+plain form so the stored XML is readable and compresses well as a whole.
+
+Uploads are read straight from the request body by the /upload/drawio
+route, so a file over the limit is refused before it is read in full.
+"""
+
+import base64
+import binascii
+import codecs
+import urllib.parse
+import xml.etree.ElementTree as ET
+import zlib
+from typing import AsyncIterator
+
+# Documents are checked in slices of this size, see _has_compressed_pages
+_PARSE_CHUNK = 64 * 1024
+
+
+class DrawioError(Exception):
+    """Raised when an upload is too large or is not a draw.io document."""
+
+
+class UploadTooLarge(DrawioError):
+    """Raised when an upload, or its inflated pages, exceed the size limit."""
+
+
+def check_size(size: int, limit: int):
+    """Refuse an upload of size bytes if it is over limit."""
+    if size > limit:
+        raise UploadTooLarge(f"File is larger than {limit // (1024 * 1024)} MB")
+
+
+async def read_stream(chunks: AsyncIterator[bytes], limit: int) -> bytearray:
+    """Read an upload from chunks, refusing it once it passes limit bytes.
+
+    The body must be UTF-8, which is checked as it arrives so that the
+    document never has to be decoded as a whole.
+    """
+    data = bytearray()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        async for chunk in chunks:
+            check_size(len(data) + len(chunk), limit)
+            decoder.decode(chunk)
+            data += chunk
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError as e:
+        raise DrawioError("Not a draw.io XML file") from e
+    return data
+
+
+def _inflate_page(text: str, limit: int) -> bytes:
+    if limit <= 0:
+        # decompress() treats a max_length of 0 as unlimited
+        raise UploadTooLarge("Compressed draw.io pages are too large")
+    try:
+        raw = base64.b64decode(text.strip(), validate=True)
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        data = inflater.decompress(raw, limit)
+    except (binascii.Error, zlib.error) as e:
+        raise DrawioError("Invalid compressed draw.io page") from e
+    if inflater.unconsumed_tail:
+        raise UploadTooLarge("Compressed draw.io pages are too large")
+    return data
+
+
+def _has_compressed_pages(data: bytes) -> bool:
+    """Check that data is a draw.io document and whether it has compressed pages.
+
+    The document is parsed incrementally and elements are emptied once
+    read, so plain documents are checked without building their whole tree.
+    """
+    parser = ET.XMLPullParser(("start", "end"))
+    view = memoryview(data)
+    root = None
+    try:
+        for offset in range(0, len(view), _PARSE_CHUNK):
+            parser.feed(view[offset : offset + _PARSE_CHUNK])
+            for event, element in parser.read_events():
+                if root is None:
+                    root = element
+                    if root.tag not in ("mxfile", "mxGraphModel"):
+                        raise DrawioError("Not a draw.io XML file")
+                elif event == "end":
+                    if (
+                        element.tag == "diagram"
+                        and len(element) == 0
+                        and element.text
+                        and element.text.strip()
+                    ):
+                        return True
+                    element.clear()
+        parser.close()
+    except ET.ParseError as e:
+        raise DrawioError("Not a draw.io XML file") from e
+    if root is None:
+        raise DrawioError("Not a draw.io XML file")
+    return False
+
+
+def inflate(data: bytes, limit: int) -> bytes:
+    """Return the draw.io document with every compressed page inflated.
+
+    data must be UTF-8, as returned by read_stream. Documents without
+    compressed pages are returned unchanged. limit caps the inflated size
+    of all pages together, so many small pages cannot add up to more than
+    a single large one.
+    """
+    if not _has_compressed_pages(data):
+        return data
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError as e:
+        raise DrawioError("Not a draw.io XML file") from e
+
+    compressed = [
+        page
+        for page in root.iter("diagram")
+        if len(page) == 0 and page.text and page.text.strip()
+    ]
+    remaining = limit
+    for page in compressed:
+        xml = _inflate_page(page.text, remaining)
+        remaining -= len(xml)
+        try:
+            model = ET.fromstring(urllib.parse.unquote(xml.decode("utf-8")))
+        except (UnicodeDecodeError, ET.ParseError) as e:
+            raise DrawioError("Invalid compressed draw.io page") from e
+        page.text = None
+        page.append(model)
+    root.attrib.pop("compressed", None)
+    return ET.tostring(root, encoding="utf-8", xml_declaration=False)
@@ -0,0 +1,193 @@
+"""Revision history of diagram content and notes.
+
+Each save appends a DiagramRevision. A revision is a full snapshot when
+revision_snapshot_interval revisions have passed since the last one; the
+others store a delta against the revision before them, so materializing
+any revision reads one snapshot and at most interval - 1 deltas. Revision
+payloads are JSON compressed with the diagram body codec.
+
+Texts are diffed as runs of tokens ending in a newline or ">", which keeps
+deltas small for line-oriented PlantUML/Mermaid code as well as for draw.io
+XML, which is usually a single line. A delta is a list of [start, end]
+ranges copied from the previous revision's tokens and inserted strings.
+"""
+
+import asyncio
+import difflib
+import json
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import blobs
+from .models import DiagramRevision
+from .settings import settings
+
+FIELDS = ("content", "notes")
+_TOKEN_BOUNDARY = re.compile(r"(?<=[\n>])")
+# Texts longer than this are diffed off the event loop
+THREAD_THRESHOLD = 64 * 1024
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_BOUNDARY.split(text) if token]
+
+
+def diff(old: str, new: str) -> list:
+    """Delta that turns old into new (see patch)."""
+    a, b = tokenize(old), tokenize(new)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def patch(old: str, ops: Sequence) -> str:
+    tokens = tokenize(old)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(tokens[op[0] : op[1]])
+    return "".join(parts)
+
+
+async def _encode(payload: dict) -> Tuple[str, bytes]:
+    return await blobs.compress(json.dumps(payload).encode("utf-8"))
+
+
+async def _decode(revision) -> dict:
+    return json.loads(await blobs.decompress(revision.codec, revision.data))
+
+
+async def _delta(before: Dict[str, str], after: Dict[str, str]) -> dict:
+    payload = {}
+    for field in FIELDS:
+        if before[field] == after[field]:
+            payload[field] = None
+        elif max(len(before[field]), len(after[field])) > THREAD_THRESHOLD:
+            payload[field] = await asyncio.to_thread(diff, before[field], after[field])
+        else:
+            payload[field] = diff(before[field], after[field])
+    return payload
+
+
+async def record(
+    session: AsyncSession,
+    diagram_id: int,
+    before: Dict[str, str],
+    after: Dict[str, str],
+    author: str = "",
+) -> int:
+    """Append a revision for a save that changed before into after.
+
+    before must be the diagram as currently stored, i.e. the latest
+    revision, so the caller should hold a lock on the diagram row. A
+    diagram without history first gets before recorded as revision 1.
+    Returns the new revision number. Runs in the caller's transaction.
+    """
+    latest, latest_snapshot = (
+        await session.exec(
+            select(
+                func.max(DiagramRevision.number),
+                func.max(case((DiagramRevision.snapshot, DiagramRevision.number))),
+            ).where(DiagramRevision.diagram_id == diagram_id)
+        )
+    ).one()
+    if latest is None:
+        codec, data = await _encode(before)
+        session.add(
+            DiagramRevision(
+                diagram_id=diagram_id,
+                number=1,
+                snapshot=True,
+                codec=codec,
+                data=data,
+            )
+        )
+        latest = latest_snapshot = 1
+
+    number = latest + 1
+    snapshot = number - latest_snapshot >= settings.revision_snapshot_interval
+    payload = after if snapshot else await _delta(before, after)
+    codec, data = await _encode(payload)
+    session.add(
+        DiagramRevision(
+            diagram_id=diagram_id,
+            number=number,
+            snapshot=snapshot,
+            author=author,
+            codec=codec,
+            data=data,
+        )
+    )
+    return number
+
+
+async def list_revisions(
+    session: AsyncSession,
+    diagram_id: int,
+    limit: int = 50,
+    before: Optional[int] = None,
+) -> list:
+    """Newest-first revision metadata, without payloads.
+
+    Pass the smallest number seen so far as before to get the next page.
+    """
+    query = (
+        select(
+            DiagramRevision.number,
+            DiagramRevision.snapshot,
+            DiagramRevision.author,
+            DiagramRevision.created_at,
+        )
+        .where(DiagramRevision.diagram_id == diagram_id)
+        .order_by(DiagramRevision.number.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(DiagramRevision.number < before)
+    return (await session.exec(query)).all()
+
+
+async def materialize(
+    session: AsyncSession, diagram_id: int, number: int
+) -> Optional[Dict[str, str]]:
+    """Return the content and notes of a revision, or None if it is unknown."""
+    in_diagram = DiagramRevision.diagram_id == diagram_id
+    base = (
+        select(func.max(DiagramRevision.number))
+        .where(
+            in_diagram & DiagramRevision.snapshot & (DiagramRevision.number <= number)
+        )
+        .scalar_subquery()
+    )
+    revisions = (
+        await session.exec(
+            select(DiagramRevision)
+            .where(
+                in_diagram
+                & (DiagramRevision.number >= base)
+                & (DiagramRevision.number <= number)
+            )
+            .order_by(DiagramRevision.number)
+        )
+    ).all()
+    if not revisions or revisions[-1].number != number:
+        return None
+
+    texts = await _decode(revisions[0])
+    for revision in revisions[1:]:
+        payload = await _decode(revision)
+        for field in FIELDS:
+            if payload[field] is not None:
+                texts[field] = patch(texts[field], payload[field])
+    return texts
@@ -0,0 +1,182 @@
+"""In-process queues for long-running work such as AI calls and renders.
+
+Work is submitted to a queue as a job under a key. Each kind of work has
+its own queue with its own number of workers, so I/O-bound AI calls are
+not held up behind CPU-bound renders or the other way round. A queue runs
+its jobs lower priority values first and in submission order within a
+priority. Submitting a key that is already queued or running returns the
+existing job, so identical work is done once and shared by everyone who
+asked for it.
+
+A job reports progress with Job.report; sessions follow it with Job.watch
+and pick up the result with Job.result. A job that was watched is
+cancelled once its last watcher stops watching before it finishes.
+"""
+
+import asyncio
+import itertools
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional
+
+from .settings import settings
+
+# Priorities: something a user is waiting for, and work nobody waits on
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class Job:
+    """A unit of queued work, shared by every submitter of the same key."""
+
+    def __init__(
+        self,
+        key: Hashable,
+        priority: int,
+        func: Callable[["Job"], Awaitable[Any]],
+    ):
+        self.key = key
+        self.priority = priority
+        self.func = func
+        self.progress: Any = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._task: Optional[asyncio.Task] = None
+        self._version = 0
+        self._changed = asyncio.Event()
+        self._watchers = 0
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def report(self, progress: Any):
+        """Publish progress to the job's watchers (called by the job itself)."""
+        self.progress = progress
+        self._version += 1
+        self._notify()
+
+    async def watch(self) -> AsyncIterator[Any]:
+        """Yield the latest progress whenever it changes, until the job ends.
+
+        Values reported while the watcher was busy are skipped. Use with
+        contextlib.aclosing so leaving early releases the job.
+        """
+        self._watchers += 1
+        seen = 0
+        try:
+            while True:
+                changed = self._changed
+                if self._version != seen:
+                    seen = self._version
+                    yield self.progress
+                elif self.future.done():
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            self._watchers -= 1
+            if not self._watchers:
+                self.cancel()
+
+    async def result(self) -> Any:
+        """Wait for the job and return its result or raise its exception."""
+        return await asyncio.shield(self.future)
+
+    def cancel(self):
+        if self.future.done():
+            return
+        if self._task is not None:
+            self._task.cancel()
+        else:
+            self.future.cancel()
+            self._notify()
+
+    async def _run(self):
+        self._task = asyncio.create_task(self.func(self))
+        try:
+            await asyncio.wait([self._task])
+        finally:
+            if not self.future.done():
+                if self._task.cancelled():
+                    self.future.cancel()
+                elif self._task.exception() is not None:
+                    self.future.set_exception(self._task.exception())
+                    # Mark the exception as retrieved when nobody was waiting
+                    self.future.exception()
+                else:
+                    self.future.set_result(self._task.result())
+            self._notify()
+
+
+def completed(key: Hashable, result: Any) -> Job:
+    """A job that has already finished with result, e.g. from a cache."""
+    job = Job(key, INTERACTIVE, None)
+    job.report(result)
+    job.future.set_result(result)
+    return job
+
+
+class JobQueue:
+    """Priority queue of jobs served by a fixed number of worker tasks."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._jobs: Dict[Hashable, Job] = {}
+        self._order = itertools.count()
+        self._tasks = set()
+
+    def _start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            task = asyncio.create_task(self._work())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def submit(
+        self,
+        key: Hashable,
+        func: Callable[[Job], Awaitable[Any]],
+        priority: int = BACKGROUND,
+    ) -> Job:
+        """Queue func(job) under key, or return the job already queued for it.
+
+        Resubmitting a queued job with a more urgent priority moves it up.
+        """
+        self._start()
+        job = self._jobs.get(key)
+        if job is None or job.future.done():
+            job = Job(key, priority, func)
+            self._jobs[key] = job
+            job.future.add_done_callback(lambda _: self._forget(job))
+        elif job.started or priority >= job.priority:
+            return job
+        job.priority = priority
+        # An outdated entry for a reprioritized job is skipped by the workers
+        self._queue.put_nowait((priority, next(self._order), job))
+        return job
+
+    def get(self, key: Hashable) -> Optional[Job]:
+        """The queued or running job for key, if any."""
+        return self._jobs.get(key)
+
+    def _forget(self, job: Job):
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+
+    async def _work(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.started or job.future.done():
+                continue
+            await job._run()
+
+
+completions = JobQueue(settings.ai_workers)
+thumbnails = JobQueue(settings.thumbnail_workers)
+# Diagram renders: previews at INTERACTIVE priority, thumbnail PNGs BACKGROUND
+renders = JobQueue(settings.render_workers)
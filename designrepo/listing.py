@@ -0,0 +1,77 @@
+"""Process-wide read-through cache of repository and diagram listings.
+
+Listings are shared by every session in the backend process, so a burst of
+page loads runs the listing query once. State mutation handlers invalidate
+the affected listing after committing. Entries also expire after
+listing_cache_ttl, which bounds how long another replica's writes can go
+unnoticed.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from .settings import settings
+
+
+class ListingCache:
+    """Lists of rows keyed by scope, loaded on first use."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, Tuple[float, list]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Bumped on every invalidation so a load that raced with a write
+        # is returned to its caller but never stored
+        self._version = 0
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[list]]) -> list:
+        """Return the cached listing for key, calling load on a miss.
+
+        Concurrent misses for the same key share a single load. The result
+        is a new list, so callers may rebind or reorder it freely.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return list(entry[1])
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return list(await asyncio.shield(pending))
+
+        version = self._version
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            items = await load()
+            if version == self._version:
+                self._entries[key] = (time.monotonic(), items)
+            future.set_result(items)
+            return list(items)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Drop the listing for key, or every listing if key is None."""
+        self._version += 1
+        if key is None:
+            self._entries.clear()
+            self._inflight.clear()
+        else:
+            self._entries.pop(key, None)
+            # Later callers must not join a load that started before the write
+            self._inflight.pop(key, None)
+
+
+# A single listing of all repositories, under the key "all"
+repositories = ListingCache(settings.listing_cache_ttl)
+# Diagram summaries keyed by repository id
+diagrams = ListingCache(settings.listing_cache_ttl)
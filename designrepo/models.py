@@ -2,7 +2,15 @@ import reflex as rx
 from typing import List, Optional
 from datetime import datetime
 from sqlmodel import Field
-from sqlalchemy import UniqueConstraint, Column, String, DateTime
+from sqlalchemy import (
+    UniqueConstraint,
+    Index,
+    Column,
+    String,
+    DateTime,
+    LargeBinary,
+    text,
+)
 import pendulum
 from pendulum import Timezone
 
@@ -38,7 +46,75 @@ class Repository(rx.Model, table=True):
         sa_column=Column(DateTime(timezone=True)),
     )
 
-    __table_args__ = (UniqueConstraint("name", name="unique_repository_name"),)
+    __table_args__ = (
+        UniqueConstraint("name", name="unique_repository_name"),
+        # id breaks ties so the sidebar can page with an (order_index, id) cursor
+        Index("ix_repository_order_index", "order_index", "id"),
+    )
+
+
+class DiagramBlob(rx.Model, table=True):
+    """Compressed diagram body, shared by every diagram with the same body."""
+
+    digest: str = Field(sa_column=Column(String(64), unique=True, nullable=False))
+    codec: str  # "zlib" or "zstd"
+    size: int  # Uncompressed size in bytes
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    # Last time the body was stored; blobs no diagram references are swept
+    # once this is older than blob_orphan_ttl (see blobs.sweep)
+    stored_at: Optional[datetime] = Field(
+        default_factory=lambda: datetime.now(tz=pendulum.local_timezone()),
+        sa_column=Column(DateTime(timezone=True)),
+    )
+
+
+class DiagramRevision(rx.Model, table=True):
+    """A saved version of a diagram's content and notes (see history.py)."""
+
+    diagram_id: int
+    number: int  # 1, 2, ... per diagram
+    snapshot: bool  # Full texts rather than a delta against number - 1
+    author: str = ""
+    codec: str
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(tz=pendulum.local_timezone()),
+        sa_column=Column(DateTime(timezone=True)),
+    )
+
+    __table_args__ = (
+        UniqueConstraint("diagram_id", "number", name="unique_diagram_revision"),
+    )
+
+
+class DiagramSearch(rx.Model, table=True):
+    """Search document of a diagram (see search.py)."""
+
+    diagram_id: int = Field(unique=True)
+    repository_id: int
+    name: str
+    # Notes followed by the labels extracted from the content
+    document: str = ""
+
+    __table_args__ = (
+        # Postgres only: weighted full-text index over name and document,
+        # and a trigram index for partial matches on the name. The vector
+        # expression must match search.vector_sql() to be used.
+        Index(
+            "ix_diagramsearch_vector",
+            text(
+                "(setweight(to_tsvector('english', name), 'A') || "
+                "setweight(to_tsvector('english', document), 'B'))"
+            ),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_diagramsearch_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
 
 class Diagram(rx.Model, table=True):
@@ -46,7 +122,8 @@ class Diagram(rx.Model, table=True):
 
     repository_id: int
     name: str
-    content: str  # Code for PlantUML/Mermaid or Base64 for Draw.io
+    # Body (PlantUML/Mermaid code or Draw.io XML), stored in DiagramBlob
+    content_digest: str = Field(foreign_key="diagramblob.digest")
     diagram_type: str  # "plantuml", "mermaid", "drawio"
     category: str  # "as-is", "to-be"
     notes: str = ""  # Markdown notes
@@ -64,4 +141,12 @@ class Diagram(rx.Model, table=True):
 
     __table_args__ = (
         UniqueConstraint("repository_id", "name", name="unique_diagram_per_repository"),
+        # Serves the ordered per-repository listing and its (order_index, id)
+        # page cursor, the max order lookup and neighbour lookups when
+        # reordering (see tests/test_query_plans.py). It deliberately has no
+        # INCLUDE columns: every save changes updated_at and usually
+        # content_digest, and indexing them would rule out HOT updates, so
+        # each save would add index entries. A sidebar page is at most
+        # sidebar_page_size + 1 heap fetches after the index scan.
+        Index("ix_diagram_repository_order", "repository_id", "order_index", "id"),
     )
@@ -0,0 +1,145 @@
+"""Process-wide OIDC metadata cache and local ID token validation."""
+
+import abc
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from authlib.jose import JsonWebKey, JsonWebToken
+from authlib.jose.errors import JoseError
+
+from .settings import settings
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared HTTP client for IdP requests, so connections are kept alive."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=settings.oidc_timeout)
+    return _http_client
+
+
+class CachedDocument(abc.ABC):
+    """A JSON document fetched over HTTP and cached for a TTL.
+
+    Once the TTL expires the stale copy keeps being served while a single
+    background task refreshes it, so callers only wait on the first fetch.
+    Concurrent forced refreshes are coalesced into one fetch as well.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value: Optional[Dict[str, Any]] = None
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh: Optional[asyncio.Task] = None
+
+    @abc.abstractmethod
+    async def _url(self) -> str:
+        """URL the document is fetched from."""
+
+    async def _fetch(self) -> Dict[str, Any]:
+        resp = await get_http_client().get(await self._url())
+        resp.raise_for_status()
+        self._value = resp.json()
+        self._fetched_at = time.monotonic()
+        return self._value
+
+    async def _background_refresh(self):
+        try:
+            await self._fetch()
+        except (httpx.HTTPError, ValueError):
+            # Keep serving the stale document; the next call retries
+            pass
+        finally:
+            self._refresh = None
+
+    async def get(self, force: bool = False) -> Dict[str, Any]:
+        if self._value is not None and not force:
+            if time.monotonic() - self._fetched_at > self.ttl and not self._refresh:
+                self._refresh = asyncio.create_task(self._background_refresh())
+            return self._value
+        requested_at = self._fetched_at
+        async with self._lock:
+            # Another caller may have fetched it while we waited for the lock,
+            # which also answers a forced refresh requested before that fetch
+            if self._value is not None and (
+                not force or self._fetched_at != requested_at
+            ):
+                return self._value
+            return await self._fetch()
+
+    def clear(self):
+        self._value = None
+        self._fetched_at = 0.0
+
+
+class DiscoveryDocument(CachedDocument):
+    async def _url(self) -> str:
+        return f"{settings.oidc_issuer.rstrip('/')}/.well-known/openid-configuration"
+
+
+class JWKSDocument(CachedDocument):
+    def __init__(self, ttl: float, discovery: DiscoveryDocument):
+        super().__init__(ttl)
+        self.discovery = discovery
+
+    async def _url(self) -> str:
+        return (await self.discovery.get())["jwks_uri"]
+
+
+discovery = DiscoveryDocument(settings.oidc_metadata_ttl)
+jwks = JWKSDocument(settings.oidc_metadata_ttl, discovery)
+
+
+async def get_config() -> Dict[str, Any]:
+    """Return the IdP's OpenID configuration."""
+    return await discovery.get()
+
+
+async def get_jwks() -> Dict[str, Any]:
+    """Return the IdP's JSON Web Key Set."""
+    return await jwks.get()
+
+
+# Only asymmetric algorithms; never "none" or shared-secret HMAC
+_jwt = JsonWebToken(["RS256", "RS384", "RS512", "PS256", "ES256", "ES384", "ES512"])
+
+
+class TokenValidationError(Exception):
+    """Raised when an ID token fails signature or claims validation."""
+
+
+async def verify_id_token(id_token: str, nonce: str) -> Dict[str, Any]:
+    """Validate an ID token locally and return its claims.
+
+    Checks the signature against the cached JWKS as well as the issuer,
+    audience, expiry and the nonce sent with the authorization request. The
+    JWKS is refreshed once if the signing key is unknown, to pick up key
+    rotation.
+    """
+    if not nonce:
+        raise TokenValidationError("No nonce was sent for this login")
+    config = await get_config()
+    claims_options = {
+        "iss": {"essential": True, "value": config["issuer"]},
+        "aud": {"essential": True, "value": settings.oidc_client_id},
+        "exp": {"essential": True},
+        "sub": {"essential": True},
+        "nonce": {"essential": True, "value": nonce},
+    }
+    for force_refresh in (False, True):
+        keys = JsonWebKey.import_key_set(await jwks.get(force=force_refresh))
+        try:
+            claims = _jwt.decode(id_token, keys, claims_options=claims_options)
+            claims.validate(leeway=settings.oidc_clock_skew)
+            return dict(claims)
+        except ValueError:
+            # Signing key not in the key set; retry with a fresh JWKS
+            continue
+        except JoseError as e:
+            raise TokenValidationError(str(e)) from e
+    raise TokenValidationError("ID token signing key not found in JWKS")
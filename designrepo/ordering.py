@@ -0,0 +1,184 @@
+"""Gapped ordering keys for repositories and diagrams.
+
+New rows are appended ORDER_GAP after the current maximum, and a move
+gives the moved row a key halfway between its new neighbours, so a typical
+reorder locks the moved row, reads the two neighbours through the ordering
+index and updates a single row. Only when two neighbours have no room left
+between them is the whole scope read and renumbered, in the same
+transaction.
+"""
+
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func, tuple_, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+ORDER_GAP = 1024
+
+
+async def next_order_index(session: AsyncSession, model, scope=None) -> int:
+    """Ordering key for a row appended at the end of the scope."""
+    query = select(func.max(model.order_index))
+    if scope is not None:
+        query = query.where(scope)
+    current = (await session.exec(query)).one()
+    return ORDER_GAP if current is None else current + ORDER_GAP
+
+
+def _between(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    if before is None and after is None:
+        return 0
+    if before is None:
+        return after - ORDER_GAP
+    if after is None:
+        return before + ORDER_GAP
+    if after - before > 1:
+        return (before + after) // 2
+    return None
+
+
+def _in_scope(query, scope):
+    return query if scope is None else query.where(scope)
+
+
+async def _renumber(
+    session: AsyncSession, model, item_id: int, before_id: Optional[int], scope
+) -> Dict[int, int]:
+    """Renumber the whole scope with the item placed after before_id."""
+    query = select(model.id, model.order_index).order_by(model.order_index, model.id)
+    rows = (await session.exec(_in_scope(query, scope).with_for_update())).all()
+    keys = {row.id: row.order_index for row in rows}
+    ids = [row.id for row in rows if row.id != item_id]
+    ids.insert(0 if before_id is None else ids.index(before_id) + 1, item_id)
+    return {
+        id_: (n + 1) * ORDER_GAP
+        for n, id_ in enumerate(ids)
+        if keys[id_] != (n + 1) * ORDER_GAP
+    }
+
+
+class _Neighbours:
+    """Reads the rows around a moved row, through the ordering index.
+
+    Every read takes at most two rows and locks them, so a move touches a
+    handful of rows however large the scope is.
+    """
+
+    def __init__(self, session: AsyncSession, model, item, scope):
+        self.session = session
+        self.model = model
+        self.scope = scope
+        self.key = tuple_(model.order_index, model.id)
+        self.current = (item.order_index, item.id)
+        self.others = select(model.id, model.order_index).where(model.id != item.id)
+
+    async def rows(
+        self, after: Optional[bool], descending: bool, offset: int, limit: int
+    ):
+        """Rows after (True), before (False) or anywhere around (None) the item."""
+        query = _in_scope(self.others, self.scope)
+        if after is not None:
+            query = query.where(
+                self.key > self.current if after else self.key < self.current
+            )
+        if descending:
+            query = query.order_by(self.model.order_index.desc(), self.model.id.desc())
+        else:
+            query = query.order_by(self.model.order_index, self.model.id)
+        query = query.offset(offset).limit(limit).with_for_update()
+        return (await self.session.exec(query)).all()
+
+
+async def _reorder(
+    session: AsyncSession,
+    model,
+    item_id: int,
+    find: Callable,
+    scope=None,
+) -> Dict[int, int]:
+    # Lock the moved row so concurrent moves of it are serialized
+    item = (
+        await session.exec(
+            select(model.id, model.order_index)
+            .where(model.id == item_id)
+            .with_for_update()
+        )
+    ).first()
+    if item is None:
+        return {}
+    neighbours = _Neighbours(session, model, item, scope)
+    before, after = await find(neighbours)
+    current = neighbours.current
+    if (before is None or (before.order_index, before.id) < current) and (
+        after is None or (after.order_index, after.id) > current
+    ):
+        # Already between them
+        return {}
+
+    new_key = _between(
+        before.order_index if before is not None else None,
+        after.order_index if after is not None else None,
+    )
+    if new_key is not None:
+        changes = {item_id: new_key}
+    else:
+        # No room left between the neighbours
+        changes = await _renumber(
+            session, model, item_id, before.id if before is not None else None, scope
+        )
+
+    for id_, key in changes.items():
+        await session.execute(
+            update(model).where(model.id == id_).values(order_index=key)
+        )
+    await session.commit()
+    return changes
+
+
+def _pair(rows):
+    return rows[0], rows[1] if len(rows) > 1 else None
+
+
+async def move_to(
+    session: AsyncSession, model, item_id: int, position: int, scope=None
+) -> Dict[int, int]:
+    """Move a row to a 0-based position within its scope.
+
+    Returns the new ordering key of every row that changed.
+    """
+
+    async def find(neighbours: _Neighbours):
+        if position <= 0:
+            first = await neighbours.rows(None, False, 0, 1)
+            return None, first[0] if first else None
+        rows = await neighbours.rows(None, False, position - 1, 2)
+        if rows:
+            return _pair(rows)
+        # Past the end: move after the last row
+        last = await neighbours.rows(None, True, 0, 1)
+        return (last[0] if last else None), None
+
+    return await _reorder(session, model, item_id, find, scope)
+
+
+async def move_by(
+    session: AsyncSession, model, item_id: int, offset: int, scope=None
+) -> Dict[int, int]:
+    """Move a row up (negative offset) or down within its scope."""
+    down = offset > 0
+
+    async def find(neighbours: _Neighbours):
+        if offset == 0:
+            return None, None
+        # Rows in the direction of the move, nearest first
+        rows = await neighbours.rows(down, not down, abs(offset) - 1, 2)
+        if not rows:
+            # Past the end: move beyond the farthest row in that direction
+            rows = await neighbours.rows(down, down, 0, 1)
+            if not rows:
+                return None, None
+        near, far = _pair(rows)
+        return (near, far) if down else (far, near)
+
+    return await _reorder(session, model, item_id, find, scope)
@@ -0,0 +1,532 @@
+"""Server-side rendering of PlantUML and Mermaid diagrams to SVG.
+
+Diagrams are rendered by a local renderer (PlantUML jar or mermaid-cli) when
+one is configured, falling back to the public PlantUML / mermaid.ink servers
+otherwise. Rendered SVGs are cached on disk keyed by a hash of
+(diagram_type, content), so unchanged diagrams are never rendered twice.
+
+The PlantUML jar runs as a pool of long-lived processes in -pipe mode, so
+only the first render in each process pays for starting the JVM.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import secrets
+import tempfile
+import time
+import urllib.parse
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import reflex as rx
+
+from . import auth, blobs, jobs
+from .settings import settings
+
+RENDERABLE_TYPES = ("plantuml", "mermaid")
+DRAWIO_VIEWER_ORIGIN = "https://viewer.diagrams.net"
+
+_B64_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_PLANTUML_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+_TO_PLANTUML = str.maketrans(_B64_ALPHABET, _PLANTUML_ALPHABET)
+_FROM_PLANTUML = str.maketrans(_PLANTUML_ALPHABET, _B64_ALPHABET)
+
+
+class RenderError(Exception):
+    """Raised when a diagram cannot be decoded or rendered."""
+
+
+def diagram_digest(diagram_type: str, content: str) -> str:
+    """Content address of a diagram source."""
+    h = hashlib.sha256()
+    h.update(diagram_type.encode("utf-8"))
+    h.update(b"\0")
+    h.update(content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def encode_plantuml(text: str) -> str:
+    """Encode PlantUML source the way the PlantUML server expects.
+
+    The source is raw-deflated and written in PlantUML's own base64
+    alphabet, with the final group zero-padded instead of using "=".
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(text.encode("utf-8")) + compressor.flush()
+    data += b"\0" * (-len(data) % 3)
+    return base64.b64encode(data).decode("ascii").translate(_TO_PLANTUML)
+
+
+def decode_plantuml(encoded: str) -> str:
+    """Inverse of encode_plantuml. Also accepts the "~h" hex form."""
+    if encoded.startswith("~h"):
+        return bytes.fromhex(encoded[2:]).decode("utf-8")
+    data = encoded.translate(_FROM_PLANTUML)
+    data += "=" * (-len(data) % 4)
+    raw = base64.b64decode(data, validate=True)
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(raw).decode("utf-8")
+
+
+def encode_source(diagram_type: str, content: str) -> str:
+    """Encode a diagram source for use in a render URL path."""
+    if diagram_type == "plantuml":
+        return encode_plantuml(content)
+    data = content.encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_source(diagram_type: str, encoded: str) -> str:
+    """Inverse of encode_source."""
+    try:
+        if diagram_type == "plantuml":
+            return decode_plantuml(encoded)
+        encoded = encoded.replace("+", "-").replace("/", "_")
+        padded = encoded + "=" * (-len(encoded) % 4)
+        return base64.urlsafe_b64decode(padded).decode("utf-8")
+    except (ValueError, binascii.Error, zlib.error, UnicodeDecodeError) as e:
+        raise RenderError(f"Invalid {diagram_type} source encoding") from e
+
+
+def base_url() -> str:
+    base = settings.render_base_url
+    if base is None:
+        from reflex.config import get_config
+
+        base = get_config().api_url
+    return base.rstrip("/")
+
+
+def drawio_viewer_url(digest: str, origin: str) -> str:
+    """diagrams.net viewer URL that loads a stored draw.io body by digest.
+
+    The browser fetches the XML from the backend, so large documents never
+    have to fit in a URL or pass through the session state. The viewer runs
+    on its own origin, so a relative render_base_url is resolved against
+    origin, the app's origin as seen by the browser. It sends no session
+    cookie, so the URL carries a token for this body when OIDC is enabled.
+    """
+    path = f"{base_url()}/source/{digest}"
+    if settings.oidc_issuer:
+        path += f"?token={auth.issue_source_token(digest)}"
+    source = urllib.parse.urljoin(f"{origin}/", path)
+    return f"{DRAWIO_VIEWER_ORIGIN}/#U{urllib.parse.quote(source, safe='')}"
+
+
+def render_url(diagram_type: str, content: str) -> str:
+    """URL of the backend render endpoint for the given diagram source.
+
+    Sources whose encoded form would exceed render_max_url_length are
+    referenced by their blob digest instead and must be stored with
+    store_preview_source before the URL is used.
+    """
+    base = base_url()
+    encoded = encode_source(diagram_type, content)
+    if len(encoded) <= settings.render_max_url_length:
+        return f"{base}/render/{diagram_type}/{encoded}"
+    return f"{base}{DIGEST_PATH}{diagram_type}/{blobs.content_digest(content)}"
+
+
+DIGEST_PATH = "/render/digest/"
+
+_preview_urls: "OrderedDict[str, str]" = OrderedDict()
+
+
+def preview_url(diagram_type: str, content: str) -> str:
+    """Preview URL for a diagram, memoized on its content digest.
+
+    Encoding a large diagram is far more expensive than hashing it, so
+    recomputing the URL for unchanged content is a dictionary lookup. Keys
+    are digests rather than the source itself to keep the cache small.
+    """
+    digest = diagram_digest(diagram_type, content)
+    url = _preview_urls.get(digest)
+    if url is not None:
+        _preview_urls.move_to_end(digest)
+        return url
+    url = render_url(diagram_type, content)
+    _preview_urls[digest] = url
+    if len(_preview_urls) > settings.preview_url_cache_size:
+        _preview_urls.popitem(last=False)
+    return url
+
+
+# Digests of sources this process stored recently, with when it stored them
+_stored_sources: "OrderedDict[str, float]" = OrderedDict()
+
+
+async def store_preview_source(diagram_type: str, content: str):
+    """Store a diagram source if its preview URL references it by digest.
+
+    Sources are stored as diagram blobs, so every backend replica can
+    render them. Await this before showing the preview URL. A source this
+    process stored less than half of blob_orphan_ttl ago is not written
+    again, so idle refreshes of an unchanged preview stay off the database
+    while the blob is still safe from sweep.
+    """
+    if diagram_type not in RENDERABLE_TYPES or not content:
+        return
+    if DIGEST_PATH not in preview_url(diagram_type, content):
+        return
+    digest = blobs.content_digest(content)
+    now = time.monotonic()
+    stored = _stored_sources.get(digest)
+    if stored is not None and now - stored < settings.blob_orphan_ttl / 2:
+        _stored_sources.move_to_end(digest)
+        return
+    async with rx.asession() as session:
+        await blobs.put(session, content)
+        await session.commit()
+    _stored_sources[digest] = now
+    _stored_sources.move_to_end(digest)
+    if len(_stored_sources) > settings.preview_url_cache_size:
+        _stored_sources.popitem(last=False)
+
+
+class SVGCache:
+    """Content-addressed on-disk store for rendered SVGs."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def _path(self, digest: str, suffix: str = "svg") -> Path:
+        return self.directory / digest[:2] / f"{digest}.{suffix}"
+
+    def _read(self, path: Path) -> Optional[bytes]:
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see partial output
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, digest: str) -> Optional[bytes]:
+        return self._read(self._path(digest))
+
+    def put(self, digest: str, svg: bytes):
+        self._write(self._path(digest), svg)
+
+    def get_thumbnail(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        """Return the (image, format) of a stored thumbnail."""
+        for fmt in ("webp", "svg"):
+            data = self._read(self._path(digest, fmt))
+            if data is not None:
+                return data, fmt
+        return None
+
+    def modified(self, digest: str, suffix: str) -> Optional[float]:
+        """Modification time of a stored entry."""
+        try:
+            return self._path(digest, suffix).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def put_thumbnail(self, digest: str, data: bytes, fmt: str):
+        self._write(self._path(digest, fmt), data)
+
+    def prune(self, max_bytes: int) -> int:
+        """Delete the oldest entries until the cache fits in max_bytes.
+
+        Everything in the cache can be produced again, so an evicted entry
+        only costs a render. Returns the number of files deleted.
+        """
+        entries = []
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        deleted = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            deleted += 1
+        return deleted
+
+
+cache = SVGCache(settings.render_cache_dir)
+
+
+async def sweep():
+    """Lifespan task that keeps the render cache under render_cache_max_bytes."""
+    while True:
+        await asyncio.to_thread(cache.prune, settings.render_cache_max_bytes)
+        await asyncio.sleep(settings.render_cache_sweep_interval)
+
+
+async def render_svg(diagram_type: str, content: str) -> bytes:
+    """Render a diagram to SVG, using the cache when possible.
+
+    Renders run on jobs.renders ahead of thumbnails, and concurrent
+    requests for the same diagram share a single render.
+    """
+    if diagram_type not in RENDERABLE_TYPES:
+        raise RenderError(f"Unsupported diagram type: {diagram_type}")
+
+    digest = diagram_digest(diagram_type, content)
+    svg = cache.get(digest)
+    if svg is not None:
+        return svg
+
+    async def run(job):
+        if diagram_type == "plantuml":
+            svg = await _render_plantuml(content)
+        else:
+            svg = await _render_mermaid(content)
+        cache.put(digest, svg)
+        return svg
+
+    job = jobs.renders.submit(("svg", digest), run, priority=jobs.INTERACTIVE)
+    return await job.result()
+
+
+async def render_png(diagram_type: str, content: str) -> bytes:
+    """Render a diagram to PNG (for thumbnails; not cached).
+
+    Runs on jobs.renders behind any preview waiting for a render slot.
+    """
+    if diagram_type not in RENDERABLE_TYPES:
+        raise RenderError(f"Unsupported diagram type: {diagram_type}")
+
+    async def run(job):
+        if diagram_type == "plantuml":
+            return await _render_plantuml(content, "png")
+        return await _render_mermaid(content, "png")
+
+    key = ("png", diagram_digest(diagram_type, content))
+    return await jobs.renders.submit(key, run, priority=jobs.BACKGROUND).result()
+
+
+# Renderers run user-supplied sources, so they only get the environment they
+# need to start, never the backend's secrets
+_RENDERER_ENV = ("PATH", "HOME", "LANG", "LC_ALL", "TMPDIR", "JAVA_HOME")
+_RENDERER_ENV_PREFIXES = ("PUPPETEER_",)
+
+
+def _renderer_env() -> Dict[str, str]:
+    return {
+        name: value
+        for name, value in os.environ.items()
+        if name in _RENDERER_ENV or name.startswith(_RENDERER_ENV_PREFIXES)
+    }
+
+
+async def _run(cmd: List[str], stdin: Optional[bytes] = None) -> bytes:
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=_renderer_env(),
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            proc.communicate(stdin), timeout=settings.render_timeout
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise RenderError(f"{cmd[0]} timed out")
+    if proc.returncode != 0:
+        raise RenderError(stderr.decode("utf-8", "replace").strip() or cmd[0])
+    return stdout
+
+
+def _plantuml_cmd(fmt: str, *options: str) -> List[str]:
+    return [
+        "java",
+        "-Djava.awt.headless=true",
+        # No !include of local files or URLs, no %getenv
+        "-DPLANTUML_SECURITY_PROFILE=SANDBOX",
+        f"-DPLANTUML_LIMIT_SIZE={settings.plantuml_limit_size}",
+        "-jar",
+        settings.plantuml_jar,
+        f"-t{fmt}",
+        "-pipe",
+        "-charset",
+        "UTF-8",
+        *options,
+    ]
+
+
+# Largest image a PlantUML process may send back for one diagram
+_MAX_PLANTUML_OUTPUT = 64 * 1024 * 1024
+
+
+class PlantUMLProcess:
+    """A PlantUML jar in -pipe mode that renders one diagram at a time.
+
+    Diagrams are written to its stdin and each image is followed by a
+    random delimiter on stdout. Errors are reported in-band, as lines with
+    "ERROR", the line number and the message instead of an image. A
+    process whose output may be out of step with its input, after a timeout
+    or a cancelled render, is killed and started again on next use.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._delimiter = b""
+
+    async def _start(self):
+        delimiter = f"--designrepo-{secrets.token_hex(16)}--"
+        self._proc = await asyncio.create_subprocess_exec(
+            *_plantuml_cmd(self.fmt, "-pipeNoStderr", "-pipedelimitor", delimiter),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=_renderer_env(),
+            limit=_MAX_PLANTUML_OUTPUT,
+        )
+        self._delimiter = delimiter.encode("ascii") + b"\n"
+
+    def kill(self):
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+        self._proc = None
+
+    async def render(self, source: str) -> bytes:
+        """Render a source holding exactly one @start/@end block."""
+        if self._proc is None or self._proc.returncode is not None:
+            await self._start()
+        try:
+            self._proc.stdin.write(source.encode("utf-8"))
+            await self._proc.stdin.drain()
+            output = await asyncio.wait_for(
+                self._proc.stdout.readuntil(self._delimiter),
+                timeout=settings.render_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.kill()
+            raise RenderError("PlantUML timed out")
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            self.kill()
+            raise RenderError("PlantUML stopped unexpectedly")
+        except BaseException:
+            # Cancelled while the image was pending; it must not be read
+            # as the answer to the next diagram
+            self.kill()
+            raise
+        output = output[: -len(self._delimiter)]
+        if output.startswith(b"ERROR\n"):
+            _, line, message = output.decode("utf-8", "replace").split("\n", 2)
+            raise RenderError(f"Line {line}: {message.strip()}")
+        return output
+
+
+class PlantUMLPool:
+    """Idle PlantUML processes for one output format, reused through a queue."""
+
+    def __init__(self, fmt: str, size: int):
+        self.fmt = fmt
+        self.size = size
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._started = 0
+
+    async def render(self, source: str) -> bytes:
+        if self._idle.empty() and self._started < self.size:
+            self._started += 1
+            process = PlantUMLProcess(self.fmt)
+        else:
+            process = await self._idle.get()
+        try:
+            return await process.render(source)
+        finally:
+            self._idle.put_nowait(process)
+
+
+_plantuml_pools: Dict[str, PlantUMLPool] = {}
+
+
+def _single_diagram(content: str) -> Optional[str]:
+    """The source as one @start/@end block, for a PlantUML -pipe process.
+
+    Returns None for anything the pipe would split differently, such as
+    several diagrams in one source, which is rendered in a process of its
+    own instead.
+    """
+    lines = content.splitlines()
+    markers = [
+        i
+        for i, line in enumerate(lines)
+        if line.lstrip().startswith(("@start", "@end"))
+    ]
+    if not markers:
+        return "@startuml\n" + "\n".join(lines) + "\n@enduml\n"
+    if len(markers) != 2:
+        return None
+    start, end = markers
+    if not (
+        lines[start].lstrip().startswith("@start")
+        and lines[end].lstrip().startswith("@end")
+    ):
+        return None
+    return "\n".join(lines[start : end + 1]) + "\n"
+
+
+async def _fetch(method: str, url: str, **kwargs) -> bytes:
+    async with httpx.AsyncClient(timeout=settings.render_timeout) as client:
+        resp = await client.request(method, url, **kwargs)
+    if resp.status_code != 200:
+        raise RenderError(f"Renderer returned HTTP {resp.status_code}")
+    return resp.content
+
+
+async def _render_plantuml(content: str, fmt: str = "svg") -> bytes:
+    if settings.plantuml_jar:
+        source = _single_diagram(content)
+        if source is None:
+            return await _run(_plantuml_cmd(fmt), content.encode("utf-8"))
+        pool = _plantuml_pools.get(fmt)
+        if pool is None:
+            pool = _plantuml_pools[fmt] = PlantUMLPool(fmt, settings.render_workers)
+        return await pool.render(source)
+    encoded = encode_source("plantuml", content)
+    if len(encoded) <= settings.render_max_url_length:
+        return await _fetch("GET", f"{settings.plantuml_server}/{fmt}/{encoded}")
+    # Too long for a GET URL even when compressed; POST the raw source instead
+    return await _fetch(
+        "POST",
+        f"{settings.plantuml_server}/{fmt}",
+        content=content.encode("utf-8"),
+        headers={"Content-Type": "text/plain; charset=utf-8"},
+    )
+
+
+async def _render_mermaid(content: str, fmt: str = "svg") -> bytes:
+    if settings.mermaid_cli:
+        # mermaid-cli only reads from and writes to files
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "diagram.mmd")
+            out = os.path.join(tmp, f"diagram.{fmt}")
+            with open(src, "w", encoding="utf-8") as f:
+                f.write(content)
+            cmd = [settings.mermaid_cli, "-i", src, "-o", out]
+            if settings.mermaid_puppeteer_config:
+                cmd += ["-p", settings.mermaid_puppeteer_config]
+            await _run(cmd)
+            with open(out, "rb") as f:
+                return f.read()
+    encoded = encode_source("mermaid", content)
+    if fmt == "png":
+        return await _fetch(
+            "GET",
+            f"{settings.mermaid_server}/img/{encoded}",
+            params={"type": "png", "width": settings.thumbnail_width},
+        )
+    return await _fetch("GET", f"{settings.mermaid_server}/svg/{encoded}")
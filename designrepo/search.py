@@ -0,0 +1,150 @@
+"""Full-text search over diagram names, notes and content labels.
+
+Each diagram has a DiagramSearch row holding its name and a search
+document: the notes followed by the labels extracted from the content
+(words of PlantUML/Mermaid source, cell values of draw.io XML). The row is
+rewritten whenever a save changes any of them.
+
+On Postgres the row is matched through a GIN index on a weighted tsvector
+(name above document) and a trigram index on the name, which also serves
+partial-word matches while typing. Other databases fall back to LIKE
+matching, which is fine for local development.
+"""
+
+import html
+import re
+import xml.etree.ElementTree as ET
+from typing import List
+
+from sqlalchemy import case, func, literal_column, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .models import DiagramSearch, Repository
+
+TS_CONFIG = "english"
+# Keep the indexed document, and so the index, bounded for huge diagrams
+MAX_DOCUMENT_LENGTH = 100_000
+
+_WORD = re.compile(r"\w[\w.-]*")
+_TAG = re.compile(r"<[^>]+>")
+# Directives, styling and comments carry no searchable labels
+_SKIP_LINE = re.compile(r"^\s*(@|!|'|%%|skinparam\b|style\b|classDef\b)")
+
+
+def vector_sql(prefix: str = "") -> str:
+    """The weighted tsvector expression indexed by ix_diagramsearch_vector."""
+    return (
+        f"(setweight(to_tsvector('{TS_CONFIG}', {prefix}name), 'A') || "
+        f"setweight(to_tsvector('{TS_CONFIG}', {prefix}document), 'B'))"
+    )
+
+
+def extract_labels(diagram_type: str, content: str) -> str:
+    """Searchable text of a diagram body."""
+    if diagram_type == "drawio":
+        try:
+            root = ET.fromstring(content)
+        except ET.ParseError:
+            root = None
+        if root is not None:
+            labels = []
+            for element in root.iter():
+                for attr in ("name", "value", "label"):
+                    value = element.get(attr)
+                    if value and (attr != "name" or element.tag == "diagram"):
+                        labels.append(html.unescape(_TAG.sub(" ", value)))
+            return " ".join(" ".join(labels).split())
+    return " ".join(
+        " ".join(_WORD.findall(line))
+        for line in content.splitlines()
+        if not _SKIP_LINE.match(line)
+    )
+
+
+def document(diagram_type: str, content: str, notes: str) -> str:
+    text = f"{notes}\n{extract_labels(diagram_type, content)}"
+    return text[:MAX_DOCUMENT_LENGTH]
+
+
+def _dialect(session: AsyncSession):
+    return postgresql if session.bind.dialect.name == "postgresql" else sqlite
+
+
+async def index_diagram(
+    session: AsyncSession,
+    diagram_id: int,
+    repository_id: int,
+    name: str,
+    diagram_type: str,
+    content: str,
+    notes: str,
+):
+    """Create or refresh a diagram's search row in the caller's transaction."""
+    values = {
+        "repository_id": repository_id,
+        "name": name,
+        "document": document(diagram_type, content, notes),
+    }
+    await session.execute(
+        _dialect(session)
+        .insert(DiagramSearch)
+        .values(diagram_id=diagram_id, **values)
+        .on_conflict_do_update(index_elements=["diagram_id"], set_=values)
+    )
+
+
+async def rename_diagram(session: AsyncSession, diagram_id: int, name: str):
+    """Update only the name of a diagram's search row."""
+    await session.execute(
+        DiagramSearch.__table__.update()
+        .where(DiagramSearch.diagram_id == diagram_id)
+        .values(name=name)
+    )
+
+
+async def search(
+    session: AsyncSession, query: str, limit: int = 20, offset: int = 0
+) -> List:
+    """Diagrams matching query across all repositories, best match first.
+
+    Rows have diagram_id, repository_id, repository_name, name and rank.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    columns = [
+        DiagramSearch.diagram_id,
+        DiagramSearch.repository_id,
+        Repository.name.label("repository_name"),
+        DiagramSearch.name,
+    ]
+    if session.bind.dialect.name == "postgresql":
+        ts_query = func.websearch_to_tsquery(TS_CONFIG, query)
+        vector = literal_column(vector_sql("diagramsearch."))
+        rank = func.ts_rank(vector, ts_query) + func.similarity(
+            DiagramSearch.name, query
+        )
+        matches = or_(
+            vector.op("@@")(ts_query),
+            DiagramSearch.name.icontains(query, autoescape=True),
+        )
+    else:
+        terms = query.split()
+        rank = case((DiagramSearch.name.icontains(query, autoescape=True), 1), else_=0)
+        matches = True
+        for term in terms:
+            matches = (
+                DiagramSearch.name.icontains(term, autoescape=True)
+                | DiagramSearch.document.icontains(term, autoescape=True)
+            ) & matches
+    statement = (
+        select(*columns, rank.label("rank"))
+        .join(Repository, Repository.id == DiagramSearch.repository_id)
+        .where(matches)
+        .order_by(rank.desc(), DiagramSearch.name, DiagramSearch.diagram_id)
+        .limit(limit)
+        .offset(offset)
+    )
+    return (await session.exec(statement)).all()
@@ -1,19 +1,134 @@
 from typing import Optional
-from pydantic import Field
+from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+ASYNC_DB_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
 class Settings(BaseSettings):
     db_url: str = "sqlite:///reflex.db"
+    # Used by State handlers through rx.asession(); derived from db_url
+    # by swapping in the asyncpg / aiosqlite driver when not set.
+    async_db_url: Optional[str] = None
     openai_api_key: str = Field(validation_alias="OPENAI_API_KEY")
+    openai_base_url: Optional[str] = None
+    openai_timeout: float = 120.0
+    openai_connect_timeout: float = 10.0
+    openai_max_retries: int = 3
+    openai_max_connections: int = 100
+    openai_max_keepalive_connections: int = 20
+    openai_keepalive_expiry: float = 30.0
+    ai_stream_interval: float = 0.25
+    # Finished AI completions are reused for identical requests for this
+    # long; at most ai_cache_size of them are kept
+    ai_cache_ttl: float = 3600.0
+    ai_cache_size: int = 256
+    # Long-running work runs on in-process job queues, one per kind of work.
+    # AI calls mostly wait on the API, so many can run at once; thumbnail
+    # jobs queue for a render_workers slot behind waiting previews.
+    ai_workers: int = 32
+    thumbnail_workers: int = 2
     oidc_issuer: str = ""
     oidc_client_id: str = ""
     oidc_client_secret: str = ""
     oidc_redirect_uri: Optional[str] = None
+    oidc_metadata_ttl: float = 3600.0
+    oidc_timeout: float = 10.0
+    # Validate the ID token locally and only call userinfo as a fallback
+    oidc_verify_id_token: bool = True
+    oidc_clock_skew: int = 60
+    # Signing key for session tokens; defaults to oidc_client_secret. One of
+    # them must be set when OIDC is enabled.
+    session_secret: str = ""
+    session_max_age: int = 3600
+    # Lifetime of the signed URLs the diagrams.net viewer loads draw.io
+    # documents from
+    source_token_max_age: int = 24 * 3600
+    # How long a cached repository / diagram listing may be served before it
+    # is re-read, to pick up writes made through other backend replicas
+    listing_cache_ttl: float = 60.0
+    # Rows per page of the repository / diagram sidebars; further pages are
+    # loaded as the user scrolls
+    sidebar_page_size: int = 100
+    # Delay before re-establishing the LISTEN connection for change
+    # notifications after it drops (Postgres only)
+    sync_reconnect_seconds: float = 5.0
+
+    # Diagram rendering. When plantuml_jar / mermaid_cli are set, diagrams are
+    # rendered locally; otherwise the backend proxies the public renderers.
+    # Rendered SVGs are cached in render_cache_dir keyed by content hash.
+    # Sources too long for a URL are stored as diagram blobs instead, so the
+    # directory can be local to each backend replica.
+    render_base_url: Optional[str] = None
+    render_cache_dir: str = ".render-cache"
+    # The oldest cache entries are deleted once the directory grows past
+    # render_cache_max_bytes; checked every render_cache_sweep_interval
+    render_cache_max_bytes: int = 1024 * 1024 * 1024
+    render_cache_sweep_interval: float = 600.0
+    # At most render_workers renders run at once, previews first. With
+    # plantuml_jar, up to as many PlantUML processes per output format are
+    # kept running between them.
+    render_workers: int = 4
+    render_timeout: float = 30.0
+    render_max_url_length: int = 4000
+    preview_url_cache_size: int = 64
+    preview_idle_seconds: float = 1.0
+    plantuml_jar: str = ""
+    # Largest image side, in pixels, the local PlantUML jar will draw
+    plantuml_limit_size: int = 4096
+    plantuml_server: str = "https://www.plantuml.com/plantuml"
+    mermaid_cli: str = ""
+    mermaid_puppeteer_config: str = ""
+    mermaid_server: str = "https://mermaid.ink"
+    # Diagram list thumbnails are rendered on the job queue after a save and
+    # stored in render_cache_dir, downscaled to WebP.
+    thumbnail_width: int = 320
+    # A diagram whose thumbnail failed to render gets the placeholder until
+    # this much time has passed, and is then rendered again
+    thumbnail_retry_seconds: float = 3600.0
+
+    # draw.io uploads are posted to /upload/drawio, read as they arrive and
+    # rejected once they pass upload_max_bytes, both as uploaded and once all
+    # compressed pages are inflated. The XML is stored as a diagram blob and
+    # only referenced from the session state.
+    upload_max_bytes: int = 20 * 1024 * 1024
+
+    # Compression for stored diagram bodies: "zlib", or "zstd" when the
+    # zstandard package is installed on every backend replica
+    blob_codec: str = "zlib"
+    blob_level: int = 6
+    # Blobs no diagram references, such as unsaved uploads, are deleted once
+    # they are older than blob_orphan_ttl; checked every blob_sweep_interval
+    blob_orphan_ttl: float = 24 * 3600.0
+    blob_sweep_interval: float = 3600.0
+    # Every this many revisions of a diagram store full texts instead of a
+    # delta, bounding the work needed to materialize any revision
+    revision_snapshot_interval: int = 20
 
     model_config = SettingsConfigDict(
         env_file=".env", env_prefix="DESIGNREPO_", extra="ignore"
     )
 
+    @model_validator(mode="after")
+    def _require_session_secret(self) -> "Settings":
+        # Session tokens signed with an empty key could be forged by anyone
+        if self.oidc_issuer and not (self.session_secret or self.oidc_client_secret):
+            raise ValueError(
+                "DESIGNREPO_SESSION_SECRET or DESIGNREPO_OIDC_CLIENT_SECRET must "
+                "be set when OIDC is enabled"
+            )
+        return self
+
+    def get_async_db_url(self) -> str:
+        if self.async_db_url:
+            return self.async_db_url
+        scheme, sep, rest = self.db_url.partition("://")
+        return ASYNC_DB_DRIVERS.get(scheme, scheme) + sep + rest
+
 
 settings = Settings()
@@ -1,17 +1,33 @@
 import reflex as rx
+import asyncio
+import contextlib
 import hashlib
-from typing import List, Optional
-import openai
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
-import urllib.parse
 import zlib
-import base64
+import httpx
 import pendulum
 import pydantic
+from sqlalchemy import tuple_, update
+from sqlalchemy.exc import NoResultFound
+from sqlmodel import select
 from .models import Repository, Diagram, User
-import httpx
+from authlib.common.security import generate_token
 from authlib.integrations.httpx_client import AsyncOAuth2Client
 from .settings import settings
+from . import (
+    ai,
+    auth,
+    blobs,
+    history,
+    listing,
+    oidc,
+    ordering,
+    render,
+    search,
+    sync,
+    thumbnails,
+)
 
 
 class RepositorySchema(pydantic.BaseModel):
@@ -26,7 +42,8 @@ class DiagramSchema(pydantic.BaseModel):
     id: Optional[int] = None
     repository_id: Optional[int] = None
     name: str = ""
-    content: str = ""
+    # The body itself is loaded into the editor fields, not kept here
+    content_digest: str = ""
     diagram_type: str = "plantuml"
     category: str = "to-be"
     notes: str = ""
@@ -37,6 +54,31 @@ class DiagramSchema(pydantic.BaseModel):
     updated_at: Optional[datetime] = None
 
 
+class DiagramSummarySchema(pydantic.BaseModel):
+    """Lightweight diagram row for the sidebar list, without content or notes."""
+
+    id: Optional[int] = None
+    name: str = ""
+    diagram_type: str = "plantuml"
+    category: str = "to-be"
+    order_index: int = 0
+    updated_at: Optional[datetime] = None
+    thumbnail_url: str = ""
+
+
+class RevisionSchema(pydantic.BaseModel):
+    number: int = 0
+    author: str = ""
+    created_at: Optional[datetime] = None
+
+
+class SearchResultSchema(pydantic.BaseModel):
+    diagram_id: int = 0
+    repository_id: int = 0
+    repository_name: str = ""
+    name: str = ""
+
+
 class UserSchema(pydantic.BaseModel):
     id: Optional[int] = None
     sub: str = ""
@@ -53,6 +95,148 @@ class UserSchema(pydantic.BaseModel):
         return f"https://www.gravatar.com/avatar/{email_hash}?d=identicon"
 
 
+def strip_code_fence(text: str) -> str:
+    """Remove a surrounding ``` fence from generated code, even if incomplete."""
+    if not text.startswith("```"):
+        return text
+    body = text.partition("\n")[2].rstrip()
+    if body.endswith("```"):
+        body = body[:-3].rstrip()
+    return body
+
+
+def sort_key(item) -> Tuple[int, int]:
+    """Sidebar order, which is also the keyset pagination cursor."""
+    return (item.order_index, item.id)
+
+
+def _sorted(items: list, complete: bool, boundary) -> list:
+    items = sorted(items, key=sort_key)
+    if complete or boundary is None:
+        return items
+    # Rows that now sort after a partially loaded list arrive with a later page
+    return [item for item in items if sort_key(item) <= boundary]
+
+
+def reordered(
+    items: list, changes: Dict[int, int], complete: bool = True
+) -> Optional[list]:
+    """Apply new ordering keys to an in-memory list and re-sort it.
+
+    complete is False when more pages remain to be loaded. Returns None if
+    a row that is not loaded moved into the list, which must be reloaded.
+    """
+    if not changes:
+        return items
+    boundary = sort_key(items[-1]) if items else None
+    loaded = {item.id for item in items}
+    if not complete and boundary is not None:
+        if any(
+            (order_index, id) <= boundary
+            for id, order_index in changes.items()
+            if id not in loaded
+        ):
+            return None
+    items = [
+        item.model_copy(update={"order_index": changes[item.id]})
+        if item.id in changes
+        else item
+        for item in items
+    ]
+    return _sorted(items, complete, boundary)
+
+
+def upserted(items: list, new_item, complete: bool = True) -> list:
+    """Insert or replace an item (matched on id) in an ordered list."""
+    boundary = sort_key(items[-1]) if items else None
+    items = [item for item in items if item.id != new_item.id]
+    items.append(new_item)
+    return _sorted(items, complete, boundary)
+
+
+def repository_schema(repository) -> RepositorySchema:
+    return RepositorySchema(
+        id=repository.id,
+        name=repository.name,
+        description=repository.description,
+        order_index=repository.order_index,
+        created_at=repository.created_at,
+    )
+
+
+def diagram_summary(diagram) -> DiagramSummarySchema:
+    return DiagramSummarySchema(
+        id=diagram.id,
+        name=diagram.name,
+        diagram_type=diagram.diagram_type,
+        category=diagram.category,
+        order_index=diagram.order_index,
+        updated_at=diagram.updated_at,
+        thumbnail_url=thumbnails.thumbnail_url(
+            diagram.diagram_type, diagram.content_digest
+        ),
+    )
+
+
+def repositories_page(after: Optional[Tuple[int, int]] = None):
+    """Query for the repository sidebar page following the cursor after.
+
+    Served by ix_repository_order_index (see tests/test_query_plans.py).
+    """
+    query = (
+        Repository.select()
+        .order_by(Repository.order_index, Repository.id)
+        .limit(settings.sidebar_page_size + 1)
+    )
+    if after is not None:
+        query = query.where(tuple_(Repository.order_index, Repository.id) > after)
+    return query
+
+
+async def fetch_repositories(
+    after: Optional[Tuple[int, int]] = None,
+) -> List[RepositorySchema]:
+    """Up to sidebar_page_size + 1 repositories following the cursor after."""
+    async with rx.asession() as session:
+        db_repositories = (await session.exec(repositories_page(after))).all()
+        return [repository_schema(p) for p in db_repositories]
+
+
+def diagrams_page(repository_id: int, after: Optional[Tuple[int, int]] = None):
+    """Query for the diagram sidebar page following the cursor after.
+
+    Served by ix_diagram_repository_order (see tests/test_query_plans.py).
+    """
+    # Only fetch the columns needed by the sidebar; content and notes
+    # are loaded on demand by select_diagram.
+    query = (
+        select(
+            Diagram.id,
+            Diagram.name,
+            Diagram.diagram_type,
+            Diagram.category,
+            Diagram.order_index,
+            Diagram.updated_at,
+            Diagram.content_digest,
+        )
+        .where(Diagram.repository_id == repository_id)
+        .order_by(Diagram.order_index, Diagram.id)
+        .limit(settings.sidebar_page_size + 1)
+    )
+    if after is not None:
+        query = query.where(tuple_(Diagram.order_index, Diagram.id) > after)
+    return query
+
+
+async def fetch_diagrams(
+    repository_id: int, after: Optional[Tuple[int, int]] = None
+) -> List[DiagramSummarySchema]:
+    """Up to sidebar_page_size + 1 diagram summaries following the cursor after."""
+    async with rx.asession() as session:
+        db_diagrams = (await session.exec(diagrams_page(repository_id, after))).all()
+        return [diagram_summary(d) for d in db_diagrams]
+
+
 class State(rx.State):
     """The base state for the app."""
 
@@ -61,18 +245,16 @@ class State(rx.State):
     repositories: List[RepositorySchema] = []
     current_repository: Optional[RepositorySchema] = None
 
-    diagrams: List[DiagramSchema] = []
+    diagrams: List[DiagramSummarySchema] = []
     current_diagram: Optional[DiagramSchema] = None
 
     user: Optional[UserSchema] = None
-    oidc_user_sub: str = rx.Cookie("", name="oidc_user_sub")
+    session_token: str = rx.Cookie("", name=auth.SESSION_COOKIE, same_site="lax")
     oidc_state_cookie: str = rx.Cookie("", name="oidc_state")
+    oidc_nonce_cookie: str = rx.Cookie("", name="oidc_nonce")
 
     async def get_oidc_config(self):
-        issuer = settings.oidc_issuer
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"{issuer}/.well-known/openid-configuration")
-            return resp.json()
+        return await oidc.get_config()
 
     async def login(self):
         config = await self.get_oidc_config()
@@ -82,55 +264,88 @@ class State(rx.State):
             scope="openid email profile",
             redirect_uri=settings.oidc_redirect_uri or self.router.url,
         )
-        uri, state = client.create_authorization_url(config["authorization_endpoint"])
+        # The nonce ties the ID token to this login attempt
+        nonce = generate_token()
+        uri, state = client.create_authorization_url(
+            config["authorization_endpoint"], nonce=nonce
+        )
         self.oidc_state_cookie = state
+        self.oidc_nonce_cookie = nonce
         return rx.redirect(uri)
 
     async def handle_callback(self, code, state):
-        if state != self.oidc_state_cookie:
+        if not state or state != self.oidc_state_cookie:
             return rx.toast.error("Invalid OIDC state")
+        nonce = self.oidc_nonce_cookie
+        self.oidc_state_cookie = ""
+        self.oidc_nonce_cookie = ""
 
         config = await self.get_oidc_config()
-        async with httpx.AsyncClient() as client:
-            # Token exchange
-            resp = await client.post(
-                config["token_endpoint"],
-                data={
-                    "grant_type": "authorization_code",
-                    "code": code,
-                    "redirect_uri": settings.oidc_redirect_uri or self.router.url,
-                    "client_id": settings.oidc_client_id,
-                    "client_secret": settings.oidc_client_secret,
-                },
-            )
-            token = resp.json()
-            access_token = token.get("access_token")
-
-            # User info
+        client = oidc.get_http_client()
+        # Token exchange
+        resp = await client.post(
+            config["token_endpoint"],
+            data={
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": settings.oidc_redirect_uri or self.router.url,
+                "client_id": settings.oidc_client_id,
+                "client_secret": settings.oidc_client_secret,
+            },
+        )
+        token = resp.json()
+        access_token = token.get("access_token")
+
+        # Identity from the ID token, validated locally against the cached JWKS
+        user_info = {}
+        id_token = token.get("id_token")
+        if id_token and settings.oidc_verify_id_token:
+            try:
+                user_info = await oidc.verify_id_token(id_token, nonce)
+            except (oidc.TokenValidationError, httpx.HTTPError):
+                # Also when the discovery document or JWKS cannot be fetched
+                user_info = {}
+
+        # Fall back to the userinfo endpoint when the ID token is missing,
+        # invalid, or does not carry the profile claims
+        if "email" not in user_info:
             resp = await client.get(
                 config["userinfo_endpoint"],
                 headers={"Authorization": f"Bearer {access_token}"},
             )
-            user_info = resp.json()
-
-            sub = user_info["sub"]
-            email = user_info.get("email", "")
-            name = user_info.get("name", "")
-            picture = user_info.get("picture", "")
-
-            with rx.session() as session:
-                user = session.exec(User.select().where(User.sub == sub)).first()
-                if not user:
-                    user = User(sub=sub, email=email, name=name, picture=picture)
-                    session.add(user)
-                else:
-                    user.email = email
-                    user.name = name
-                    user.picture = picture
-                session.commit()
-
-            self.oidc_user_sub = sub
-            self.user = UserSchema(sub=sub, email=email, name=name, picture=picture)
+            userinfo = resp.json()
+            if user_info and userinfo.get("sub") != user_info["sub"]:
+                return rx.toast.error("OIDC userinfo does not match ID token")
+            user_info = {**user_info, **userinfo}
+
+        sub = user_info["sub"]
+        email = user_info.get("email", "")
+        name = user_info.get("name", "")
+        picture = user_info.get("picture", "")
+
+        async with rx.asession() as session:
+            user = (await session.exec(User.select().where(User.sub == sub))).first()
+            if not user:
+                user = User(sub=sub, email=email, name=name, picture=picture)
+                session.add(user)
+            else:
+                user.email = email
+                user.name = name
+                user.picture = picture
+            await session.commit()
+            await session.refresh(user)
+            self.user = UserSchema(
+                id=user.id,
+                sub=user.sub,
+                email=user.email,
+                name=user.name,
+                picture=user.picture,
+            )
+
+        self.session_token = auth.issue_session_token(self._session_profile())
+
+    def _session_profile(self) -> dict:
+        return self.user.model_dump(exclude={"gravatar_url"})
 
     async def on_load(self):
         if not settings.oidc_issuer:
@@ -139,6 +354,7 @@ class State(rx.State):
                 email="local@example.com",
                 name="Local User",
             )
+            self._watch()
             await self.load_repositories()
             return
 
@@ -149,24 +365,43 @@ class State(rx.State):
             await self.handle_callback(code, state)
             return rx.redirect("/")
 
-        if self.oidc_user_sub:
-            with rx.session() as session:
-                user = session.exec(
-                    User.select().where(User.sub == self.oidc_user_sub)
-                ).first()
-                if user:
-                    self.user = UserSchema(
-                        id=user.id,
-                        sub=user.sub,
-                        email=user.email,
-                        name=user.name,
-                        picture=user.picture,
-                    )
+        if self.session_token:
+            profile, fresh = auth.load_session_token(self.session_token)
+            if profile and fresh:
+                self.user = UserSchema(**profile)
+            elif profile:
+                # Token expired; re-check the user before renewing it
+                async with rx.asession() as session:
+                    user = (
+                        await session.exec(
+                            User.select().where(User.sub == profile["sub"])
+                        )
+                    ).first()
+                    if user:
+                        self.user = UserSchema(
+                            id=user.id,
+                            sub=user.sub,
+                            email=user.email,
+                            name=user.name,
+                            picture=user.picture,
+                        )
+                        self.session_token = auth.issue_session_token(
+                            self._session_profile()
+                        )
+            if not self.user:
+                self.session_token = ""
+        self._watch()
         await self.load_repositories()
 
+    def _watch(self):
+        sync.watch(
+            self.router.session.client_token,
+            self.current_repository.id if self.current_repository else None,
+        )
+
     def logout(self):
         self.user = None
-        self.oidc_user_sub = ""
+        self.session_token = ""
         return rx.redirect("/")
 
     # Form fields
@@ -175,6 +410,13 @@ class State(rx.State):
 
     diagram_name: str = ""
     diagram_content: str = ""
+    # Content shown in the preview; lags diagram_content until the editor
+    # goes idle so that typing does not re-render the preview.
+    _preview_content: str = ""
+    _preview_generation: int = 0
+    # draw.io documents are stored as diagram blobs and referenced by digest
+    # instead of being held in diagram_content.
+    _drawio_digest: str = ""
     diagram_type: str = "plantuml"
     diagram_category: str = "to-be"
     diagram_notes: str = ""
@@ -222,8 +464,30 @@ class State(rx.State):
 
     def set_diagram_content(self, value: str):
         self.diagram_content = value
-
-    def set_diagram_type(self, value: str):
+        return State.refresh_preview_when_idle
+
+    async def refresh_preview(self):
+        """Show the current diagram content in the preview immediately."""
+        self._preview_generation += 1
+        await render.store_preview_source(self.diagram_type, self.diagram_content)
+        self._preview_content = self.diagram_content
+
+    @rx.event(background=True)
+    async def refresh_preview_when_idle(self):
+        """Refresh the preview once no edits arrived for preview_idle_seconds."""
+        async with self:
+            self._preview_generation += 1
+            generation = self._preview_generation
+        await asyncio.sleep(settings.preview_idle_seconds)
+        async with self:
+            if generation == self._preview_generation:
+                content = self.diagram_content
+                await render.store_preview_source(self.diagram_type, content)
+                self._preview_content = content
+
+    async def set_diagram_type(self, value: str):
+        # The preview URL of the other type may need the source stored
+        await render.store_preview_source(value, self._preview_content)
         self.diagram_type = value
 
     def set_diagram_category(self, value: str):
@@ -260,70 +524,73 @@ class State(rx.State):
 
     @rx.var
     def plantuml_url(self) -> str:
-        if not self.diagram_content or self.diagram_type != "plantuml":
+        if not self._preview_content or self.diagram_type != "plantuml":
             return ""
         try:
-            hex_data = self.diagram_content.encode("utf-8").hex()
-            return f"http://www.plantuml.com/plantuml/svg/~h{hex_data}"
+            return render.preview_url("plantuml", self._preview_content)
         except:
             return ""
 
     @rx.var
     def drawio_url(self) -> str:
-        if not self.diagram_content or self.diagram_type != "drawio":
-            return ""
-        try:
-            encoded_xml = urllib.parse.quote(self.diagram_content)
-            return f"https://viewer.diagrams.net/?xml={encoded_xml}"
-        except:
+        if not self._drawio_digest or self.diagram_type != "drawio":
             return ""
+        return render.drawio_viewer_url(self._drawio_digest, self.router.page.host)
+
+    @rx.var
+    def drawio_upload_url(self) -> str:
+        """Backend route the editor posts draw.io files to."""
+        return f"{render.base_url()}/upload/drawio"
+
+    @rx.var
+    def has_diagram_content(self) -> bool:
+        if self.diagram_type == "drawio":
+            return bool(self._drawio_digest)
+        return bool(self.diagram_content)
 
     @rx.var
     def mermaid_url(self) -> str:
-        if not self.diagram_content or self.diagram_type != "mermaid":
+        if not self._preview_content or self.diagram_type != "mermaid":
             return ""
         try:
-            # Mermaid encoding for mermaid.ink
-            content_bytes = self.diagram_content.encode("utf-8")
-            base64_content = base64.b64encode(content_bytes).decode("utf-8")
-            return f"https://mermaid.ink/svg/{base64_content}"
+            return render.preview_url("mermaid", self._preview_content)
         except:
             return ""
 
+    has_more_repositories: bool = False
+
     async def load_repositories(self):
-        with rx.session() as session:
-            db_repositories = session.exec(
-                Repository.select().order_by(Repository.order_index)
-            ).all()
-            self.repositories = [
-                RepositorySchema(
-                    id=p.id,
-                    name=p.name,
-                    description=p.description,
-                    order_index=p.order_index,
-                    created_at=p.created_at,
-                )
-                for p in db_repositories
-            ]
+        """Load the first page of repositories, which is shared and cached."""
+        page = await listing.repositories.get("all", fetch_repositories)
+        self.has_more_repositories = len(page) > settings.sidebar_page_size
+        self.repositories = page[: settings.sidebar_page_size]
+
+    async def load_more_repositories(self, visible: bool = True):
+        """Append the next page of repositories once the list end is visible."""
+        if not visible or not self.has_more_repositories or not self.repositories:
+            return
+        page = await fetch_repositories(after=sort_key(self.repositories[-1]))
+        self.has_more_repositories = len(page) > settings.sidebar_page_size
+        self.repositories = self.repositories + page[: settings.sidebar_page_size]
 
     async def add_repository(self):
         if not self.new_repository_name:
             return rx.toast.error("Repository name is required")
-        with rx.session() as session:
+        async with rx.asession() as session:
             # Check for duplicate repository name
-            existing = session.exec(
-                Repository.select().where(Repository.name == self.new_repository_name)
+            existing = (
+                await session.exec(
+                    Repository.select().where(
+                        Repository.name == self.new_repository_name
+                    )
+                )
             ).first()
             if existing:
                 return rx.toast.error(
                     f"Repository '{self.new_repository_name}' already exists."
                 )
 
-            # Get max order_index
-            max_order = session.exec(
-                Repository.select().order_by(Repository.order_index.desc())
-            ).first()
-            new_order = (max_order.order_index + 1) if max_order else 0
+            new_order = await ordering.next_order_index(session, Repository)
 
             repository = Repository(
                 name=self.new_repository_name,
@@ -331,9 +598,19 @@ class State(rx.State):
                 order_index=new_order,
             )
             session.add(repository)
-            session.commit()
-            session.refresh(repository)
-            await self.load_repositories()
+            await session.commit()
+            await session.refresh(repository)
+            listing.repositories.invalidate()
+            summary = repository_schema(repository)
+            self.repositories = upserted(
+                self.repositories, summary, not self.has_more_repositories
+            )
+            await sync.publish(
+                "repository",
+                None,
+                self.router.session.client_token,
+                item=summary.model_dump(mode="json"),
+            )
             self.new_repository_name = ""
             self.new_repository_description = ""
             self.show_repository_modal = False
@@ -341,34 +618,33 @@ class State(rx.State):
     async def select_repository(self, repository: RepositorySchema):
         self.current_repository = repository
         self.current_diagram = None
+        self._watch()
         await self.load_diagrams()
 
+    has_more_diagrams: bool = False
+
     async def load_diagrams(self):
+        """Load the first page of diagrams, which is shared and cached."""
         if not self.current_repository:
             return
-        with rx.session() as session:
-            db_diagrams = session.exec(
-                Diagram.select()
-                .where(Diagram.repository_id == self.current_repository.id)
-                .order_by(Diagram.order_index)
-            ).all()
-            self.diagrams = [
-                DiagramSchema(
-                    id=d.id,
-                    repository_id=d.repository_id,
-                    name=d.name,
-                    content=d.content,
-                    diagram_type=d.diagram_type,
-                    category=d.category,
-                    notes=d.notes,
-                    last_ai_prompt=d.last_ai_prompt,
-                    last_ai_notes_prompt=d.last_ai_notes_prompt,
-                    order_index=d.order_index,
-                    created_at=d.created_at,
-                    updated_at=d.updated_at,
-                )
-                for d in db_diagrams
-            ]
+        repository_id = self.current_repository.id
+        page = await listing.diagrams.get(
+            repository_id, lambda: fetch_diagrams(repository_id)
+        )
+        self.has_more_diagrams = len(page) > settings.sidebar_page_size
+        self.diagrams = page[: settings.sidebar_page_size]
+
+    async def load_more_diagrams(self, visible: bool = True):
+        """Append the next page of diagrams once the list end is visible."""
+        if not visible or not self.has_more_diagrams or not self.current_repository:
+            return
+        if not self.diagrams:
+            return
+        page = await fetch_diagrams(
+            self.current_repository.id, after=sort_key(self.diagrams[-1])
+        )
+        self.has_more_diagrams = len(page) > settings.sidebar_page_size
+        self.diagrams = self.diagrams + page[: settings.sidebar_page_size]
 
     async def add_diagram(self):
         if not self.current_repository:
@@ -376,12 +652,14 @@ class State(rx.State):
         if not self.new_diagram_name:
             return rx.toast.error("Diagram name is required")
 
-        with rx.session() as session:
+        async with rx.asession() as session:
             # Check for duplicate diagram name in the same repository
-            existing = session.exec(
-                Diagram.select().where(
-                    (Diagram.repository_id == self.current_repository.id)
-                    & (Diagram.name == self.new_diagram_name)
+            existing = (
+                await session.exec(
+                    Diagram.select().where(
+                        (Diagram.repository_id == self.current_repository.id)
+                        & (Diagram.name == self.new_diagram_name)
+                    )
                 )
             ).first()
             if existing:
@@ -389,26 +667,43 @@ class State(rx.State):
                     f"Diagram '{self.new_diagram_name}' already exists in this repository."
                 )
 
-            # Get max order_index for this repository
-            max_order = session.exec(
-                Diagram.select()
-                .where(Diagram.repository_id == self.current_repository.id)
-                .order_by(Diagram.order_index.desc())
-            ).first()
-            new_order = (max_order.order_index + 1) if max_order else 0
+            new_order = await ordering.next_order_index(
+                session,
+                Diagram,
+                Diagram.repository_id == self.current_repository.id,
+            )
 
             diagram = Diagram(
                 repository_id=self.current_repository.id,
                 name=self.new_diagram_name,
-                content="",  # Default empty
+                content_digest=await blobs.put(session, ""),  # Default empty
                 diagram_type="plantuml",  # Default
                 category="to-be",  # Default
                 notes="",  # Default empty
                 order_index=new_order,
             )
             session.add(diagram)
-            session.commit()
-            await self.load_diagrams()
+            await session.flush()
+            await search.index_diagram(
+                session,
+                diagram.id,
+                diagram.repository_id,
+                diagram.name,
+                diagram.diagram_type,
+                "",
+                diagram.notes,
+            )
+            await session.commit()
+            await session.refresh(diagram)
+            listing.diagrams.invalidate(diagram.repository_id)
+            summary = diagram_summary(diagram)
+            self.diagrams = upserted(self.diagrams, summary, not self.has_more_diagrams)
+            await sync.publish(
+                "diagram",
+                diagram.repository_id,
+                self.router.session.client_token,
+                item=summary.model_dump(mode="json"),
+            )
             self.new_diagram_name = ""
             self.current_diagram = None
             self.show_diagram_modal = False
@@ -418,85 +713,329 @@ class State(rx.State):
     def set_is_editing(self, value: bool):
         self.is_editing = value
 
-    def select_diagram(self, diagram: DiagramSchema):
-        self.current_diagram = diagram
-        self.diagram_name = diagram.name
-        self.diagram_content = diagram.content
-        self.diagram_type = diagram.diagram_type
-        self.diagram_notes = diagram.notes
-        self.ai_prompt = diagram.last_ai_prompt
-        self.ai_notes_prompt = diagram.last_ai_notes_prompt
-
-    def edit_diagram(self, diagram: DiagramSchema):
-        self.select_diagram(diagram)
+    async def select_diagram(self, diagram: DiagramSummarySchema):
+        """Load the full diagram row for the given summary into the editor."""
+        async with rx.asession() as session:
+            d = await session.get(Diagram, diagram.id)
+            if not d:
+                return
+            self.current_diagram = DiagramSchema(
+                id=d.id,
+                repository_id=d.repository_id,
+                name=d.name,
+                content_digest=d.content_digest,
+                diagram_type=d.diagram_type,
+                category=d.category,
+                notes=d.notes,
+                last_ai_prompt=d.last_ai_prompt,
+                last_ai_notes_prompt=d.last_ai_notes_prompt,
+                order_index=d.order_index,
+                created_at=d.created_at,
+                updated_at=d.updated_at,
+            )
+            content = await blobs.get(session, d.content_digest)
+        self.revisions = []
+        self.diagram_name = self.current_diagram.name
+        self.diagram_type = self.current_diagram.diagram_type
+        await self._set_content(content, self.current_diagram.content_digest)
+        self.diagram_category = self.current_diagram.category
+        self.diagram_notes = self.current_diagram.notes
+        self.ai_prompt = self.current_diagram.last_ai_prompt
+        self.ai_notes_prompt = self.current_diagram.last_ai_notes_prompt
+
+    async def _set_content(self, content: str, digest: Optional[str] = None):
+        """Load content into the editor; digest is its blob if already stored."""
+        if self.diagram_type == "drawio":
+            if digest is None:
+                async with rx.asession() as session:
+                    digest = await blobs.put(session, content)
+                    await session.commit()
+            self._drawio_digest = digest
+            self.diagram_content = ""
+        else:
+            self._drawio_digest = ""
+            self.diagram_content = content
+        await self.refresh_preview()
+
+    async def _diagram_source(self) -> Optional[str]:
+        """Content of the diagram being edited, or None if it was lost."""
+        if self.diagram_type != "drawio" or not self._drawio_digest:
+            return self.diagram_content
+        async with rx.asession() as session:
+            try:
+                return await blobs.get(session, self._drawio_digest)
+            except NoResultFound:
+                return None
+
+    async def edit_diagram(self, diagram: DiagramSummarySchema):
+        await self.select_diagram(diagram)
         self.is_editing = True
 
-    def show_diagram(self, diagram: DiagramSchema):
+    async def show_diagram(self, diagram: DiagramSummarySchema):
         self.is_editing = False
-        self.select_diagram(diagram)
-        pass
+        await self.select_diagram(diagram)
+
+    def _changed_fields(self, content: str) -> dict:
+        """Editor fields that differ from the diagram as it was loaded."""
+        base = self.current_diagram
+        values = {
+            "name": self.diagram_name,
+            "diagram_type": self.diagram_type,
+            "category": self.diagram_category,
+            "notes": self.diagram_notes,
+            "last_ai_prompt": self.ai_prompt,
+            "last_ai_notes_prompt": self.ai_notes_prompt,
+            "content_digest": blobs.content_digest(content),
+        }
+        return {k: v for k, v in values.items() if getattr(base, k) != v}
+
+    async def _record_revision(self, session, content: str) -> bool:
+        """Add a history revision and store the body for the pending save.
+
+        Returns False if the diagram no longer exists.
+        """
+        # Lock the row so concurrent saves record revisions in commit order
+        stored = (
+            await session.execute(
+                select(Diagram.content_digest, Diagram.notes)
+                .where(Diagram.id == self.current_diagram.id)
+                .with_for_update()
+            )
+        ).one_or_none()
+        if stored is None:
+            return False
+        digest = blobs.content_digest(content)
+        before = {
+            "content": content
+            if stored.content_digest == digest
+            else await blobs.get(session, stored.content_digest),
+            "notes": stored.notes,
+        }
+        after = {"content": content, "notes": self.diagram_notes}
+        if before != after:
+            await history.record(
+                session,
+                self.current_diagram.id,
+                before,
+                after,
+                author=self.user.email if self.user else "",
+            )
+        if stored.content_digest != digest:
+            await blobs.put(session, content)
+        return True
 
     async def save_diagram(self):
         if not self.current_diagram:
             return
         if not self.diagram_name:
             return rx.toast.error("Diagram name is required")
+        content = await self._diagram_source()
+        if content is None:
+            return rx.toast.error(
+                "The uploaded file has expired, please upload it again"
+            )
+        changed = self._changed_fields(content)
+        if not changed:
+            self.is_editing = False
+            return
+
+        async with rx.asession() as session:
+            if "name" in changed:
+                # Check for duplicate diagram name (excluding the current one)
+                existing = (
+                    await session.exec(
+                        Diagram.select().where(
+                            (
+                                Diagram.repository_id
+                                == self.current_diagram.repository_id
+                            )
+                            & (Diagram.name == self.diagram_name)
+                            & (Diagram.id != self.current_diagram.id)
+                        )
+                    )
+                ).first()
+                if existing:
+                    return rx.toast.error(
+                        f"Another diagram named '{self.diagram_name}' already exists in this repository."
+                    )
 
-        with rx.session() as session:
-            # Check for duplicate diagram name (excluding the current one)
-            existing = session.exec(
-                Diagram.select().where(
-                    (Diagram.repository_id == self.current_diagram.repository_id)
-                    & (Diagram.name == self.diagram_name)
-                    & (Diagram.id != self.current_diagram.id)
+            if "content_digest" in changed or "notes" in changed:
+                if not await self._record_revision(session, content):
+                    return rx.toast.error("This diagram no longer exists.")
+            changed["updated_at"] = datetime.now(tz=pendulum.local_timezone())
+            # Only the modified columns are written; RETURNING gives back the
+            # sidebar summary without another query.
+            diagram = (
+                await session.execute(
+                    update(Diagram)
+                    .where(Diagram.id == self.current_diagram.id)
+                    .values(**changed)
+                    .returning(
+                        Diagram.id,
+                        Diagram.repository_id,
+                        Diagram.name,
+                        Diagram.diagram_type,
+                        Diagram.category,
+                        Diagram.order_index,
+                        Diagram.updated_at,
+                        Diagram.content_digest,
+                    )
                 )
-            ).first()
-            if existing:
-                return rx.toast.error(
-                    f"Another diagram named '{self.diagram_name}' already exists in this repository."
+            ).one_or_none()
+            if diagram is None:
+                return rx.toast.error("This diagram no longer exists.")
+            if changed.keys() & {"content_digest", "notes", "diagram_type"}:
+                await search.index_diagram(
+                    session,
+                    diagram.id,
+                    diagram.repository_id,
+                    diagram.name,
+                    diagram.diagram_type,
+                    content,
+                    self.diagram_notes,
                 )
+            elif "name" in changed:
+                await search.rename_diagram(session, diagram.id, diagram.name)
+            await session.commit()
+
+        if changed.keys() & {"content_digest", "diagram_type"}:
+            thumbnails.schedule(diagram.diagram_type, content, diagram.content_digest)
+        listing.diagrams.invalidate(diagram.repository_id)
+        summary = diagram_summary(diagram)
+        self.diagrams = upserted(self.diagrams, summary, not self.has_more_diagrams)
+        await sync.publish(
+            "diagram",
+            diagram.repository_id,
+            self.router.session.client_token,
+            item=summary.model_dump(mode="json"),
+        )
+        # Update current diagram in state to reflect changes
+        self.current_diagram = self.current_diagram.model_copy(update=changed)
+        self.is_editing = False
 
-            diagram = session.exec(
-                Diagram.select().where(Diagram.id == self.current_diagram.id)
-            ).first()
-            diagram.name = self.diagram_name
-            diagram.content = self.diagram_content
-            diagram.diagram_type = self.diagram_type
-            diagram.category = self.diagram_category
-            diagram.notes = self.diagram_notes
-            diagram.last_ai_prompt = self.ai_prompt
-            diagram.last_ai_notes_prompt = self.ai_notes_prompt
-            diagram.updated_at = datetime.now(tz=pendulum.local_timezone())
-            session.add(diagram)
-            session.commit()
-            session.refresh(diagram)
-            await self.load_diagrams()
-            # Update current diagram in state to reflect changes
-            self.current_diagram = DiagramSchema(
-                id=diagram.id,
-                repository_id=diagram.repository_id,
-                name=diagram.name,
-                content=diagram.content,
-                diagram_type=diagram.diagram_type,
-                category=diagram.category,
-                notes=diagram.notes,
-                last_ai_prompt=diagram.last_ai_prompt,
-                last_ai_notes_prompt=diagram.last_ai_notes_prompt,
-                created_at=diagram.created_at,
-                updated_at=diagram.updated_at,
-            )
+    revisions: List[RevisionSchema] = []
+    has_more_revisions: bool = False
 
-            self.is_editing = False
+    async def load_revisions(self):
+        """Load the newest page of the current diagram's history."""
+        self.revisions = []
+        await self.load_more_revisions()
 
-    async def generate_diagram(self):
-        if not self.ai_prompt:
+    async def load_more_revisions(self):
+        if not self.current_diagram:
             return
-        self.is_loading = True
-        self.show_ai_modal = False
-        yield
+        page_size = 50
+        before = self.revisions[-1].number if self.revisions else None
+        async with rx.asession() as session:
+            rows = await history.list_revisions(
+                session, self.current_diagram.id, limit=page_size + 1, before=before
+            )
+        self.has_more_revisions = len(rows) > page_size
+        self.revisions = self.revisions + [
+            RevisionSchema(number=r.number, author=r.author, created_at=r.created_at)
+            for r in rows[:page_size]
+        ]
+
+    async def restore_revision(self, number: int):
+        """Load a revision into the editor; it is kept only if saved."""
+        if not self.current_diagram:
+            return
+        async with rx.asession() as session:
+            texts = await history.materialize(session, self.current_diagram.id, number)
+        if texts is None:
+            return rx.toast.error(f"Revision {number} not found")
+        await self._set_content(texts["content"])
+        self.diagram_notes = texts["notes"]
+        self.is_editing = True
 
-        try:
-            client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
+    search_query: str = ""
+    search_results: List[SearchResultSchema] = []
+    has_more_results: bool = False
+
+    async def set_search_query(self, value: str):
+        self.search_query = value
+        self.search_results = []
+        await self.load_more_results()
+
+    async def load_more_results(self):
+        """Append the next page of diagrams matching search_query."""
+        page_size = 20
+        if not self.search_query.strip():
+            self.has_more_results = False
+            return
+        async with rx.asession() as session:
+            rows = await search.search(
+                session,
+                self.search_query,
+                limit=page_size + 1,
+                offset=len(self.search_results),
+            )
+        self.has_more_results = len(rows) > page_size
+        self.search_results = self.search_results + [
+            SearchResultSchema(
+                diagram_id=r.diagram_id,
+                repository_id=r.repository_id,
+                repository_name=r.repository_name,
+                name=r.name,
+            )
+            for r in rows[:page_size]
+        ]
+
+    def clear_search(self):
+        self.search_query = ""
+        self.search_results = []
+        self.has_more_results = False
+
+    async def open_search_result(self, result: SearchResultSchema):
+        async with rx.asession() as session:
+            repository = await session.get(Repository, result.repository_id)
+            diagram = await session.get(Diagram, result.diagram_id)
+        if not repository or not diagram:
+            return rx.toast.error("This diagram no longer exists.")
+        await self.select_repository(repository_schema(repository))
+        await self.show_diagram(diagram_summary(diagram))
+
+    _ai_generation: int = 0
+
+    def cancel_generation(self):
+        """Stop the AI generation in progress, keeping what was streamed."""
+        self._ai_generation += 1
+        self.is_loading = False
+
+    async def _stream_completion(
+        self, generation: int, messages: list, field: str, transform=None
+    ) -> bool:
+        """Stream a chat completion into a state field.
+
+        The completion runs on the job queue. Partial output is pushed to
+        the client at most every ai_stream_interval seconds. Returns False
+        if the generation was cancelled before the completion finished.
+        """
+        job = ai.submit_completion(messages)
+        transform = transform or (lambda text: text)
+        async with contextlib.aclosing(job.watch()) as updates:
+            async for content in updates:
+                async with self:
+                    if generation != self._ai_generation:
+                        return False
+                    setattr(self, field, transform(content))
+                await asyncio.sleep(settings.ai_stream_interval)
+            content = await job.result()
+        async with self:
+            if generation != self._ai_generation:
+                return False
+            setattr(self, field, transform(content))
+        return True
+
+    @rx.event(background=True)
+    async def generate_diagram(self):
+        async with self:
+            if not self.ai_prompt or self.is_loading:
+                return
+            self.is_loading = True
+            self.show_ai_modal = False
+            self._ai_generation += 1
+            generation = self._ai_generation
 
             system_msg = f"Generate or modify {self.diagram_type} code based on the user instruction. "
             if self.diagram_type == "plantuml":
@@ -508,180 +1047,202 @@ class State(rx.State):
             if self.diagram_content:
                 user_content += f"Current Diagram Code:\n{self.diagram_content}"
 
-            response = await client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
+        try:
+            await self._stream_completion(
+                generation,
+                [
                     {
                         "role": "system",
                         "content": system_msg,
                     },
                     {"role": "user", "content": user_content},
                 ],
+                "diagram_content",
+                strip_code_fence,
             )
-            content = response.choices[0].message.content
-            # Clean up content if it has backticks
-            if content.startswith("```"):
-                content = "\n".join(content.split("\n")[1:-1])
-            self.diagram_content = content
             # Prompt is preserved for next time as per user request
         except Exception as e:
             yield rx.toast.error(f"Error generating diagram: {str(e)}")
         finally:
-            self.is_loading = False
-            yield
+            async with self:
+                if generation == self._ai_generation:
+                    self.is_loading = False
+                await self.refresh_preview()
 
+    @rx.event(background=True)
     async def generate_notes(self):
-        if not self.ai_notes_prompt:
-            return
-        self.is_loading = True
-        self.show_ai_notes_modal = False
-        yield
-
-        try:
-            client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
+        async with self:
+            if not self.ai_notes_prompt or self.is_loading:
+                return
+            self.is_loading = True
+            self.show_ai_notes_modal = False
+            self._ai_generation += 1
+            generation = self._ai_generation
 
             system_msg = (
                 "Generate markdown documentation/notes based on the user instruction."
             )
             user_content = f"Instruction: {self.ai_notes_prompt}\n"
 
-            if self.refer_to_diagram and self.diagram_content:
-                user_content += f"\nRelevant Diagram Content ({self.diagram_type}):\n{self.diagram_content}"
+            diagram_content = (
+                await self._diagram_source() if self.refer_to_diagram else None
+            )
+            if diagram_content:
+                user_content += f"\nRelevant Diagram Content ({self.diagram_type}):\n{diagram_content}"
 
-            response = await client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
+        try:
+            await self._stream_completion(
+                generation,
+                [
                     {
                         "role": "system",
                         "content": system_msg,
                     },
                     {"role": "user", "content": user_content},
                 ],
+                "diagram_notes",
             )
-            self.diagram_notes = response.choices[0].message.content
             # Prompt is preserved for next time as per user request
         except Exception as e:
             yield rx.toast.error(f"Error generating notes: {str(e)}")
         finally:
-            self.is_loading = False
-            yield
-
-    async def handle_upload(self, files: List[rx.UploadFile]):
-        """Handle uploading a Draw.io file."""
-        for file in files:
-            upload_data = await file.read()
-            # For Draw.io, we store the content (which is XML)
-            self.diagram_content = upload_data.decode("utf-8")
-            self.diagram_type = "drawio"
-            if not self.diagram_name:
-                self.diagram_name = file.filename
+            async with self:
+                if generation == self._ai_generation:
+                    self.is_loading = False
+
+    async def load_upload(self, result: dict):
+        """Load a draw.io document stored by the /upload/drawio route.
+
+        result is {"digest", "name"} for a stored upload, or {"error"}.
+        """
+        if result.get("error"):
+            return rx.toast.error(
+                f"Cannot upload {result.get('name')}: {result['error']}"
+            )
+        digest = result.get("digest", "")
+        if not blobs.is_digest(digest):
+            return rx.toast.error("Upload failed")
+        self.diagram_type = "drawio"
+        await self._set_content("", digest)
+        if not self.diagram_name:
+            self.diagram_name = result.get("name", "")
 
-    async def move_repository_up(self, repo_id: int):
-        with rx.session() as session:
-            current = session.exec(
-                Repository.select().where(Repository.id == repo_id)
-            ).first()
-            if not current:
-                return
+    def _diagram_scope(self, diag_id: int):
+        return Diagram.repository_id == (
+            select(Diagram.repository_id).where(Diagram.id == diag_id).scalar_subquery()
+        )
 
-            # Find the item just before this one
-            previous = session.exec(
-                Repository.select()
-                .where(Repository.order_index < current.order_index)
-                .order_by(Repository.order_index.desc())
-            ).first()
+    async def _reorder_repositories(self, changes: Dict[int, int]):
+        repositories = reordered(
+            self.repositories, changes, not self.has_more_repositories
+        )
+        if repositories is None:
+            await self.load_repositories()
+        else:
+            self.repositories = repositories
 
-            if previous:
-                # Swap order indices
-                current.order_index, previous.order_index = (
-                    previous.order_index,
-                    current.order_index,
-                )
-                session.add(current)
-                session.add(previous)
-                session.commit()
-                await self.load_repositories()
+    async def _reorder_diagrams(self, changes: Dict[int, int]):
+        diagrams = reordered(self.diagrams, changes, not self.has_more_diagrams)
+        if diagrams is None:
+            await self.load_diagrams()
+        else:
+            self.diagrams = diagrams
 
-    async def move_repository_down(self, repo_id: int):
-        with rx.session() as session:
-            current = session.exec(
-                Repository.select().where(Repository.id == repo_id)
-            ).first()
-            if not current:
-                return
+    async def _apply_repository_moves(self, changes: Dict[int, int]):
+        if not changes:
+            return
+        listing.repositories.invalidate()
+        await self._reorder_repositories(changes)
+        await sync.publish(
+            "repository", None, self.router.session.client_token, moves=changes
+        )
 
-            # Find the item just after this one
-            next_repo = session.exec(
-                Repository.select()
-                .where(Repository.order_index > current.order_index)
-                .order_by(Repository.order_index.asc())
-            ).first()
+    async def _apply_diagram_moves(self, changes: Dict[int, int]):
+        if not changes:
+            return
+        repository_id = self.current_repository.id if self.current_repository else None
+        # Without a current repository, drop every diagram listing
+        listing.diagrams.invalidate(repository_id)
+        await self._reorder_diagrams(changes)
+        await sync.publish(
+            "diagram", repository_id, self.router.session.client_token, moves=changes
+        )
 
-            if next_repo:
-                # Swap order indices
-                current.order_index, next_repo.order_index = (
-                    next_repo.order_index,
-                    current.order_index,
+    async def _apply_change(self, change: dict):
+        """Apply a change made by another session (see sync.publish)."""
+        item = change["item"]
+        moves = change["moves"]
+        if moves:
+            # JSON object keys arrive as strings
+            moves = {int(k): v for k, v in moves.items()}
+        if change["kind"] == "repository":
+            if item:
+                self.repositories = upserted(
+                    self.repositories,
+                    RepositorySchema(**item),
+                    not self.has_more_repositories,
                 )
-                session.add(current)
-                session.add(next_repo)
-                session.commit()
+            elif moves:
+                await self._reorder_repositories(moves)
+            else:
                 await self.load_repositories()
+            return
 
-    async def move_diagram_up(self, diag_id: int):
-        with rx.session() as session:
-            current = session.exec(
-                Diagram.select().where(Diagram.id == diag_id)
-            ).first()
-            if not current:
-                return
+        if (
+            not self.current_repository
+            or self.current_repository.id != change["repository_id"]
+        ):
+            return
+        if item:
+            summary = DiagramSummarySchema(**item)
+            self.diagrams = upserted(self.diagrams, summary, not self.has_more_diagrams)
+            # Follow edits to the diagram being viewed, but never replace
+            # content someone is editing
+            if (
+                self.current_diagram
+                and self.current_diagram.id == summary.id
+                and not self.is_editing
+            ):
+                await self.select_diagram(summary)
+        elif moves:
+            await self._reorder_diagrams(moves)
+        else:
+            await self.load_diagrams()
 
-            # Find the item just before this one in the same repository
-            previous = session.exec(
-                Diagram.select()
-                .where(
-                    (Diagram.repository_id == current.repository_id)
-                    & (Diagram.order_index < current.order_index)
-                )
-                .order_by(Diagram.order_index.desc())
-            ).first()
+    async def move_repository(self, repo_id: int, position: int):
+        """Move a repository to a 0-based position in the list."""
+        async with rx.asession() as session:
+            changes = await ordering.move_to(session, Repository, repo_id, position)
+        await self._apply_repository_moves(changes)
 
-            if previous:
-                # Swap order indices
-                current.order_index, previous.order_index = (
-                    previous.order_index,
-                    current.order_index,
-                )
-                session.add(current)
-                session.add(previous)
-                session.commit()
-                await self.load_diagrams()
+    async def move_repository_up(self, repo_id: int):
+        async with rx.asession() as session:
+            changes = await ordering.move_by(session, Repository, repo_id, -1)
+        await self._apply_repository_moves(changes)
 
-    async def move_diagram_down(self, diag_id: int):
-        with rx.session() as session:
-            current = session.exec(
-                Diagram.select().where(Diagram.id == diag_id)
-            ).first()
-            if not current:
-                return
+    async def move_repository_down(self, repo_id: int):
+        async with rx.asession() as session:
+            changes = await ordering.move_by(session, Repository, repo_id, 1)
+        await self._apply_repository_moves(changes)
+
+    async def move_diagram(self, diag_id: int, position: int):
+        """Move a diagram to a 0-based position within its repository."""
+        async with rx.asession() as session:
+            changes = await ordering.move_to(
+                session, Diagram, diag_id, position, self._diagram_scope(diag_id)
+            )
+        await self._apply_diagram_moves(changes)
 
-            # Find the item just after this one in the same repository
-            next_diag = session.exec(
-                Diagram.select()
-                .where(
-                    (Diagram.repository_id == current.repository_id)
-                    & (Diagram.order_index > current.order_index)
-                )
-                .order_by(Diagram.order_index.asc())
-            ).first()
+    async def move_diagram_up(self, diag_id: int):
+        async with rx.asession() as session:
+            changes = await ordering.move_by(
+                session, Diagram, diag_id, -1, self._diagram_scope(diag_id)
+            )
+        await self._apply_diagram_moves(changes)
 
-            if next_diag:
-                # Swap order indices
-                current.order_index, next_diag.order_index = (
-                    next_diag.order_index,
-                    current.order_index,
-                )
-                session.add(current)
-                session.add(next_diag)
-                session.commit()
-                await self.load_diagrams()
+    async def move_diagram_down(self, diag_id: int):
+        async with rx.asession() as session:
+            changes = await ordering.move_by(
+                session, Diagram, diag_id, 1, self._diagram_scope(diag_id)
+            )
+        await self._apply_diagram_moves(changes)
@@ -0,0 +1,147 @@
+"""Change notifications that keep every open session up to date.
+
+Mutation handlers publish a small change record after committing. On
+Postgres the record is sent with NOTIFY, so every backend replica receives
+it through a LISTEN connection; other databases only deliver it within the
+current process. Receiving a change invalidates the shared listings and
+patches the state of the sessions it concerns: repository changes go to
+every session, diagram changes only to sessions viewing that repository.
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, Optional, Set
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+import reflex as rx
+from reflex.state import _substate_key
+
+from . import listing
+from .settings import settings
+
+CHANNEL = "designrepo_changes"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+_app: Optional[rx.App] = None
+# Client token -> id of the repository the session is viewing
+_sessions: Dict[str, Optional[int]] = {}
+_tasks: Set[asyncio.Task] = set()
+
+
+def watch(token: str, repository_id: Optional[int] = None):
+    """Register a session to receive changes for a repository."""
+    _sessions[token] = repository_id
+
+
+def _is_postgres() -> bool:
+    return make_url(settings.get_async_db_url()).get_backend_name() == "postgresql"
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def publish(
+    kind: str,
+    repository_id: Optional[int],
+    origin: str,
+    item: Optional[Dict[str, Any]] = None,
+    moves: Optional[Dict[int, int]] = None,
+):
+    """Announce a committed change to a repository or diagram.
+
+    kind is "repository" or "diagram". item is the summary of a created or
+    updated row and moves maps row ids to new ordering keys. The session
+    that made the change (origin) has already applied it and is skipped.
+    """
+    change = {
+        "kind": kind,
+        "repository_id": repository_id,
+        "origin": origin,
+        "item": item,
+        "moves": moves,
+    }
+    if not _is_postgres():
+        _spawn(_dispatch(change))
+        return
+    payload = json.dumps(change)
+    if len(payload) > MAX_PAYLOAD:
+        # Too large to send; receivers reload the listing instead
+        payload = json.dumps({**change, "item": None, "moves": None})
+    async with rx.asession() as session:
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": payload},
+        )
+        await session.commit()
+
+
+async def _dispatch(change: Dict[str, Any]):
+    from .state import State
+
+    kind = change["kind"]
+    repository_id = change["repository_id"]
+    if kind == "repository":
+        listing.repositories.invalidate()
+    else:
+        listing.diagrams.invalidate(repository_id)
+    if _app is None or _app.event_namespace is None:
+        return
+
+    connected = _app.event_namespace.token_to_sid
+    for token, viewing in list(_sessions.items()):
+        if token == change["origin"]:
+            continue
+        if kind == "diagram" and viewing != repository_id:
+            continue
+        if token not in connected:
+            _sessions.pop(token, None)
+            continue
+        try:
+            async with _app.modify_state(_substate_key(token, State)) as root:
+                state = await root.get_state(State)
+                await state._apply_change(change)
+        except Exception:
+            # One broken session must not stop delivery to the others
+            _sessions.pop(token, None)
+
+
+def _on_notify(connection, pid, channel, payload):
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        return
+    _spawn(_dispatch(change))
+
+
+async def listen(rx_app: rx.App):
+    """Lifespan task that forwards database notifications to sessions."""
+    global _app
+    _app = rx_app
+    if not _is_postgres():
+        return
+    url = make_url(settings.get_async_db_url()).set(drivername="postgresql")
+    dsn = url.render_as_string(hide_password=False)
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(dsn)
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            await connection.add_listener(CHANNEL, _on_notify)
+            await closed.wait()
+        except (OSError, asyncpg.PostgresError):
+            pass
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        # Changes may have been missed while the connection was down
+        listing.repositories.invalidate()
+        listing.diagrams.invalidate()
+        await asyncio.sleep(settings.sync_reconnect_seconds)
@@ -0,0 +1,101 @@
+"""Small raster previews of diagrams for the diagram list.
+
+A thumbnail is rendered on the job queue after a save changes a diagram,
+and on first request for diagrams saved before thumbnails existed. It is
+stored in the render cache keyed by the diagram body digest and type, so
+identical diagrams share one thumbnail and an unchanged diagram is never
+rendered again. Renderers produce PNG, which is downscaled to WebP.
+draw.io diagrams have no server-side renderer and get no thumbnail.
+
+When rendering fails, e.g. for a diagram with a syntax error, the
+placeholder is stored as its thumbnail, so a broken diagram is rendered
+at most once per thumbnail_retry_seconds rather than on every view.
+"""
+
+import asyncio
+import io
+import time
+from typing import Optional, Tuple
+
+import httpx
+from PIL import Image
+
+from . import blobs, jobs, render
+from .settings import settings
+
+MEDIA_TYPES = {"webp": "image/webp", "svg": "image/svg+xml"}
+# Shown while a thumbnail is being rendered, or when there can be none
+PLACEHOLDER_SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="320" height="180">'
+    b'<rect width="100%" height="100%" fill="#f4f4f5"/></svg>'
+)
+
+# Digest of a blank diagram, which is never rendered
+EMPTY_DIGEST = blobs.content_digest("")
+
+
+def thumbnail_key(diagram_type: str, content_digest: str) -> str:
+    return f"{content_digest}.{diagram_type}"
+
+
+def thumbnail_url(diagram_type: str, content_digest: str) -> str:
+    """Backend URL of a diagram's thumbnail, or "" if it cannot have one."""
+    if diagram_type not in render.RENDERABLE_TYPES or content_digest == EMPTY_DIGEST:
+        return ""
+    return f"{render.base_url()}/thumbnail/{diagram_type}/{content_digest}"
+
+
+def is_valid(diagram_type: str, content_digest: str) -> bool:
+    return diagram_type in render.RENDERABLE_TYPES and blobs.is_digest(content_digest)
+
+
+def _lookup(key: str) -> Optional[Tuple[bytes, str]]:
+    thumbnail = render.cache.get_thumbnail(key)
+    if thumbnail is not None and thumbnail[1] == "svg":
+        # A failed render, which is retried once it is old enough
+        modified = render.cache.modified(key, "svg")
+        if (
+            modified is None
+            or time.time() - modified > settings.thumbnail_retry_seconds
+        ):
+            return None
+    return thumbnail
+
+
+def get(diagram_type: str, content_digest: str) -> Optional[Tuple[bytes, str]]:
+    """Return the (image, format) thumbnail of a diagram body, if rendered.
+
+    The format is "svg" for the placeholder stored after a failed render.
+    """
+    return _lookup(thumbnail_key(diagram_type, content_digest))
+
+
+def _shrink(png: bytes) -> bytes:
+    with Image.open(io.BytesIO(png)) as image:
+        width = settings.thumbnail_width
+        image.thumbnail((width, width * 2))
+        out = io.BytesIO()
+        image.save(out, "WEBP", quality=80)
+    return out.getvalue()
+
+
+async def _make(key: str, diagram_type: str, content: str):
+    try:
+        png = await render.render_png(diagram_type, content)
+    except (render.RenderError, httpx.HTTPError):
+        render.cache.put_thumbnail(key, PLACEHOLDER_SVG, "svg")
+        return
+    data = await asyncio.to_thread(_shrink, png)
+    render.cache.put_thumbnail(key, data, "webp")
+
+
+def schedule(diagram_type: str, content: str, content_digest: str):
+    """Queue rendering the thumbnail of a diagram body if needed."""
+    if diagram_type not in render.RENDERABLE_TYPES or not content.strip():
+        return
+    key = thumbnail_key(diagram_type, content_digest)
+    if _lookup(key) is not None:
+        return
+    jobs.thumbnails.submit(
+        ("thumbnail", key), lambda job: _make(key, diagram_type, content)
+    )
@@ -4,6 +4,7 @@ from designrepo.settings import settings
 config = rx.Config(
     app_name="designrepo",
     db_url=settings.db_url,
+    async_db_url=settings.get_async_db_url(),
     plugins=[
         rx.plugins.SitemapPlugin(),
         rx.plugins.TailwindV4Plugin(),
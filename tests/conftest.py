@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+# Settings are read at import time, so configure them before designrepo loads
+_tmp = tempfile.mkdtemp(prefix="designrepo-tests-")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("DESIGNREPO_DB_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("DESIGNREPO_RENDER_CACHE_DIR", f"{_tmp}/render-cache")
+
+import pytest
+from reflex.model import get_async_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from designrepo import models  # noqa: F401  (registers the tables)
+
+
+@pytest.fixture
+async def session(tmp_path):
+    """Async session on a fresh SQLite database with every table created."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/db.sqlite")
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.fixture
+async def app_db():
+    """The database behind rx.asession(), with every table created."""
+    engine = get_async_engine(None)
+    # Connections pooled by an earlier test belong to another event loop
+    await engine.dispose()
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    yield engine
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.drop_all)
+    await engine.dispose()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import socket
+import threading
+
+import openai
+import pytest
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from designrepo import ai, jobs
+from designrepo.settings import settings
+
+
+class StubOpenAI:
+    """Local OpenAI-compatible server that records the connections used."""
+
+    def __init__(self):
+        self.connections = []
+        self.requests = 0
+        app = FastAPI()
+        app.post("/v1/chat/completions")(self.completions)
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}/v1"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self.thread = threading.Thread(
+            target=self.server.run, kwargs={"sockets": [self.sock]}, daemon=True
+        )
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        self.requests += 1
+        client = request.scope["client"]
+        if client not in self.connections:
+            self.connections.append(client)
+        prompt = body["messages"][-1]["content"]
+
+        async def chunks():
+            if prompt == "fail":
+                yield 'data: {"error": {"message": "boom"}}\n\n'
+                return
+            for word in ["echo:", " ", prompt]:
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [
+                        {"index": 0, "delta": {"content": word}, "finish_reason": None}
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(0.01)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            threading.Event().wait(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(5)
+
+
+@pytest.fixture
+async def stub(monkeypatch):
+    with StubOpenAI() as stub:
+        monkeypatch.setattr(settings, "openai_base_url", stub.url)
+        monkeypatch.setattr(ai, "_client", None)
+        monkeypatch.setattr(ai, "cache", ai.CompletionCache(60, 16))
+        monkeypatch.setattr(jobs, "completions", jobs.JobQueue(8))
+        yield stub
+        await ai.get_client().close()
+
+
+def _messages(prompt: str):
+    return [
+        {"role": "system", "content": "Echo the prompt."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+async def test_sequential_completions_reuse_one_connection(stub):
+    for n in range(5):
+        job = ai.submit_completion(_messages(f"prompt {n}"))
+        assert await job.result() == f"echo: prompt {n}"
+    assert stub.requests == 5
+    assert len(stub.connections) == 1
+
+
+async def test_concurrent_completions_keep_their_connections(stub):
+    prompts = [f"prompt {n}" for n in range(4)]
+    jobs_ = [ai.submit_completion(_messages(p)) for p in prompts]
+    assert [await job.result() for job in jobs_] == [f"echo: {p}" for p in prompts]
+    opened = len(stub.connections)
+    assert opened <= 4
+
+    # The pooled connections are kept alive and reused by the next round
+    jobs_ = [ai.submit_completion(_messages(f"again {p}")) for p in prompts]
+    for job in jobs_:
+        await job.result()
+    assert stub.requests == 8
+    assert len(stub.connections) == opened
+
+
+async def test_identical_requests_make_one_upstream_call(stub):
+    first = ai.submit_completion(_messages("same"))
+    second = ai.submit_completion(_messages("same"))
+    assert await first.result() == await second.result() == "echo: same"
+    assert (await ai.submit_completion(_messages("same")).result()) == "echo: same"
+    assert stub.requests == 1
+    assert ai.cache.stats()["coalesced"] == 1
+    assert ai.cache.stats()["hits"] == 1
+
+
+async def test_error_event_fails_the_job_and_is_not_cached(stub):
+    with pytest.raises(openai.APIError, match="boom"):
+        await ai.submit_completion(_messages("fail")).result()
+    assert ai.cache.stats()["entries"] == 0
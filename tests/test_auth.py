@@ -0,0 +1,29 @@
+import pydantic
+import pytest
+
+from designrepo import auth
+from designrepo.settings import Settings, settings
+
+
+def test_oidc_requires_a_session_secret():
+    with pytest.raises(pydantic.ValidationError):
+        Settings(oidc_issuer="https://idp.example.com")
+    Settings(oidc_issuer="https://idp.example.com", session_secret="s")
+    Settings(oidc_issuer="https://idp.example.com", oidc_client_secret="s")
+    Settings()
+
+
+def test_tokens_are_never_signed_with_an_empty_key(monkeypatch):
+    monkeypatch.setattr(settings, "session_secret", "")
+    monkeypatch.setattr(settings, "oidc_client_secret", "")
+    with pytest.raises(auth.SessionSecretError):
+        auth.issue_session_token({"sub": "alice"})
+    with pytest.raises(auth.SessionSecretError):
+        auth.load_session_token("anything")
+
+
+def test_session_token_round_trip(monkeypatch):
+    monkeypatch.setattr(settings, "session_secret", "secret")
+    token = auth.issue_session_token({"sub": "alice"})
+    assert auth.load_session_token(token) == ({"sub": "alice"}, True)
+    assert auth.load_session_token(token[:-2] + "xx") == (None, False)
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import pendulum
+from sqlmodel import select, update
+
+from designrepo import blobs
+from designrepo.models import Diagram, DiagramBlob
+
+
+async def test_put_and_get_round_trip(session):
+    digest = await blobs.put(session, "graph TD; A-->B")
+    assert digest == blobs.content_digest("graph TD; A-->B")
+    assert await blobs.get(session, digest) == "graph TD; A-->B"
+
+
+async def test_prune_removes_only_old_unreferenced_blobs(session):
+    used = await blobs.put(session, "used")
+    orphan = await blobs.put(session, "orphan")
+    await blobs.put(session, "recent")
+    session.add(
+        Diagram(
+            repository_id=1,
+            name="d",
+            content_digest=used,
+            diagram_type="plantuml",
+            category="as-is",
+        )
+    )
+    await session.commit()
+
+    now = datetime.now(tz=pendulum.local_timezone())
+    assert await blobs.prune(session, now - timedelta(hours=1)) == 0
+    # Storing a body again keeps it from being pruned
+    await blobs.put(session, "recent")
+    assert await blobs.prune(session, now) == 1
+    await session.commit()
+
+    digests = set((await session.exec(select(DiagramBlob.digest))).all())
+    assert used in digests
+    assert orphan not in digests
+    assert blobs.content_digest("recent") in digests
+
+
+async def test_prune_treats_blobs_without_stored_at_as_old(session):
+    digest = await blobs.put(session, "orphan")
+    await session.exec(update(DiagramBlob).values(stored_at=None))
+    now = datetime.now(tz=pendulum.local_timezone())
+    assert await blobs.prune(session, now - timedelta(hours=1)) == 1
+    assert (
+        await session.exec(select(DiagramBlob).where(DiagramBlob.digest == digest))
+    ).first() is None
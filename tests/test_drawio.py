@@ -0,0 +1,112 @@
+import base64
+import urllib.parse
+import zlib
+
+import httpx
+import pytest
+import reflex as rx
+
+from designrepo import api, blobs, drawio, render
+from designrepo.settings import settings
+
+PAGE = '<mxGraphModel><root><mxCell id="0" value="{}"/></root></mxGraphModel>'
+
+
+def _compress(xml: str) -> str:
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(urllib.parse.quote(xml).encode()) + compressor.flush()
+    return base64.b64encode(data).decode()
+
+
+def _document(*pages: str) -> bytes:
+    diagrams = "".join(
+        f'<diagram name="Page {i}">{_compress(page)}</diagram>'
+        for i, page in enumerate(pages)
+    )
+    return f'<mxfile compressed="true">{diagrams}</mxfile>'.encode()
+
+
+def test_inflate_expands_compressed_pages():
+    xml = drawio.inflate(_document(PAGE.format("a"), PAGE.format("b")), 10_000)
+    assert xml.count(b"<mxGraphModel>") == 2
+    assert b'value="b"' in xml
+    assert b"compressed" not in xml
+
+
+def test_inflate_limits_total_size_of_all_pages():
+    page = PAGE.format("x" * 1000)
+    size = len(urllib.parse.quote(page))
+    data = _document(*[page] * 10)
+    assert drawio.inflate(data, size * 10).count(b"<mxGraphModel>") == 10
+    with pytest.raises(drawio.DrawioError):
+        drawio.inflate(data, size * 10 - 1)
+    # Each page alone is well under the limit
+    with pytest.raises(drawio.DrawioError):
+        drawio.inflate(data, size * 5)
+
+
+def test_inflate_returns_plain_documents_unchanged():
+    data = f"<mxfile><diagram>{PAGE.format('a')}</diagram></mxfile>".encode()
+    assert drawio.inflate(data, 10) is data
+    with pytest.raises(drawio.DrawioError):
+        drawio.inflate(b"<html><body/></html>", 10_000)
+
+
+def _client():
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=api.api), base_url="http://test"
+    )
+
+
+async def test_upload_is_inflated_and_stored(app_db):
+    data = _document(PAGE.format("a"))
+    async with _client() as client:
+        resp = await client.post("/upload/drawio", content=data)
+    assert resp.status_code == 200
+    async with rx.asession() as session:
+        xml = await blobs.get(session, resp.json()["digest"])
+    assert xml == drawio.inflate(data, 10_000).decode()
+
+
+async def test_upload_is_refused_before_it_is_read_in_full(monkeypatch):
+    monkeypatch.setattr(settings, "upload_max_bytes", 1000)
+    sent = 0
+
+    async def body():
+        nonlocal sent
+        for _ in range(100):
+            sent += 1
+            yield b"x" * 100
+
+    async with _client() as client:
+        resp = await client.post("/upload/drawio", content=body())
+        assert resp.status_code == 413
+        assert sent < 100
+
+        # A declared size over the limit is refused without reading anything
+        resp = await client.post("/upload/drawio", content=b"x" * 1001)
+        assert resp.status_code == 413
+
+
+async def test_source_is_only_served_with_a_viewer_token(app_db, monkeypatch):
+    monkeypatch.setattr(settings, "oidc_issuer", "https://idp.example.com")
+    monkeypatch.setattr(settings, "session_secret", "secret")
+    monkeypatch.setattr(settings, "render_base_url", "")
+    async with rx.asession() as session:
+        digest = await blobs.put(session, "<mxfile/>")
+        other = await blobs.put(session, "<mxfile><diagram/></mxfile>")
+        await session.commit()
+    viewer_url = render.drawio_viewer_url(digest, "http://test")
+    source_url = urllib.parse.unquote(viewer_url.split("#U", 1)[1])
+    token = urllib.parse.parse_qs(urllib.parse.urlsplit(source_url).query)["token"]
+
+    async with _client() as client:
+        resp = await client.get(source_url)
+        assert resp.status_code == 200
+        assert resp.text == "<mxfile/>"
+        assert resp.headers["access-control-allow-origin"] == (
+            "https://viewer.diagrams.net"
+        )
+        assert (await client.get(f"/source/{digest}")).status_code == 403
+        resp = await client.get(f"/source/{other}", params={"token": token[0]})
+        assert resp.status_code == 403
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+from sqlmodel import select
+
+from designrepo import history
+from designrepo.models import DiagramRevision
+from designrepo.settings import settings
+
+REVISIONS = 1000
+
+
+def _plantuml(rng: random.Random, lines: list) -> list:
+    """Edit a PlantUML body the way a user would: a few lines at a time."""
+    lines = list(lines)
+    for _ in range(rng.randint(1, 3)):
+        n = rng.randrange(len(lines) + 1)
+        action = rng.random()
+        if action < 0.5 or len(lines) < 3:
+            lines.insert(n, f"A{rng.randrange(500)} -> B{rng.randrange(500)} : call\n")
+        elif action < 0.8:
+            del lines[min(n, len(lines) - 1)]
+        else:
+            lines[min(n, len(lines) - 1)] = f"note over A{rng.randrange(9)} : ✓\n"
+    return lines
+
+
+def _drawio(rng: random.Random, cells: list) -> list:
+    """Edit draw.io XML, which is a single line of many elements."""
+    cells = list(cells)
+    n = rng.randrange(len(cells) + 1)
+    if rng.random() < 0.6 or len(cells) < 3:
+        cells.insert(n, f'<mxCell id="{rng.randrange(10**6)}" value="Box &amp; {n}"/>')
+    else:
+        del cells[min(n, len(cells) - 1)]
+    return cells
+
+
+def _histories(seed: int = 1):
+    """REVISIONS successive {content, notes} versions of two diagrams."""
+    rng = random.Random(seed)
+    lines = ["@startuml\n", "@enduml\n"]
+    cells = ['<mxGraphModel><root><mxCell id="0"/>', "</root></mxGraphModel>"]
+    notes = "# Notes\n"
+    plantuml, drawio = [], []
+    for _ in range(REVISIONS):
+        lines = _plantuml(rng, lines)
+        cells = _drawio(rng, cells)
+        if rng.random() < 0.2:
+            notes += f"- change {rng.randrange(1000)}\n"
+        plantuml.append({"content": "".join(lines), "notes": notes})
+        drawio.append({"content": "".join(cells), "notes": notes})
+    return plantuml, drawio
+
+
+@pytest.mark.parametrize("kind", [0, 1])
+def test_diff_patch_round_trips(kind):
+    versions = _histories()[kind]
+    for old, new in zip(versions, versions[1:]):
+        for field in history.FIELDS:
+            ops = history.diff(old[field], new[field])
+            assert history.patch(old[field], ops) == new[field]
+
+
+def test_diff_patch_edge_cases():
+    for old, new in [
+        ("", ""),
+        ("", "a\n"),
+        ("a\n", ""),
+        ("a", "a\n"),
+        ("x>y", "x>z>y"),
+    ]:
+        assert history.patch(old, history.diff(old, new)) == new
+
+
+@pytest.mark.parametrize("kind", [0, 1])
+async def test_record_and_materialize_every_revision(session, kind):
+    versions = _histories()[kind]
+    before = {"content": "", "notes": ""}
+    for after in versions:
+        await history.record(session, 1, before, after, author="alice")
+        before = after
+    await session.commit()
+
+    # Revision 1 is the empty diagram before the first save
+    assert await history.materialize(session, 1, 1) == {"content": "", "notes": ""}
+    for number, expected in enumerate(versions, start=2):
+        assert await history.materialize(session, 1, number) == expected
+    assert await history.materialize(session, 1, REVISIONS + 2) is None
+    assert await history.materialize(session, 2, 1) is None
+
+    snapshots = (
+        await session.exec(
+            select(DiagramRevision.number).where(DiagramRevision.snapshot)
+        )
+    ).all()
+    interval = settings.revision_snapshot_interval
+    assert list(snapshots) == list(range(1, REVISIONS + 2, interval))
+
+    page = await history.list_revisions(session, 1, limit=10)
+    assert [r.number for r in page] == list(range(REVISIONS + 1, REVISIONS - 9, -1))
+    page = await history.list_revisions(session, 1, limit=10, before=page[-1].number)
+    assert page[0].number == REVISIONS - 9
@@ -0,0 +1,57 @@
+import asyncio
+
+from designrepo import jobs
+
+
+async def test_queue_runs_at_most_workers_jobs():
+    queue = jobs.JobQueue(2)
+    running, peak = 0, 0
+    release = asyncio.Event()
+
+    async def work(job):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await release.wait()
+        running -= 1
+        return job.key
+
+    submitted = [queue.submit(i, work) for i in range(5)]
+    await asyncio.sleep(0.01)
+    assert running == 2
+    release.set()
+    assert [await job.result() for job in submitted] == list(range(5))
+    assert peak == 2
+
+
+async def test_kinds_of_work_do_not_share_workers():
+    renders = jobs.JobQueue(1)
+    calls = jobs.JobQueue(1)
+    blocked = asyncio.Event()
+
+    async def slow_render(job):
+        await blocked.wait()
+
+    async def call(job):
+        return "done"
+
+    renders.submit("render-1", slow_render)
+    renders.submit("render-2", slow_render)
+    job = calls.submit("call", call, priority=jobs.INTERACTIVE)
+    assert await asyncio.wait_for(job.result(), 1) == "done"
+    blocked.set()
+
+
+async def test_identical_submissions_share_one_job():
+    queue = jobs.JobQueue(1)
+    runs = 0
+
+    async def work(job):
+        nonlocal runs
+        runs += 1
+        return runs
+
+    first = queue.submit("key", work)
+    assert queue.submit("key", work) is first
+    assert await first.result() == 1
+    assert runs == 1
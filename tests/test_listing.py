@@ -0,0 +1,77 @@
+import asyncio
+
+from designrepo.listing import ListingCache
+
+
+class Loader:
+    """Listing loads that return the current rows once released."""
+
+    def __init__(self):
+        self.rows = ["v1"]
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> list:
+        self.calls += 1
+        rows = list(self.rows)
+        await self.release.wait()
+        return rows
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = ListingCache(ttl=60.0)
+    load = Loader()
+    waiting = [asyncio.create_task(cache.get("all", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    load.release.set()
+    assert await asyncio.gather(*waiting) == [["v1"]] * 5
+    assert load.calls == 1
+
+
+async def test_load_racing_an_invalidation_is_not_cached():
+    cache = ListingCache(ttl=60.0)
+    load = Loader()
+    first = asyncio.create_task(cache.get("all", load))
+    await asyncio.sleep(0)
+
+    # A write commits and invalidates while the load is still running
+    load.rows = ["v2"]
+    cache.invalidate("all")
+    load.release.set()
+    # Its caller still gets the rows it loaded, but they are not stored
+    assert await first == ["v1"]
+    assert await cache.get("all", load) == ["v2"]
+    assert load.calls == 2
+    assert await cache.get("all", load) == ["v2"]
+    assert load.calls == 2
+
+
+async def test_gets_after_an_invalidation_do_not_join_an_earlier_load():
+    cache = ListingCache(ttl=60.0)
+    load = Loader()
+    first = asyncio.create_task(cache.get("all", load))
+    await asyncio.sleep(0)
+    load.rows = ["v2"]
+    cache.invalidate("all")
+    second = asyncio.create_task(cache.get("all", load))
+    await asyncio.sleep(0)
+    assert load.calls == 2
+
+    load.release.set()
+    assert await first == ["v1"]
+    assert await second == ["v2"]
+    assert await cache.get("all", load) == ["v2"]
+    assert load.calls == 2
+
+
+async def test_invalidating_everything_drops_every_key():
+    cache = ListingCache(ttl=60.0)
+    load = Loader()
+    load.release.set()
+    await cache.get(1, load)
+    await cache.get(2, load)
+    cache.invalidate()
+    load.rows = ["v2"]
+    assert await cache.get(1, load) == ["v2"]
+    assert await cache.get(2, load) == ["v2"]
+    assert load.calls == 4
@@ -0,0 +1,110 @@
+"""Load test: State database access must not serialize concurrent sessions.
+
+Handlers reach the database through rx.asession(), so a slow query only
+holds its own connection. These tests run many concurrent sessions against
+the configured (test) database and check that slow queries overlap, that
+the event loop stays responsive meanwhile, and that sidebar loads hold up
+under concurrency.
+"""
+
+import asyncio
+import time
+
+import pytest
+import reflex as rx
+from reflex.model import get_async_engine
+from sqlalchemy import event, text
+from sqlmodel import SQLModel
+
+from designrepo import state
+from designrepo.models import Diagram, Repository
+
+SESSIONS = 8
+QUERY_SECONDS = 0.2
+
+
+def _sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+@pytest.fixture
+async def engine():
+    engine = get_async_engine(None)
+
+    def add_sleep(dbapi_connection, record):
+        # Stands in for a slow Postgres query (pg_sleep)
+        dbapi_connection.create_function("sleep", 1, _sleep)
+
+    event.listen(engine.sync_engine, "connect", add_sleep)
+    await engine.dispose()
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    yield engine
+    event.remove(engine.sync_engine, "connect", add_sleep)
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.drop_all)
+    await engine.dispose()
+
+
+async def _slow_query() -> float:
+    async with rx.asession() as session:
+        result = await session.execute(
+            text("SELECT sleep(:seconds)"), {"seconds": QUERY_SECONDS}
+        )
+        return result.scalar()
+
+
+async def test_slow_queries_do_not_block_the_event_loop(engine):
+    gaps = []
+
+    async def heartbeat(stop: asyncio.Event):
+        last = time.monotonic()
+        while not stop.is_set():
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(heartbeat(stop))
+    started = time.monotonic()
+    results = await asyncio.gather(*[_slow_query() for _ in range(SESSIONS)])
+    elapsed = time.monotonic() - started
+    stop.set()
+    await ticker
+
+    assert results == [QUERY_SECONDS] * SESSIONS
+    # Serialized, the queries would take SESSIONS * QUERY_SECONDS
+    assert elapsed < SESSIONS * QUERY_SECONDS / 2
+    # Other sessions' events keep being served while the queries run
+    assert max(gaps) < QUERY_SECONDS / 2
+
+
+async def test_concurrent_sidebar_loads(engine):
+    async with rx.asession() as session:
+        for n in range(20):
+            session.add(Repository(name=f"r{n}", description="", order_index=n))
+        for n in range(50):
+            session.add(
+                Diagram(
+                    repository_id=1,
+                    name=f"d{n}",
+                    content_digest="0" * 64,
+                    diagram_type="plantuml",
+                    category="as-is",
+                    order_index=n,
+                )
+            )
+        await session.commit()
+
+    loads = [state.fetch_repositories() for _ in range(100)]
+    loads += [state.fetch_diagrams(1) for _ in range(100)]
+    started = time.monotonic()
+    pages = await asyncio.gather(*loads)
+    elapsed = time.monotonic() - started
+
+    assert all(len(page) == 20 for page in pages[:100])
+    assert all(len(page) == 50 for page in pages[100:])
+    assert [d.name for d in pages[-1][:3]] == ["d0", "d1", "d2"]
+    assert elapsed < 10
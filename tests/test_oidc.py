@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from authlib.jose import JsonWebKey, jwt
+
+from designrepo import oidc
+from designrepo.settings import settings
+
+ISSUER = "https://idp.example.com"
+CLIENT_ID = "designrepo"
+
+
+class StubIdP:
+    """Discovery, JWKS and signing for tests, served through MockTransport."""
+
+    def __init__(self):
+        self.key = JsonWebKey.generate_key("RSA", 2048, {"kid": "key-1"}, True)
+        self.requests = []
+        self.delay = 0.0
+        self.down = False
+
+    def rotate(self, kid: str):
+        self.key = JsonWebKey.generate_key("RSA", 2048, {"kid": kid}, True)
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request.url.path)
+        # Lets concurrent callers pile up behind an in-flight fetch
+        await asyncio.sleep(self.delay)
+        if self.down:
+            return httpx.Response(503)
+        if request.url.path == "/.well-known/openid-configuration":
+            return httpx.Response(
+                200, json={"issuer": ISSUER, "jwks_uri": f"{ISSUER}/jwks"}
+            )
+        if request.url.path == "/jwks":
+            return httpx.Response(200, json={"keys": [self.key.as_dict()]})
+        return httpx.Response(404)
+
+    def id_token(self, **claims) -> str:
+        now = int(time.time())
+        payload = {
+            "iss": ISSUER,
+            "aud": CLIENT_ID,
+            "sub": "alice",
+            "iat": now,
+            "exp": now + 300,
+            **claims,
+        }
+        header = {"alg": "RS256", "kid": self.key.kid}
+        return jwt.encode(header, payload, self.key).decode()
+
+
+@pytest.fixture
+def idp(monkeypatch):
+    idp = StubIdP()
+    monkeypatch.setattr(settings, "oidc_issuer", ISSUER)
+    monkeypatch.setattr(settings, "oidc_client_id", CLIENT_ID)
+    monkeypatch.setattr(
+        oidc,
+        "_http_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(idp.handler)),
+    )
+    # Locks bind to the event loop they are first contended on
+    monkeypatch.setattr(oidc.discovery, "_lock", asyncio.Lock())
+    monkeypatch.setattr(oidc.jwks, "_lock", asyncio.Lock())
+    oidc.discovery.clear()
+    oidc.jwks.clear()
+    yield idp
+    oidc.discovery.clear()
+    oidc.jwks.clear()
+
+
+async def test_id_token_with_matching_nonce_is_accepted(idp):
+    claims = await oidc.verify_id_token(idp.id_token(nonce="n-1"), "n-1")
+    assert claims["sub"] == "alice"
+
+
+@pytest.mark.parametrize("claims", [{"nonce": "other"}, {}])
+async def test_id_token_without_matching_nonce_is_rejected(idp, claims):
+    with pytest.raises(oidc.TokenValidationError):
+        await oidc.verify_id_token(idp.id_token(**claims), "n-1")
+
+
+async def test_login_without_nonce_is_rejected(idp):
+    with pytest.raises(oidc.TokenValidationError):
+        await oidc.verify_id_token(idp.id_token(nonce=""), "")
+
+
+async def test_concurrent_first_fetches_are_coalesced(idp):
+    idp.delay = 0.05
+    configs = await asyncio.gather(*[oidc.get_config() for _ in range(20)])
+    assert all(config["issuer"] == ISSUER for config in configs)
+    keys = await asyncio.gather(*[oidc.get_jwks() for _ in range(20)])
+    assert all(k["keys"][0]["kid"] == "key-1" for k in keys)
+    assert idp.requests == ["/.well-known/openid-configuration", "/jwks"]
+
+
+async def test_stale_document_is_served_while_refreshing_once(idp, monkeypatch):
+    await oidc.get_jwks()
+    idp.rotate("key-2")
+    idp.delay = 0.05
+    monkeypatch.setattr(oidc.jwks, "ttl", 0.0)
+    idp.requests.clear()
+
+    # Served from the cache immediately, with a single background refresh
+    stale = await asyncio.gather(*[oidc.get_jwks() for _ in range(10)])
+    assert all(k["keys"][0]["kid"] == "key-1" for k in stale)
+    await oidc.jwks._refresh
+    assert idp.requests == ["/jwks"]
+    assert (await oidc.get_jwks())["keys"][0]["kid"] == "key-2"
+
+
+async def test_failed_background_refresh_keeps_stale_document(idp, monkeypatch):
+    await oidc.get_jwks()
+    monkeypatch.setattr(oidc.jwks, "ttl", 0.0)
+
+    idp.down = True
+    assert (await oidc.get_jwks())["keys"][0]["kid"] == "key-1"
+    await oidc.jwks._refresh
+    assert (await oidc.get_jwks())["keys"][0]["kid"] == "key-1"
+
+
+async def test_unknown_kid_forces_one_jwks_refresh(idp):
+    await oidc.get_jwks()
+    idp.rotate("key-2")
+    idp.requests.clear()
+
+    claims = await oidc.verify_id_token(idp.id_token(nonce="n"), "n")
+    assert claims["sub"] == "alice"
+    assert idp.requests == ["/jwks"]
+
+    # Now cached: no further fetches
+    await oidc.verify_id_token(idp.id_token(nonce="n"), "n")
+    assert idp.requests == ["/jwks"]
+
+
+async def test_concurrent_forced_refreshes_are_coalesced(idp):
+    await oidc.get_jwks()
+    idp.rotate("key-2")
+    idp.delay = 0.05
+    idp.requests.clear()
+
+    tokens = [idp.id_token(nonce="n") for _ in range(10)]
+    results = await asyncio.gather(*[oidc.verify_id_token(t, "n") for t in tokens])
+    assert all(claims["sub"] == "alice" for claims in results)
+    assert idp.requests == ["/jwks"]
+
+
+def test_cached_document_requires_a_url():
+    with pytest.raises(TypeError):
+        oidc.CachedDocument(60.0)
+
+
+async def test_token_signed_by_unknown_key_is_rejected(idp):
+    token = StubIdP().id_token(nonce="n")
+    with pytest.raises(oidc.TokenValidationError):
+        await oidc.verify_id_token(token, "n")
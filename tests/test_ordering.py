@@ -0,0 +1,89 @@
+import random
+
+from sqlmodel import select
+
+from designrepo import ordering
+from designrepo.models import Diagram, Repository
+
+
+async def _add_repositories(session, keys):
+    for n, key in enumerate(keys):
+        session.add(Repository(name=f"r{n}", description="", order_index=key))
+    await session.commit()
+
+
+async def _order(session, model=Repository, scope=None):
+    query = select(model.id).order_by(model.order_index, model.id)
+    if scope is not None:
+        query = query.where(scope)
+    return list((await session.exec(query)).all())
+
+
+async def test_move_updates_only_the_moved_row(session):
+    await _add_repositories(session, [1024, 2048, 3072, 4096])
+    ids = await _order(session)
+    assert await ordering.move_to(session, Repository, ids[3], 1) == {ids[3]: 1536}
+    assert await ordering.move_by(session, Repository, ids[0], 1) == {ids[0]: 1792}
+    assert await _order(session) == [ids[3], ids[0], ids[1], ids[2]]
+
+
+async def test_moves_that_change_nothing(session):
+    await _add_repositories(session, [1024, 2048, 3072])
+    ids = await _order(session)
+    assert await ordering.move_to(session, Repository, ids[1], 1) == {}
+    assert await ordering.move_by(session, Repository, ids[0], -1) == {}
+    assert await ordering.move_by(session, Repository, ids[2], 5) == {}
+    assert await ordering.move_to(session, Repository, ids[2], 99) == {}
+    assert await ordering.move_to(session, Repository, 12345, 0) == {}
+
+
+async def test_scope_is_renumbered_only_without_a_gap(session):
+    await _add_repositories(session, [1, 2, 3])
+    ids = await _order(session)
+    changes = await ordering.move_to(session, Repository, ids[2], 1)
+    assert await _order(session) == [ids[0], ids[2], ids[1]]
+    assert sorted(changes.values()) == [1024, 2048, 3072]
+
+
+async def test_moves_within_a_scope(session):
+    for repository_id in (1, 2):
+        for n in range(4):
+            session.add(
+                Diagram(
+                    repository_id=repository_id,
+                    name=f"d{n}",
+                    content_digest="0" * 64,
+                    diagram_type="plantuml",
+                    category="as-is",
+                    order_index=(n + 1) * ordering.ORDER_GAP,
+                )
+            )
+    await session.commit()
+    scope = Diagram.repository_id == 1
+    ids = await _order(session, Diagram, scope)
+    other = await _order(session, Diagram, Diagram.repository_id == 2)
+
+    await ordering.move_to(session, Diagram, ids[0], 99, scope)
+    await ordering.move_by(session, Diagram, ids[3], -10, scope)
+    assert await _order(session, Diagram, scope) == [ids[3], ids[1], ids[2], ids[0]]
+    assert await _order(session, Diagram, Diagram.repository_id == 2) == other
+
+
+async def test_random_moves_match_list_semantics(session):
+    rng = random.Random(7)
+    # Tight keys force renumbering along the way
+    await _add_repositories(session, [n * 3 for n in range(12)])
+    expected = await _order(session)
+    for _ in range(300):
+        item = rng.choice(expected)
+        current = expected.index(item)
+        expected.remove(item)
+        if rng.random() < 0.5:
+            position = rng.randint(-2, 14)
+            await ordering.move_to(session, Repository, item, position)
+        else:
+            offset = rng.randint(-4, 4)
+            await ordering.move_by(session, Repository, item, offset)
+            position = current + offset
+        expected.insert(max(0, min(position, len(expected))), item)
+        assert await _order(session) == expected
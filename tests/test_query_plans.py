@@ -0,0 +1,149 @@
+"""The sidebar listing and reorder neighbour queries must use their indexes.
+
+Runs EXPLAIN against SQLite, and against Postgres as well when
+DESIGNREPO_TEST_POSTGRES_URL points at a scratch database (async URL,
+e.g. postgresql+asyncpg://...). Its tables are dropped and recreated.
+"""
+
+import json
+import os
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from designrepo import blobs, ordering, state
+from designrepo.models import Diagram, Repository
+
+POSTGRES_URL = os.environ.get("DESIGNREPO_TEST_POSTGRES_URL")
+
+
+async def _postgres_session():
+    engine = create_async_engine(POSTGRES_URL)
+    async with engine.begin() as connection:
+        # Normally created by the migrations; needed by the name trigram index
+        await connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        await connection.run_sync(SQLModel.metadata.drop_all)
+        await connection.run_sync(SQLModel.metadata.create_all)
+    return engine, AsyncSession(engine, expire_on_commit=False)
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+async def db(request, session):
+    if request.param == "sqlite":
+        yield session
+        return
+    if not POSTGRES_URL:
+        pytest.skip("DESIGNREPO_TEST_POSTGRES_URL is not set")
+    engine, pg_session = await _postgres_session()
+    async with pg_session:
+        yield pg_session
+    await engine.dispose()
+
+
+async def _populate(session):
+    # Diagrams reference their body, which Postgres enforces
+    await blobs.put(session, "")
+    for n in range(50):
+        session.add(Repository(name=f"r{n}", description="", order_index=n * 1024))
+    for repository_id in range(1, 11):
+        for n in range(20):
+            session.add(
+                Diagram(
+                    repository_id=repository_id,
+                    name=f"d{n}",
+                    content_digest=blobs.content_digest(""),
+                    diagram_type="plantuml",
+                    category="as-is",
+                    order_index=n * 1024,
+                )
+            )
+    await session.commit()
+
+
+async def _indexes(session, sql: str, params) -> set:
+    """Names of the indexes the plan of sql uses; fails on a sort step."""
+    connection = await session.connection()
+    if session.bind.dialect.name == "postgresql":
+        # The test tables are tiny, so make the planner show what it can use
+        await connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        result = await connection.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {sql}", params
+        )
+        plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        nodes, found = [plan[0]["Plan"]], set()
+        while nodes:
+            node = nodes.pop()
+            assert node["Node Type"] != "Sort", sql
+            if "Index Name" in node:
+                found.add(node["Index Name"])
+            nodes.extend(node.get("Plans", []))
+        return found
+    result = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params)
+    details = [row[-1] for row in result.all()]
+    assert not any("TEMP B-TREE" in detail for detail in details), details
+    return {
+        word
+        for detail in details
+        for word in detail.replace("(", " ").split()
+        if word.startswith(("ix_", "sqlite_autoindex"))
+    }
+
+
+def _compile(session, query):
+    compiled = query.compile(dialect=session.bind.dialect)
+    params = compiled.construct_params()
+    # Both drivers take positional parameters ($1 for asyncpg, ? for SQLite)
+    return str(compiled), tuple(params[name] for name in compiled.positiontup)
+
+
+async def test_sidebar_pages_use_order_indexes(db):
+    await _populate(db)
+    for after in (None, (5 * 1024, 6)):
+        sql, params = _compile(db, state.repositories_page(after))
+        assert await _indexes(db, sql, params) == {"ix_repository_order_index"}
+        sql, params = _compile(db, state.diagrams_page(3, after))
+        assert await _indexes(db, sql, params) == {"ix_diagram_repository_order"}
+
+
+async def _captured_selects(db, move):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    engine = db.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        await move()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return statements
+
+
+@pytest.mark.parametrize(
+    "move",
+    [
+        lambda s, m, i, scope: ordering.move_to(s, m, i, 7, scope),
+        lambda s, m, i, scope: ordering.move_to(s, m, i, 99, scope),
+        lambda s, m, i, scope: ordering.move_by(s, m, i, 1, scope),
+        lambda s, m, i, scope: ordering.move_by(s, m, i, -3, scope),
+    ],
+)
+async def test_reorder_neighbour_lookups_use_order_indexes(db, move):
+    await _populate(db)
+    cases = [
+        (Repository, None, "ix_repository_order_index"),
+        (Diagram, Diagram.repository_id == 3, "ix_diagram_repository_order"),
+    ]
+    for model, scope, index in cases:
+        item_id = 45 if model is Repository else 50
+        selects = await _captured_selects(db, lambda: move(db, model, item_id, scope))
+        # The moved row by primary key, then its neighbours
+        assert len(selects) >= 2
+        for sql, params in selects[1:]:
+            assert index in await _indexes(db, sql, params), sql
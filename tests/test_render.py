@@ -0,0 +1,257 @@
+import asyncio
+import collections
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from designrepo import api, auth, blobs, jobs, render
+from designrepo.settings import settings
+
+
+# From the PlantUML text encoding documentation
+PLANTUML_SOURCE = "Bob -> Alice : hello"
+PLANTUML_ENCODED = "SyfFKj2rKt3CoKnELR1Io4ZDoSa70000"
+
+
+def test_encode_plantuml_matches_reference():
+    assert render.encode_plantuml(PLANTUML_SOURCE) == PLANTUML_ENCODED
+    assert render.decode_plantuml(PLANTUML_ENCODED) == PLANTUML_SOURCE
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["", "a", "ab", "abc", "@startuml\nA -> B : ünïcödé ✓\n@enduml", "x" * 10_000],
+)
+def test_plantuml_encoding_round_trips(text):
+    encoded = render.encode_plantuml(text)
+    assert set(encoded) <= set(render._PLANTUML_ALPHABET)
+    assert render.decode_plantuml(encoded) == text
+
+
+def test_decode_plantuml_accepts_hex_form():
+    assert render.decode_plantuml("~h" + PLANTUML_SOURCE.encode().hex()) == (
+        PLANTUML_SOURCE
+    )
+
+
+def test_long_sources_are_referenced_by_blob_digest(monkeypatch):
+    monkeypatch.setattr(settings, "render_base_url", "")
+    content = "graph TD\n" + "".join(f"N{i} --> N{i + 1}\n" for i in range(1000))
+    url = render.render_url("mermaid", content)
+    assert url == f"/render/digest/mermaid/{blobs.content_digest(content)}"
+
+
+async def test_long_sources_are_stored_once(app_db, monkeypatch):
+    monkeypatch.setattr(render, "_stored_sources", collections.OrderedDict())
+    real_put = blobs.put
+    puts = []
+
+    async def counting_put(session, content):
+        puts.append(content)
+        return await real_put(session, content)
+
+    monkeypatch.setattr(blobs, "put", counting_put)
+    content = "graph TD\n" + "".join(f"N{i} --> N{i + 1}\n" for i in range(1000))
+    for _ in range(3):
+        await render.store_preview_source("mermaid", content)
+    assert len(puts) == 1
+
+    # Stored again before sweep could consider it an old orphan
+    digest = blobs.content_digest(content)
+    render._stored_sources[digest] -= settings.blob_orphan_ttl
+    await render.store_preview_source("mermaid", content)
+    assert len(puts) == 2
+
+
+async def test_previews_are_rendered_ahead_of_thumbnails(tmp_path, monkeypatch):
+    monkeypatch.setattr(render, "cache", render.SVGCache(str(tmp_path)))
+    monkeypatch.setattr(jobs, "renders", jobs.JobQueue(1))
+    rendered = []
+    release = asyncio.Event()
+
+    async def fake_render(content, fmt="svg"):
+        await release.wait()
+        rendered.append((content, fmt))
+        return f"<{fmt}/>".encode()
+
+    monkeypatch.setattr(render, "_render_plantuml", fake_render)
+    busy = asyncio.create_task(render.render_png("plantuml", "A"))
+    thumbnail = asyncio.create_task(render.render_png("plantuml", "B"))
+    await asyncio.sleep(0)
+    previews = [
+        asyncio.create_task(render.render_svg("plantuml", "C")) for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*previews) == [b"<svg/>"] * 3
+    assert await busy == await thumbnail == b"<png/>"
+    # The preview overtook the queued thumbnail and was rendered once
+    assert rendered == [("A", "png"), ("C", "svg"), ("B", "png")]
+    assert await render.render_svg("plantuml", "C") == b"<svg/>"
+    assert len(rendered) == 3
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/render/digest/plantuml/not-a-digest",
+        "/render/digest/plantuml/" + "A" * 64,
+        "/render/digest/drawio/" + "a" * 64,
+        "/source/" + "a" * 63,
+        "/source/..%2F..%2Fetc%2Fpasswd",
+    ],
+)
+def test_digest_routes_reject_malformed_digests(path):
+    assert TestClient(api.api).get(path).status_code == 404
+
+
+def test_plantuml_jar_runs_sandboxed(monkeypatch):
+    monkeypatch.setattr(settings, "plantuml_jar", "/opt/plantuml.jar")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-secret")
+    monkeypatch.setenv("DESIGNREPO_SESSION_SECRET", "secret")
+
+    cmd = render._plantuml_cmd("svg")
+    assert "-DPLANTUML_SECURITY_PROFILE=SANDBOX" in cmd
+    assert any(arg.startswith("-DPLANTUML_LIMIT_SIZE=") for arg in cmd)
+    assert cmd.index("-DPLANTUML_SECURITY_PROFILE=SANDBOX") < cmd.index("-jar")
+    env = render._renderer_env()
+    assert "PATH" in env
+    assert "OPENAI_API_KEY" not in env
+    assert not any(name.startswith("DESIGNREPO_") for name in env)
+
+
+# Stands in for the PlantUML jar in -pipe mode: answers each @start/@end
+# block with an image, or with an in-band error, followed by the delimiter
+FAKE_PLANTUML = r"""
+import sys, time
+delimiter = sys.argv[sys.argv.index("-pipedelimitor") + 1]
+block = []
+for line in sys.stdin:
+    block.append(line)
+    if line.startswith("@end"):
+        body = "".join(block[1:-1]).strip()
+        block = []
+        if body == "slow":
+            time.sleep(1)
+        if body == "error":
+            sys.stdout.write("ERROR\n1\nSyntax Error?\n")
+        else:
+            sys.stdout.write(f"<svg>{body}</svg>")
+        sys.stdout.write(delimiter + "\n")
+        sys.stdout.flush()
+"""
+
+
+@pytest.fixture
+async def fake_plantuml(monkeypatch):
+    started = []
+    create = asyncio.create_subprocess_exec
+
+    async def counting_exec(*cmd, **kwargs):
+        proc = await create(*cmd, **kwargs)
+        started.append(proc)
+        return proc
+
+    monkeypatch.setattr(settings, "plantuml_jar", "/opt/plantuml.jar")
+    monkeypatch.setattr(
+        render,
+        "_plantuml_cmd",
+        lambda fmt, *options: [sys.executable, "-c", FAKE_PLANTUML, *options],
+    )
+    monkeypatch.setattr(render, "_plantuml_pools", {})
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", counting_exec)
+    yield started
+    for proc in started:
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+
+
+async def test_plantuml_processes_are_reused(fake_plantuml):
+    assert await render._render_plantuml("A -> B") == b"<svg>A -> B</svg>"
+    assert await render._render_plantuml("@startuml\nC -> D\n@enduml") == (
+        b"<svg>C -> D</svg>"
+    )
+    with pytest.raises(render.RenderError, match="Syntax Error"):
+        await render._render_plantuml("error")
+    assert await render._render_plantuml("E -> F") == b"<svg>E -> F</svg>"
+    assert len(fake_plantuml) == 1
+
+
+async def test_cancelled_plantuml_render_does_not_answer_the_next(fake_plantuml):
+    task = asyncio.create_task(render._render_plantuml("slow"))
+    await asyncio.sleep(0.5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await render._render_plantuml("A -> B") == b"<svg>A -> B</svg>"
+    assert len(fake_plantuml) == 2
+
+
+async def test_several_plantuml_diagrams_render_in_their_own_process(
+    fake_plantuml, monkeypatch
+):
+    calls = []
+
+    async def fake_run(cmd, stdin=None):
+        calls.append(cmd)
+        return b"<svg/>"
+
+    monkeypatch.setattr(render, "_run", fake_run)
+    source = "@startuml\nA -> B\n@enduml\n@startuml\nC -> D\n@enduml"
+    assert await render._render_plantuml(source) == b"<svg/>"
+    assert len(calls) == 1
+    assert "-pipedelimitor" not in calls[0]
+    assert not fake_plantuml
+
+
+def test_rendered_svg_cannot_run_script(monkeypatch):
+    async def fake_render(diagram_type, content):
+        return b"<svg><script>alert(1)</script></svg>"
+
+    monkeypatch.setattr(render, "render_svg", fake_render)
+    client = TestClient(api.api)
+    encoded = render.encode_source("plantuml", "Bob -> Alice : hello")
+    resp = client.get(f"/render/plantuml/{encoded}")
+    assert resp.status_code == 200
+    assert resp.headers["content-security-policy"] == (
+        "default-src 'none'; style-src 'unsafe-inline'"
+    )
+    assert resp.headers["x-content-type-options"] == "nosniff"
+
+    resp = client.get(
+        f"/render/plantuml/{encoded}", headers={"If-None-Match": resp.headers["etag"]}
+    )
+    assert resp.status_code == 304
+    assert resp.headers["x-content-type-options"] == "nosniff"
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/render/plantuml/SyfFKj2rKt3CoKnELR1Io4ZDoSa70000",
+        f"/render/digest/plantuml/{'0' * 64}",
+        f"/thumbnail/plantuml/{'0' * 64}",
+    ],
+)
+def test_diagram_routes_require_a_session(monkeypatch, path):
+    monkeypatch.setattr(settings, "oidc_issuer", "https://idp.example.com")
+    monkeypatch.setattr(settings, "session_secret", "secret")
+    assert TestClient(api.api).get(path).status_code == 401
+
+
+def test_diagram_routes_accept_the_session_cookie(monkeypatch):
+    async def fake_render(diagram_type, content):
+        return b"<svg/>"
+
+    monkeypatch.setattr(settings, "oidc_issuer", "https://idp.example.com")
+    monkeypatch.setattr(settings, "session_secret", "secret")
+    monkeypatch.setattr(render, "render_svg", fake_render)
+    client = TestClient(api.api)
+    client.cookies.set(auth.SESSION_COOKIE, auth.issue_session_token({"sub": "a"}))
+    encoded = render.encode_source("plantuml", "Bob -> Alice : hello")
+    resp = client.get(f"/render/plantuml/{encoded}")
+    assert resp.status_code == 200
+    assert resp.headers["cache-control"].startswith("private")
@@ -0,0 +1,130 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from designrepo import search
+from designrepo.models import Repository
+
+DRAWIO = (
+    '<mxfile><diagram name="Overview"><mxGraphModel><root>'
+    '<mxCell id="0"/><mxCell id="2" value="&lt;b&gt;Billing&lt;/b&gt; API"/>'
+    '<UserObject label="Ledger &amp;amp; audit"/>'
+    "</root></mxGraphModel></diagram></mxfile>"
+)
+PLANTUML = (
+    "@startuml\nskinparam monochrome true\n' not searchable\n"
+    "actor Customer\nCustomer -> OrderService : place order\n@enduml"
+)
+
+
+def _migration():
+    path = next(
+        Path(__file__)
+        .parent.parent.joinpath("alembic", "versions")
+        .glob("d4a8e1f63b27_*.py")
+    )
+    spec = importlib.util.spec_from_file_location("d4a8e1f63b27", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_drawio_labels_are_cell_values_without_markup():
+    assert (
+        search.extract_labels("drawio", DRAWIO) == "Overview Billing API Ledger & audit"
+    )
+
+
+def test_plantuml_labels_skip_directives_and_comments():
+    assert search.extract_labels("plantuml", PLANTUML) == (
+        "actor Customer Customer OrderService place order"
+    )
+
+
+def test_malformed_drawio_falls_back_to_words():
+    assert search.extract_labels("drawio", "<mxfile><cell") == "mxfile cell"
+
+
+@pytest.mark.parametrize(
+    "diagram_type, content",
+    [("drawio", DRAWIO), ("plantuml", PLANTUML), ("drawio", "<broken")],
+)
+def test_migration_copy_matches_search(diagram_type, content):
+    # The migration indexed existing diagrams with a frozen copy; if search
+    # changes, those rows need a new migration to be reindexed
+    migration = _migration()
+    assert migration.VECTOR_SQL == search.vector_sql()
+    assert migration.MAX_DOCUMENT_LENGTH == search.MAX_DOCUMENT_LENGTH
+    assert migration._document(diagram_type, content, "notes") == search.document(
+        diagram_type, content, "notes"
+    )
+
+
+async def _index(session, diagrams):
+    session.add(Repository(name="Payments", description="", order_index=0))
+    await session.commit()
+    for diagram_id, (name, diagram_type, content) in enumerate(diagrams, start=1):
+        await search.index_diagram(
+            session, diagram_id, 1, name, diagram_type, content, notes=""
+        )
+    await session.commit()
+
+
+async def test_labels_are_found_and_name_matches_rank_first(session):
+    await _index(
+        session,
+        [
+            ("Invoices", "drawio", DRAWIO),
+            ("Checkout", "plantuml", PLANTUML),
+            ("Billing flow", "plantuml", "A -> B"),
+        ],
+    )
+    rows = await search.search(session, "billing")
+    assert [row.name for row in rows] == ["Billing flow", "Invoices"]
+    assert rows[0].repository_name == "Payments"
+
+    rows = await search.search(session, "orderservice")
+    assert [row.diagram_id for row in rows] == [2]
+    # Every term has to match somewhere
+    assert await search.search(session, "customer ledger") == []
+    assert await search.search(session, "   ") == []
+
+
+async def test_like_fallback_matches_partial_words_literally(session):
+    await _index(
+        session,
+        [("Ledger 50% off", "plantuml", "A"), ("Ledger 500", "plantuml", "A")],
+    )
+    rows = await search.search(session, "LEDG")
+    assert [row.name for row in rows] == ["Ledger 50% off", "Ledger 500"]
+    # LIKE wildcards in the query match only themselves
+    for query in ("50%", "%", "50_"):
+        rows = await search.search(session, query)
+        assert [row.name for row in rows] == (
+            ["Ledger 50% off"] if "%" in query else []
+        )
+
+
+async def test_reindexing_and_renaming_replace_the_row(session):
+    await _index(session, [("Old", "plantuml", "Alpha")])
+    await search.index_diagram(session, 1, 1, "Old", "plantuml", "Beta", notes="")
+    await search.rename_diagram(session, 1, "New")
+    await session.commit()
+    assert await search.search(session, "alpha") == []
+    assert [row.name for row in await search.search(session, "beta")] == ["New"]
+
+
+async def test_results_are_paginated_in_a_stable_order(session):
+    await _index(
+        session, [(f"Diagram {n % 3}", "plantuml", "shared") for n in range(7)]
+    )
+    pages = [
+        await search.search(session, "shared", limit=3, offset=offset)
+        for offset in (0, 3, 6)
+    ]
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [row.diagram_id for page in pages for row in page]
+    assert sorted(ids) == list(range(1, 8))
+    keys = [(row.name, row.diagram_id) for page in pages for row in page]
+    assert keys == sorted(keys)
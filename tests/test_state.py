@@ -0,0 +1,67 @@
+from designrepo.state import RepositorySchema, reordered, sort_key, upserted
+
+
+def _page(*keys):
+    return [
+        RepositorySchema(id=id, name=f"r{id}", order_index=order_index)
+        for order_index, id in keys
+    ]
+
+
+def _keys(items):
+    keys = [sort_key(item) for item in items]
+    # Sorted by (order_index, id), each row once
+    assert keys == sorted(keys)
+    assert len({id for _, id in keys}) == len(keys)
+    return keys
+
+
+# First page of a longer list
+PAGE = _page((1024, 1), (2048, 2), (3072, 3))
+
+
+def test_upserted_item_after_a_partial_page_is_left_for_a_later_page():
+    items = upserted(PAGE, RepositorySchema(id=9, order_index=9000), complete=False)
+    assert _keys(items) == [(1024, 1), (2048, 2), (3072, 3)]
+
+    # In a complete list it is appended
+    items = upserted(PAGE, RepositorySchema(id=9, order_index=9000), complete=True)
+    assert _keys(items) == [(1024, 1), (2048, 2), (3072, 3), (9000, 9)]
+
+
+def test_upserted_item_inside_a_partial_page_is_placed_in_order():
+    items = upserted(PAGE, RepositorySchema(id=9, order_index=1500), complete=False)
+    assert _keys(items) == [(1024, 1), (1500, 9), (2048, 2), (3072, 3)]
+
+
+def test_upserted_item_replaces_its_loaded_row():
+    items = upserted(
+        PAGE, RepositorySchema(id=2, name="renamed", order_index=500), complete=False
+    )
+    assert _keys(items) == [(500, 2), (1024, 1), (3072, 3)]
+    assert items[0].name == "renamed"
+
+    # Moved past the loaded rows, it drops out until that page is loaded
+    items = upserted(PAGE, RepositorySchema(id=2, order_index=9000), complete=False)
+    assert _keys(items) == [(1024, 1), (3072, 3)]
+
+
+def test_reordered_rows_are_resorted():
+    items = reordered(PAGE, {3: 1536}, complete=False)
+    assert _keys(items) == [(1024, 1), (1536, 3), (2048, 2)]
+    # The input list is left alone
+    assert _keys(PAGE) == [(1024, 1), (2048, 2), (3072, 3)]
+
+    items = reordered(PAGE, {1: 9000}, complete=False)
+    assert _keys(items) == [(2048, 2), (3072, 3)]
+    items = reordered(PAGE, {1: 9000}, complete=True)
+    assert _keys(items) == [(2048, 2), (3072, 3), (9000, 1)]
+
+
+def test_reordered_rows_from_later_pages():
+    # Still after the loaded rows: nothing to show
+    items = reordered(PAGE, {9: 8000}, complete=False)
+    assert _keys(items) == [(1024, 1), (2048, 2), (3072, 3)]
+    # Moved into the loaded rows: its data is not loaded, so reload
+    assert reordered(PAGE, {9: 1500}, complete=False) is None
+    assert reordered(PAGE, {}, complete=False) is PAGE
@@ -0,0 +1,204 @@
+"""Delivery of change notifications to the sessions they concern.
+
+The dispatcher runs against stub app sessions here. The LISTEN/NOTIFY
+round trip is tested as well when DESIGNREPO_TEST_POSTGRES_URL points at a
+scratch database (see tests/test_query_plans.py).
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+from types import SimpleNamespace
+
+import asyncpg
+import pytest
+from sqlalchemy.engine import make_url
+
+from designrepo import listing, sync
+from designrepo.settings import settings
+from designrepo.state import DiagramSummarySchema, RepositorySchema, State
+
+POSTGRES_URL = os.environ.get("DESIGNREPO_TEST_POSTGRES_URL")
+
+
+class StubState:
+    """The parts of State that changes are applied to."""
+
+    _apply_change = State._apply_change
+    _reorder_repositories = State._reorder_repositories
+    _reorder_diagrams = State._reorder_diagrams
+
+    def __init__(self, repository_id=None):
+        self.repositories = [
+            RepositorySchema(id=1, name="r1", order_index=1024),
+            RepositorySchema(id=2, name="r2", order_index=2048),
+        ]
+        self.has_more_repositories = False
+        self.current_repository = (
+            RepositorySchema(id=repository_id) if repository_id else None
+        )
+        self.diagrams = [
+            DiagramSummarySchema(id=1, name="d1", order_index=1024),
+            DiagramSummarySchema(id=2, name="d2", order_index=2048),
+        ]
+        self.has_more_diagrams = False
+        self.current_diagram = None
+        self.is_editing = False
+        self.handled = []
+
+    async def load_repositories(self):
+        self.handled.append("load_repositories")
+
+    async def load_diagrams(self):
+        self.handled.append("load_diagrams")
+
+    async def select_diagram(self, summary):
+        self.handled.append(("select_diagram", summary.id))
+
+
+class StubApp:
+    """Connected sessions of a Reflex app, each with a StubState."""
+
+    def __init__(self):
+        self.states = {}
+        self.broken = set()
+        self.event_namespace = SimpleNamespace(token_to_sid={})
+
+    def connect(self, token, repository_id=None):
+        self.states[token] = StubState(repository_id)
+        self.event_namespace.token_to_sid[token] = f"sid-{token}"
+        sync.watch(token, repository_id)
+        return self.states[token]
+
+    @contextlib.asynccontextmanager
+    async def modify_state(self, key):
+        token = key.split("_")[0]
+        if token in self.broken:
+            raise RuntimeError("state is gone")
+        state = self.states[token]
+
+        async def get_state(cls):
+            assert cls is State
+            return state
+
+        yield SimpleNamespace(get_state=get_state)
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = StubApp()
+    monkeypatch.setattr(sync, "_app", app)
+    monkeypatch.setattr(sync, "_sessions", {})
+    return app
+
+
+async def _notify(change):
+    """Deliver change as the LISTEN connection would, and wait for it."""
+    sync._on_notify(None, 0, sync.CHANNEL, json.dumps(change))
+    await asyncio.gather(*sync._tasks)
+
+
+def _change(kind, repository_id=None, origin="a", item=None, moves=None):
+    return {
+        "kind": kind,
+        "repository_id": repository_id,
+        "origin": origin,
+        "item": item,
+        "moves": moves,
+    }
+
+
+async def test_repository_change_reaches_every_other_session(app):
+    origin = app.connect("a")
+    other = app.connect("b", repository_id=7)
+    item = {"id": 3, "name": "r3", "description": "", "order_index": 1536}
+    await _notify(_change("repository", item=item))
+    assert [r.id for r in other.repositories] == [1, 3, 2]
+    assert [r.id for r in origin.repositories] == [1, 2]
+
+
+async def test_diagram_change_reaches_only_sessions_viewing_its_repository(app):
+    viewing = app.connect("b", repository_id=7)
+    elsewhere = app.connect("c", repository_id=8)
+    viewing.current_diagram = viewing.diagrams[1]
+    item = {"id": 2, "name": "renamed", "order_index": 2048}
+    await _notify(_change("diagram", repository_id=7, item=item))
+    assert viewing.diagrams[1].name == "renamed"
+    assert viewing.handled == [("select_diagram", 2)]
+    assert elsewhere.diagrams[1].name == "d2"
+    assert elsewhere.handled == []
+
+
+async def test_moves_reorder_and_bare_changes_reload(app):
+    state = app.connect("b", repository_id=7)
+    # Row ids arrive as JSON object keys, i.e. strings
+    await _notify(_change("diagram", repository_id=7, moves={1: 4096}))
+    assert [d.id for d in state.diagrams] == [2, 1]
+    await _notify(_change("repository", moves={2: 512}))
+    assert [r.id for r in state.repositories] == [2, 1]
+    assert state.handled == []
+
+    await _notify(_change("diagram", repository_id=7))
+    await _notify(_change("repository"))
+    assert state.handled == ["load_diagrams", "load_repositories"]
+
+
+async def test_gone_and_broken_sessions_are_dropped(app):
+    app.connect("b")
+    app.connect("c")
+    healthy = app.connect("d")
+    del app.event_namespace.token_to_sid["b"]
+    app.broken.add("c")
+    await _notify(_change("repository"))
+    assert healthy.handled == ["load_repositories"]
+    assert set(sync._sessions) == {"d"}
+
+
+async def test_changes_invalidate_the_shared_listings(app, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(
+        listing.repositories, "invalidate", lambda key=None: invalidated.append(key)
+    )
+    monkeypatch.setattr(
+        listing.diagrams, "invalidate", lambda key=None: invalidated.append(key)
+    )
+    await _notify(_change("repository"))
+    await _notify(_change("diagram", repository_id=7))
+    assert invalidated == [None, 7]
+
+
+async def test_unparsable_notifications_are_ignored(app):
+    state = app.connect("b")
+    sync._on_notify(None, 0, sync.CHANNEL, "not json")
+    await asyncio.gather(*sync._tasks)
+    assert state.handled == []
+
+
+async def test_changes_are_delivered_through_postgres(app, monkeypatch):
+    if not POSTGRES_URL:
+        pytest.skip("DESIGNREPO_TEST_POSTGRES_URL is not set")
+    monkeypatch.setattr(settings, "async_db_url", POSTGRES_URL)
+    monkeypatch.setattr(settings, "sync_reconnect_seconds", 0.1)
+    state = app.connect("b")
+    listener = asyncio.create_task(sync.listen(app))
+    dsn = make_url(POSTGRES_URL).set(drivername="postgresql")
+    connection = await asyncpg.connect(dsn.render_as_string(hide_password=False))
+    try:
+        for _ in range(50):
+            # The LISTEN may not be registered yet; notify until it is
+            await connection.execute(
+                "SELECT pg_notify($1, $2)",
+                sync.CHANNEL,
+                json.dumps(_change("repository")),
+            )
+            await asyncio.sleep(0.1)
+            if state.handled:
+                break
+        await asyncio.gather(*sync._tasks)
+        assert "load_repositories" in state.handled
+    finally:
+        await connection.close()
+        listener.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await listener
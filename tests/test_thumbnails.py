@@ -0,0 +1,90 @@
+import io
+import os
+import time
+
+import httpx
+import pytest
+import reflex as rx
+from PIL import Image
+
+from designrepo import api, blobs, jobs, render, thumbnails
+from designrepo.settings import settings
+
+SOURCE = "@startuml\nA -> B\n@enduml"
+DIGEST = blobs.content_digest(SOURCE)
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    cache = render.SVGCache(str(tmp_path))
+    monkeypatch.setattr(render, "cache", cache)
+    monkeypatch.setattr(jobs, "thumbnails", jobs.JobQueue(1))
+    return cache
+
+
+async def _schedule_and_wait():
+    thumbnails.schedule("plantuml", SOURCE, DIGEST)
+    job = jobs.thumbnails.get(
+        ("thumbnail", thumbnails.thumbnail_key("plantuml", DIGEST))
+    )
+    if job is not None:
+        await job.result()
+    return job
+
+
+async def test_thumbnail_is_downscaled_to_webp(monkeypatch):
+    async def fake_png(diagram_type, content):
+        out = io.BytesIO()
+        Image.new("RGB", (1600, 900), "white").save(out, "PNG")
+        return out.getvalue()
+
+    monkeypatch.setattr(render, "render_png", fake_png)
+    await _schedule_and_wait()
+    data, fmt = thumbnails.get("plantuml", DIGEST)
+    assert fmt == "webp"
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.width == settings.thumbnail_width
+
+
+async def test_failed_render_is_recorded_and_retried_later(monkeypatch, cache):
+    calls = 0
+
+    async def broken_png(diagram_type, content):
+        nonlocal calls
+        calls += 1
+        raise render.RenderError("Syntax error")
+
+    monkeypatch.setattr(render, "render_png", broken_png)
+    assert await _schedule_and_wait() is not None
+    assert thumbnails.get("plantuml", DIGEST) == (thumbnails.PLACEHOLDER_SVG, "svg")
+
+    # Viewing the diagram again does not render it again
+    assert await _schedule_and_wait() is None
+    assert calls == 1
+
+    key = thumbnails.thumbnail_key("plantuml", DIGEST)
+    old = time.time() - settings.thumbnail_retry_seconds - 1
+    os.utime(cache._path(key, "svg"), (old, old))
+    assert thumbnails.get("plantuml", DIGEST) is None
+    await _schedule_and_wait()
+    assert calls == 2
+
+
+async def test_blank_diagrams_get_no_thumbnail(app_db, monkeypatch):
+    monkeypatch.setattr(settings, "render_base_url", "")
+    assert thumbnails.thumbnail_url("plantuml", blobs.content_digest("")) == ""
+    assert (
+        thumbnails.thumbnail_url("plantuml", DIGEST) == f"/thumbnail/plantuml/{DIGEST}"
+    )
+
+    # Whitespace-only bodies still have a URL; their placeholder is cached
+    async with rx.asession() as session:
+        digest = await blobs.put(session, "  \n")
+        await session.commit()
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=api.api), base_url="http://test"
+    ) as client:
+        resp = await client.get(f"/thumbnail/plantuml/{digest}")
+    assert resp.content == thumbnails.PLACEHOLDER_SVG
+    assert "immutable" in resp.headers["cache-control"]
+    assert jobs.thumbnails.get(("thumbnail", f"{digest}.plantuml")) is None